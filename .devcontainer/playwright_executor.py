@@ -3,17 +3,131 @@ from playwright.async_api import async_playwright
 import argparse
 from datetime import datetime
 import os
+import re
 import json
 from pathlib import Path
 import tempfile
 import base64
+import importlib.util
+import sys
+import time
+import uuid
+
+SCREENSHOT_OPTIONS = {"full_page": True, "type": "jpeg", "quality": 50}
+
+
+def _new_result():
+    return {
+        "status": "success",
+        "data": {
+            "screenshots": [],
+            "console_logs": [],
+            "error": None,
+            "output": None
+        }
+    }
+
+
+def _build_test_script(script: str) -> str:
+    # Decode script if base64 encoded
+    if script.startswith('base64:'):
+        script = base64.b64decode(script[7:]).decode('utf-8')
+
+    # Add proper indentation to the script
+    indented_script = ""
+    for line in script.split('\n'):
+        if line.strip():
+            indented_script += "    " + line + "\n"
+        else:
+            indented_script += "\n"
+
+    # Create test script with proper indentation
+    return f"""async def run_test(page, output_dir):
+{indented_script}"""
+
+
+def _load_test_module(test_script: str, run_dir: Path):
+    # Write the test script to a file for debugging
+    with open(run_dir / "test_script.py", "w") as f:
+        f.write(test_script)
+
+    # Save script to temp file for execution
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
+        f.write(test_script)
+        script_path = f.name
+
+    try:
+        # Unique module names keep concurrently loaded scripts apart
+        spec = importlib.util.spec_from_file_location(f"dynamic_script_{uuid.uuid4().hex}", script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.unlink(script_path)
+    return module
+
+
+async def _save_screenshot(page, paths):
+    """Capture the page once and write every copy off the event loop"""
+    data = await page.screenshot(**SCREENSHOT_OPTIONS)
+
+    def write():
+        for path in paths:
+            Path(path).write_bytes(data)
+
+    await asyncio.to_thread(write)
+
+
+async def _run_in_page(page, url: str, script: str, run_dir: Path, screenshot_path: Path, capture_logs: bool,
+                       result: dict, label: str):
+    """Navigate, run the script and collect screenshots and console logs into ``result``"""
+    # Store console logs if requested
+    console_logs = []
+    if capture_logs:
+        page.on("console", lambda msg: console_logs.append(f"{msg.type}: {msg.text}"))
+
+    try:
+        # Navigate to URL first
+        await page.goto(url, wait_until="networkidle", timeout=30000)
+
+        # Import and execute the script
+        module = _load_test_module(_build_test_script(script), run_dir)
+        output = await module.run_test(page, str(run_dir))
+        if output is not None:
+            result["data"]["output"] = output
+
+        # Take a screenshot if none were taken
+        screenshot_files = [f for pattern in ("*.png", "*.jpg", "*.jpeg") for f in run_dir.glob(pattern)]
+        if not screenshot_files:
+            final_screenshot = run_dir / f"final_{label}.png"
+            await _save_screenshot(page, [final_screenshot, screenshot_path])
+            result["data"]["screenshots"].append(str(final_screenshot))
+        else:
+            result["data"]["screenshots"].extend(str(f) for f in screenshot_files)
+
+        # Save console logs if captured
+        if capture_logs and console_logs:
+            log_path = run_dir / f"console_{label}.log"
+            with open(log_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(console_logs))
+            result["data"]["console_logs"].append(str(log_path))
+
+    except Exception as e:
+        result["status"] = "error"
+        result["data"]["error"] = f"Script error: {str(e)}"
+        error_screenshot = run_dir / f"error_{label}.png"
+        try:
+            await _save_screenshot(page, [error_screenshot, screenshot_path])
+            result["data"]["screenshots"].append(str(error_screenshot))
+        except Exception:
+            pass  # The page or its browser is gone
+
 
 async def execute_playwright_script(url: str, script: str, output_dir: str = ".screenshots", capture_logs: bool = False):
     """
     Executes a Playwright script and captures outputs.
     """
     # Create output directory
-    
+
     automation_output_dir = 'automation_output'
 
     os.makedirs(output_dir, exist_ok=True)
@@ -25,147 +139,252 @@ async def execute_playwright_script(url: str, script: str, output_dir: str = ".s
 
     screenshot_dir = Path(output_dir)
     screenshot_dir.mkdir(exist_ok=True)
-    
-    result = {
-        "status": "success",
-        "data": {
-            "screenshots": [],
-            "console_logs": [],
-            "error": None,
-            "output": None
-        }
-    }
+
+    result = _new_result()
+    started = time.perf_counter()
 
     try:
         async with async_playwright() as p:
             browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context()
-            page = await context.new_page()
-            
-            # Store console logs if requested
-            console_logs = []
-            if capture_logs:
-                page.on("console", lambda msg: console_logs.append(f"{msg.type}: {msg.text}"))
-            
             try:
-                # Navigate to URL first
-                await page.goto(url, wait_until="networkidle", timeout=30000)
-                
-                # Decode script if base64 encoded
-                if script.startswith('base64:'):
-                    script = base64.b64decode(script[7:]).decode('utf-8')
-                
-                # Add proper indentation to the script
-                indented_script = ""
-                for line in script.split('\n'):
-                    if line.strip():
-                        indented_script += "    " + line + "\n"
-                    else:
-                        indented_script += "\n"
-                
-                # Create test script with proper indentation
-                test_script = f"""async def run_test(page, output_dir):
-{indented_script}"""
-
-                # Write the test script to a file for debugging
-                test_script_path = run_dir / "test_script.py"
-                with open(test_script_path, "w") as f:
-                    f.write(test_script)
-
-                # Save script to temp file for execution
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                    f.write(test_script)
-                    script_path = f.name
-
-                # Import and execute the script
-                import importlib.util
-                spec = importlib.util.spec_from_file_location("dynamic_script", script_path)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
-                # Run the test
-                output = await module.run_test(page, str(run_dir))
-                if output is not None:
-                    result["data"]["output"] = output
-                
-                # Take a screenshot if none were taken
-                screenshot_files = list(run_dir.glob('*.{png,jpg,jpeg}'))
-                if not screenshot_files:
-                    final_screenshot = run_dir / f"final_{timestamp}.png"
-                    await page.screenshot(
-                        path=str(final_screenshot),
-                        full_page=True,
-                        type="jpeg",
-                        quality = 50
-                    )
-                    result["data"]["screenshots"].append(str(final_screenshot))
-
-                    # Save additional screenshot to .screenshot folder
-                    await page.screenshot(
-                        path=str(screenshot_dir / "screenshot.jpeg"),
-                        full_page=True,
-                        type="jpeg",
-                        quality = 50
-                    )
-                else:
-                    result["data"]["screenshots"].extend(str(f) for f in screenshot_files)
-
-                # Save console logs if captured
-                if capture_logs and console_logs:
-                    log_path = run_dir / f"console_{timestamp}.log"
-                    with open(log_path, "w", encoding="utf-8") as f:
-                        f.write("\n".join(console_logs))
-                    result["data"]["console_logs"].append(str(log_path))
-
-            except Exception as e:
-                result["status"] = "error"
-                result["data"]["error"] = f"Script error: {str(e)}"
-                error_screenshot = run_dir / f"error_{timestamp}.png"
-                await page.screenshot(
-                        path=str(error_screenshot),
-                        full_page=True,
-                        type="jpeg",
-                        quality = 50
-                    )
-                result["data"]["screenshots"].append(str(error_screenshot))
-
-                # Save additional screenshot to .screenshot folder
-                await page.screenshot(
-                        path=str(screenshot_dir / "screenshot.jpeg"),
-                        full_page=True,
-                        type="jpeg",
-                        quality = 50
-                    )
-            
+                context = await browser.new_context()
+                page = await context.new_page()
+                await _run_in_page(
+                    page, url, script, run_dir, screenshot_dir / "screenshot.jpeg", capture_logs, result, timestamp
+                )
             finally:
-                if os.path.exists(script_path):
-                    os.unlink(script_path)
                 await browser.close()
 
     except Exception as e:
         result["status"] = "error"
         result["data"]["error"] = f"Setup error: {str(e)}"
 
+    result["data"]["timing"] = {"total_ms": round((time.perf_counter() - started) * 1000, 1)}
     return result
 
+
+class BrowserPool:
+    """
+    Warm headless Chromium instances shared by concurrent scripts.
+
+    Every script runs in its own browser context, so scripts on the same
+    browser do not share cookies or storage. Scripts go to the least busy
+    browser; a browser that has crashed is replaced on the next acquire.
+    """
+
+    def __init__(self, playwright, size: int = 2):
+        self._playwright = playwright
+        self.size = size
+        self.launches = 0
+        self._browsers = []
+        self._active = {}  # id(browser) -> running scripts
+        self._lock = asyncio.Lock()
+
+    async def _launch(self):
+        self.launches += 1
+        return await self._playwright.chromium.launch(headless=True)
+
+    async def start(self):
+        self._browsers = list(await asyncio.gather(*(self._launch() for _ in range(self.size))))
+
+    async def acquire(self):
+        async with self._lock:
+            for index, browser in enumerate(self._browsers):
+                if not browser.is_connected():
+                    self._browsers[index] = await self._launch()
+            browser = min(self._browsers, key=lambda b: self._active.get(id(b), 0))
+            self._active[id(browser)] = self._active.get(id(browser), 0) + 1
+            return browser
+
+    def release(self, browser):
+        self._active[id(browser)] -= 1
+        if not self._active[id(browser)]:
+            del self._active[id(browser)]
+
+    async def close(self):
+        await asyncio.gather(*(browser.close() for browser in self._browsers), return_exceptions=True)
+
+
+async def execute_playwright_scripts(url: str, scripts, output_dir: str = ".screenshots", capture_logs: bool = False,
+                                     parallel: int = 4, browsers: int = 2, retries: int = 1, timeout: float = 120):
+    """
+    Executes many Playwright scripts concurrently on a pool of warm browsers.
+
+    ``scripts`` holds script strings or {"name", "script", "url"} dicts.
+    Results are yielded as each script finishes, each with its name and
+    timing. A script whose browser crashed is retried on a fresh browser up
+    to ``retries`` times; other failures are reported as they are.
+    """
+    if parallel < 1 or browsers < 1 or retries < 0:
+        raise ValueError("parallel and browsers must be at least 1 and retries at least 0")
+    automation_output_dir = 'automation_output'
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    batch_dir = Path(automation_output_dir) / f"batch_{timestamp}"
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    screenshot_dir = Path(output_dir)
+
+    jobs = []
+    for index, job in enumerate(scripts):
+        job = {"script": job} if isinstance(job, str) else dict(job)
+        job["name"] = re.sub(r"[^A-Za-z0-9_.-]", "_", str(job.get("name") or f"script_{index + 1}"))
+        job.setdefault("url", url)
+        jobs.append(job)
+
+    if not jobs:
+        return
+
+    results = asyncio.Queue()
+    slots = asyncio.Semaphore(parallel)
+
+    async def run(index, job):
+        queued = time.perf_counter()
+        result = _new_result()
+        attempts = 0
+        async with slots:
+            started = time.perf_counter()
+            while attempts <= retries:
+                attempts += 1
+                result = _new_result()
+                run_dir = batch_dir / f"{index + 1:03d}_{job['name']}" / f"attempt_{attempts}"
+                run_dir.mkdir(parents=True, exist_ok=True)
+                browser = await pool.acquire()
+                context = None
+                try:
+                    context = await browser.new_context()
+                    page = await context.new_page()
+                    await asyncio.wait_for(_run_in_page(
+                        page, job["url"], job["script"], run_dir,
+                        screenshot_dir / f"screenshot_{index + 1:03d}_{job['name']}.jpeg", capture_logs, result, job["name"]
+                    ), timeout)
+                except asyncio.TimeoutError:
+                    result["status"] = "error"
+                    result["data"]["error"] = f"Script error: timed out after {timeout:g}s"
+                except Exception as e:
+                    result["status"] = "error"
+                    result["data"]["error"] = f"Setup error: {str(e)}"
+                finally:
+                    crashed = not browser.is_connected()
+                    if context is not None and not crashed:
+                        try:
+                            await context.close()
+                        except Exception:
+                            pass
+                    pool.release(browser)
+                if not crashed:
+                    break
+                result["status"] = "error"
+                result["data"]["error"] = f"Browser crashed: {result['data']['error']}"
+        finished = time.perf_counter()
+        result["name"] = job["name"]
+        result["data"]["timing"] = {
+            "queued_ms": round((started - queued) * 1000, 1),
+            "run_ms": round((finished - started) * 1000, 1),
+            "attempts": attempts,
+        }
+        return result
+
+    async def run_and_report(index, job):
+        try:
+            result = await run(index, job)
+        except Exception as e:
+            result = _new_result()
+            result["status"] = "error"
+            result["name"] = job["name"]
+            result["data"]["error"] = f"Setup error: {str(e)}"
+        await results.put(result)
+
+    async with async_playwright() as p:
+        pool = BrowserPool(p, max(1, min(browsers, parallel, len(jobs))))
+        try:
+            await pool.start()
+        except Exception as e:
+            await pool.close()
+            for job in jobs:
+                result = _new_result()
+                result["status"] = "error"
+                result["name"] = job["name"]
+                result["data"]["error"] = f"Setup error: {str(e)}"
+                yield result
+            return
+
+        tasks = [asyncio.create_task(run_and_report(index, job)) for index, job in enumerate(jobs)]
+        try:
+            for _ in tasks:
+                yield await results.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await pool.close()
+
+
+async def _print_batch(url, scripts, output_dir, capture_logs, parallel, browsers, retries, timeout):
+    """Print one JSON line per script as it finishes, then a summary line"""
+    started = time.perf_counter()
+    results = []
+    async for result in execute_playwright_scripts(
+        url, scripts, output_dir, capture_logs, parallel, browsers, retries, timeout
+    ):
+        results.append(result)
+        print(json.dumps(result), flush=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    script_ms = sum(result["data"].get("timing", {}).get("run_ms", 0) for result in results)
+    print(json.dumps({"summary": {
+        "scripts": len(results),
+        "succeeded": sum(result["status"] == "success" for result in results),
+        "failed": sum(result["status"] != "success" for result in results),
+        "wall_ms": round(wall_ms, 1),
+        "script_ms": round(script_ms, 1),
+        "slowest": sorted(
+            ({"name": result["name"], "run_ms": result["data"]["timing"]["run_ms"]}
+             for result in results if "timing" in result["data"]),
+            key=lambda entry: -entry["run_ms"]
+        )[:5],
+    }}), flush=True)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Execute Playwright automation script")
     parser.add_argument("url", help="URL to automate")
-    parser.add_argument("--script", required=True, help="Playwright script to execute (plain text or base64 encoded with 'base64:' prefix)")
+    parser.add_argument("--script", help="Playwright script to execute (plain text or base64 encoded with 'base64:' prefix)")
+    parser.add_argument("--batch", help="JSON file ('-' for stdin) with a list of scripts or "
+                                        "{name, script, url} objects to run concurrently")
     parser.add_argument("--output", "-o", default=".screenshots",
                         help="Output directory for screenshots and logs")
     parser.add_argument("--capture-logs", action="store_true", help="Capture console logs")
-    
+    parser.add_argument("--parallel", type=int, default=4, help="Maximum scripts running at once (batch mode)")
+    parser.add_argument("--browsers", type=int, default=2, help="Warm browser instances to share (batch mode)")
+    parser.add_argument("--retries", type=int, default=1, help="Retries for scripts whose browser crashed (batch mode)")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-script timeout in seconds (batch mode)")
+
     args = parser.parse_args()
-    
+    if bool(args.script) == bool(args.batch):
+        parser.error("pass exactly one of --script or --batch")
+    if args.parallel < 1 or args.browsers < 1:
+        parser.error("--parallel and --browsers must be at least 1")
+    if args.retries < 0:
+        parser.error("--retries must not be negative")
+    if args.timeout <= 0:
+        parser.error("--timeout must be positive")
+
+    if args.batch:
+        with (sys.stdin if args.batch == "-" else open(args.batch)) as f:
+            scripts = json.load(f)
+        asyncio.run(_print_batch(
+            args.url, scripts, args.output, args.capture_logs,
+            args.parallel, args.browsers, args.retries, args.timeout
+        ))
+        return
+
     result = asyncio.run(execute_playwright_script(
         args.url,
         args.script,
         args.output,
         args.capture_logs
     ))
-    
+
     print(json.dumps(result))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,286 @@
+"""Microbenchmarks for backend hot paths.
+
+Each benchmark runs at several data scales against either an in-memory
+mongomock-motor stand-in (the default) or a local mongod, in a separate
+database that is dropped afterwards. Results are compared with a JSON
+baseline; a benchmark whose median is slower than its baseline by more than
+the threshold is reported as a regression and the run exits non-zero.
+
+    python backend/benchmarks.py                        # compare with the baseline
+    python backend/benchmarks.py --save                 # record a new baseline
+    python backend/benchmarks.py --mongo-url mongodb://localhost:27017 --scales 10,1000
+    python backend/benchmarks.py --only vessel_hydration,search_suggestions
+
+Baselines are machine specific; record one on the machine that compares.
+Database-backed benchmarks skip scales above STANDIN_MAX_SCALE on the
+stand-in, since they would only measure mongomock.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = Path(__file__).parent
+sys.path.insert(0, str(BACKEND_DIR))
+load_dotenv(BACKEND_DIR / '.env')
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "vessel_benchmarks")
+os.environ.setdefault("SLOW_QUERY_THRESHOLD_MS", "inf")  # time the request path, not slow query capture
+
+import server  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+
+try:
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError:  # Only needed for the in-memory stand-in
+    AsyncMongoMockClient = None
+
+DEFAULT_BASELINE = BACKEND_DIR / "benchmark_baseline.json"
+DEFAULT_SCALES = (10, 1_000, 100_000)
+DEFAULT_THRESHOLD = 0.25
+STANDIN_MAX_SCALE = 10_000  # mongomock is pure Python; larger collections only measure the stand-in
+
+BENCHMARKS: Dict[str, Callable] = {}
+USES_DB: set = set()
+
+
+def benchmark(name: str, uses_db: bool = False):
+    """Register ``setup(db, scale)``, which prepares data and returns the operation to time"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        if uses_db:
+            USES_DB.add(name)
+        return setup
+    return register
+
+
+def random_search_params(rng: random.Random, vessel_types: List[str], locations: List[str], tags: List[str]) -> Dict[str, Any]:
+    params = {"sort_by": rng.choice(["featured", "price-low", "price-high", "rating", "newest"])}
+    if rng.random() < 0.3:
+        params["search"] = rng.choice(vessel_types + locations)[:6]
+    if rng.random() < 0.4:
+        params["vessel_type"] = rng.choice(vessel_types)
+    if rng.random() < 0.3:
+        params["location"] = rng.choice(locations).split(",")[0]
+    if rng.random() < 0.3:
+        params["min_daily_rate"] = rng.choice([5000, 10000, 20000])
+    if rng.random() < 0.3:
+        params["max_daily_rate"] = rng.choice([15000, 30000, 60000])
+    if rng.random() < 0.2:
+        params["min_year_built"] = rng.randint(1995, 2020)
+    if rng.random() < 0.3:
+        params["tags"] = ", ".join(rng.sample(tags, rng.randint(1, min(3, len(tags)))))
+    return params
+
+
+def synthetic_vocabulary(size: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    syllables = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add(" ".join("".join(rng.choice(syllables) for _ in range(rng.randint(2, 3))).title()
+                                for _ in range(rng.randint(1, 2))))
+    return sorted(vocabulary)
+
+
+async def insert_batches(collection, docs, batch_size: int = 5000):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            await collection.insert_many(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch)
+
+
+@benchmark("vessel_query")
+async def bench_vessel_query(db, scale: int):
+    """Build ``scale`` get_vessels filter/sort documents"""
+    profile = server.fleet_profile()
+    vessel_types = sorted({template["vessel_type"] for template in profile["templates"]})
+    rng = random.Random(scale)
+    requests = [random_search_params(rng, vessel_types, profile["locations"], profile["tags"]) for _ in range(scale)]
+
+    def run():
+        for params in requests:
+            server.vessel_search_query(**params)
+    return run
+
+
+@benchmark("vessel_hydration")
+async def bench_vessel_hydration(db, scale: int):
+    """Vessel(**doc) for ``scale`` stored documents"""
+    docs = list(server.generate_vessels(scale, seed=scale))
+
+    def run():
+        return [server.Vessel(**doc) for doc in docs]
+    return run
+
+
+@benchmark("vessel_encoding")
+async def bench_vessel_encoding(db, scale: int):
+    """Validate and JSON-encode ``scale`` vessels the way GET /api/vessels responds"""
+    route = next(route for route in server.app.routes if getattr(route, "path", None) == "/api/vessels"
+                 and "GET" in route.methods)
+    vessels = [server.Vessel(**doc) for doc in server.generate_vessels(scale, seed=scale)]
+
+    async def run():
+        content = await serialize_response(field=route.response_field, response_content=vessels, is_coroutine=True)
+        return server.JSONResponse(content).body
+    return run
+
+
+@benchmark("search_suggestions")
+async def bench_search_suggestions(db, scale: int):
+    """The suggestions dedup loop over a reference vocabulary of ``scale`` values"""
+    vocabulary = synthetic_vocabulary(scale, seed=scale)
+    server.reference_snapshots = None
+    server._reference_data = {
+        "vessel_types": vocabulary[0::4],
+        "locations": vocabulary[1::4],
+        "tags": vocabulary[2::4],
+        "features": vocabulary[3::4],
+    }
+    server.suggestion_index = server.SuggestionIndex()  # keep fuzzy matching out of the measurement
+    rng = random.Random(scale)
+    queries = [value[:rng.randint(2, 4)].lower() for value in rng.sample(vocabulary, min(50, len(vocabulary)))]
+
+    async def run():
+        for q in queries:
+            await server.get_search_suggestions(q=q)
+    return run
+
+
+@benchmark("search_analytics", uses_db=True)
+async def bench_search_analytics(db, scale: int):
+    """GET /api/search/analytics aggregating ``scale`` search log entries"""
+    await db.search_queries.delete_many({})
+    await insert_batches(db.search_queries, server.generate_search_logs(scale, seed=scale, days=7))
+
+    async def run():
+        return await server.get_search_analytics(start_date=None, end_date=None, limit=scale)
+    return run
+
+
+async def measure(operation: Callable, repeat: int, min_time: float) -> Dict[str, Any]:
+    """Median and minimum wall time of ``operation`` over at least ``repeat`` runs and ``min_time`` seconds"""
+    is_async = inspect.iscoroutinefunction(operation)
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat or (time.perf_counter() - started < min_time and len(timings) < 1000):
+        op_started = time.perf_counter()
+        if is_async:
+            await operation()
+        else:
+            operation()
+        timings.append((time.perf_counter() - op_started) * 1000)
+    return {
+        "median_ms": round(statistics.median(timings), 4),
+        "min_ms": round(min(timings), 4),
+        "runs": len(timings),
+    }
+
+
+async def run_suite(names: List[str], scales: List[int], mongo_url: Optional[str], db_name: str,
+                    repeat: int, min_time: float) -> Dict[str, Dict[str, Any]]:
+    if mongo_url:
+        server.client = server.AsyncIOMotorClient(mongo_url)
+    elif AsyncMongoMockClient is not None:
+        server.client = AsyncMongoMockClient()
+    else:
+        raise SystemExit("The in-memory stand-in needs mongomock-motor; install it or pass --mongo-url")
+    server.db = server.client[db_name]
+    results = {}
+    try:
+        for name in names:
+            for scale in scales:
+                if name in USES_DB and not mongo_url and scale > STANDIN_MAX_SCALE:
+                    print(f"{name:<20} {scale:>8}  skipped on the in-memory stand-in; use --mongo-url")
+                    continue
+                operation = await BENCHMARKS[name](server.db, scale)
+                result = await measure(operation, repeat, min_time)
+                results[f"{name}@{scale}"] = result
+                print(f"{name:<20} {scale:>8}  median {result['median_ms']:>11.3f} ms  "
+                      f"min {result['min_ms']:>11.3f} ms  ({result['runs']} runs)")
+    finally:
+        await server.client.drop_database(db_name)
+        server.close_db()
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Names of benchmarks whose median exceeds the baseline by more than their threshold"""
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get("results", {}).get(key)
+        if not expected:
+            continue
+        allowed = expected.get("threshold", threshold)
+        ratio = result["median_ms"] / max(expected["median_ms"], 1e-6)
+        status = "REGRESSION" if ratio > 1 + allowed else "ok"
+        print(f"{key:<30} {ratio:>6.2f}x baseline (limit {1 + allowed:.2f}x)  {status}")
+        if status != "ok":
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend hot paths against a JSON baseline")
+    parser.add_argument("--only", default=None, help=f"Comma-separated benchmarks: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scales", default=",".join(str(scale) for scale in DEFAULT_SCALES),
+                        help="Comma-separated data sizes")
+    parser.add_argument("--mongo-url", default=None, help="Run against this mongod instead of the in-memory stand-in")
+    parser.add_argument("--db", default="vessel_benchmarks", help="Scratch database, dropped afterwards")
+    parser.add_argument("--repeat", type=int, default=5, help="Minimum runs per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum seconds per benchmark")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown over the baseline median, e.g. 0.25 for 25%%")
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    scales = [int(scale) for scale in args.scales.split(",")]
+    results = asyncio.run(run_suite(names, scales, args.mongo_url, args.db, args.repeat, args.min_time))
+
+    if args.save:
+        previous = json.loads(args.baseline.read_text()) if args.baseline.exists() else {"results": {}}
+        for key, result in results.items():
+            # Keep hand-tuned per-benchmark thresholds across re-recordings
+            if "threshold" in previous["results"].get(key, {}):
+                result["threshold"] = previous["results"][key]["threshold"]
+        previous["results"].update(results)
+        previous["recorded_at"] = datetime.utcnow().isoformat()
+        previous["environment"] = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "backend": "mongod" if args.mongo_url else "mongomock",
+        }
+        args.baseline.write_text(json.dumps(previous, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save to record one")
+        return
+    if compare(results, json.loads(args.baseline.read_text()), args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
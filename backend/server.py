@@ -1,27 +1,82 @@
-from fastapi import FastAPI, APIRouter, Query, HTTPException, Request
+from fastapi import FastAPI, APIRouter, Query, HTTPException, Request, Response, UploadFile, File, Depends
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import List, Optional, Dict, Any, Sequence
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
+import asyncio
+import argparse
+import json
+import random
+import time
+import math
+import threading
+import fcntl
+import mmap
+import struct
+import tempfile
+import hashlib
+import shutil
+import multiprocessing
+import socket
+import bisect
+import heapq
+import contextvars
+import urllib.request
+from dataclasses import dataclass
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, deque, OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+import numpy as np
+from pymongo import UpdateOne, ReturnDocument, monitoring
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is only needed by the image pipeline
+    Image = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis is only needed for the shared rate limit backend
+    aioredis = None
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
+#
+# The client is created by the lifespan handler (or the CLI) rather than at
+# import time, so startup can ping the server and time the connection.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
-# Create the main app without a prefix
-app = FastAPI()
+
+def connect_db():
+    global client, db
+    if client is None:
+        client = AsyncIOMotorClient(mongo_url, event_listeners=[pool_wait_monitor, command_tracer])
+        db = client[os.environ['DB_NAME']]
+    return db
+
+
+def close_db():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -44,6 +99,17 @@ class VesselSpecifications(BaseModel):
     deck_space: Optional[float] = None
     fuel_capacity: Optional[float] = None
 
+class ImageVariant(BaseModel):
+    width: int
+    height: int
+    format: str
+    url: str
+
+class VesselImage(BaseModel):
+    content_hash: str
+    original_url: str
+    variants: List[ImageVariant] = []
+
 class Vessel(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     vessel_name: str
@@ -62,9 +128,30 @@ class Vessel(BaseModel):
     discount_percentage: Optional[float] = None
     features: Optional[List[str]] = []
     description: Optional[str] = None
+    thumbnails: Optional[List[VesselImage]] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+CHARTER_MAX_DAYS = int(os.environ.get("CHARTER_MAX_DAYS", "1830"))  # about five years
+
+class CharterQuote(BaseModel):
+    vessel_id: str
+    days: int
+    months: int
+    weeks: int
+    extra_days: int
+    subtotal: float
+    discount_percentage: float
+    total: float
+    effective_daily_rate: float
+
+class VesselWithQuote(Vessel):
+    quote: Optional[CharterQuote] = None
+
+class VesselQuoteRequest(BaseModel):
+    ids: List[str]
+    days: int = Field(..., ge=1, le=CHARTER_MAX_DAYS)
+
 class VesselCreate(BaseModel):
     vessel_name: str
     vessel_type: str
@@ -83,7 +170,64 @@ class VesselCreate(BaseModel):
     features: Optional[List[str]] = []
     description: Optional[str] = None
 
+class VesselPatch(BaseModel):
+    vessel_name: Optional[str] = None
+    vessel_type: Optional[str] = None
+    location: Optional[str] = None
+    daily_rate: Optional[float] = None
+    weekly_rate: Optional[float] = None
+    monthly_rate: Optional[float] = None
+    images: Optional[List[str]] = None
+    specifications: Optional[VesselSpecifications] = None
+    availability_status: Optional[str] = None
+    rating: Optional[float] = None
+    total_reviews: Optional[int] = None
+    tags: Optional[List[str]] = None
+    is_featured: Optional[bool] = None
+    discount_percentage: Optional[float] = None
+    features: Optional[List[str]] = None
+    description: Optional[str] = None
+
+    @field_validator("vessel_name", "vessel_type", "location")
+    @classmethod
+    def _required(cls, value):
+        if value is None:
+            raise ValueError("may not be null")
+        return value
+
+    def update_document(self, existing: Dict[str, Any]) -> Dict[str, Any]:
+        """$set fields for this patch; specifications are merged field by field"""
+        changes = self.dict(exclude_unset=True)
+        specifications = changes.get("specifications")
+        if specifications is not None and existing.get("specifications") is not None:
+            del changes["specifications"]
+            changes.update({f"specifications.{field}": value for field, value in specifications.items()})
+        return changes
+
+class VesselBulkItem(BaseModel):
+    id: str
+    update: VesselPatch
+
+class VesselBulkFilter(BaseModel):
+    ids: Optional[List[str]] = None
+    vessel_type: Optional[str] = None
+    location: Optional[str] = None
+    availability_status: Optional[str] = None
+    tags: Optional[List[str]] = None
+
+class VesselBulkUpdate(BaseModel):
+    items: Optional[List[VesselBulkItem]] = None  # per-vessel partial updates
+    filter: Optional[VesselBulkFilter] = None  # or one update applied to every match
+    update: Optional[VesselPatch] = None
+
+class VesselBatchRequest(BaseModel):
+    ids: List[str]
+    fields: Optional[List[str]] = None
+
 class VesselSearchParams(BaseModel):
+    """Canonical get_vessels parameters: equivalent requests compare and hash equal"""
+    model_config = ConfigDict(frozen=True)
+
     search: Optional[str] = None
     vessel_type: Optional[str] = None
     location: Optional[str] = None
@@ -93,12 +237,130 @@ class VesselSearchParams(BaseModel):
     max_year_built: Optional[int] = None
     availability_status: Optional[str] = None
     is_featured: Optional[bool] = None
-    tags: Optional[List[str]] = None
+    tags: Optional[List[str]] = None  # also accepts a comma-separated string
     features: Optional[List[str]] = None
-    sort_by: Optional[str] = "featured"  # featured, price-low, price-high, rating, newest
+    sort_by: Optional[str] = "featured"  # featured, price-low, price-high, rating, newest, quote
     limit: Optional[int] = 50
     offset: Optional[int] = 0
 
+    @field_validator("search", "vessel_type", "location", "availability_status", mode="before")
+    @classmethod
+    def _strip(cls, value):
+        return canonical_search_text(value)
+
+    @field_validator("tags", "features", mode="before")
+    @classmethod
+    def _terms(cls, value):
+        return canonical_search_terms(value)
+
+    @field_validator("sort_by", mode="before")
+    @classmethod
+    def _sort(cls, value):
+        return canonical_search_sort(value)
+
+    def plan_key(self) -> tuple:
+        """Everything that shapes the query plan, in field order; paging is applied when the plan runs"""
+        values = map(self.__dict__.__getitem__, VESSEL_PLAN_KEY_FIELDS)
+        return tuple([tuple(value) if value.__class__ is list else value for value in values])
+
+    def __hash__(self):
+        return hash(self.plan_key())
+
+VESSEL_PLAN_KEY_FIELDS = tuple(name for name in VesselSearchParams.model_fields if name not in ("limit", "offset"))
+
+
+def canonical_search_text(value):
+    return value.strip() or None if isinstance(value, str) else value
+
+
+def canonical_search_terms(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    return sorted({term.strip() for term in value if isinstance(term, str) and term.strip()}) or None
+
+
+def canonical_search_sort(value):
+    value = value.strip().lower() if isinstance(value, str) else value
+    return value if value in VESSEL_SORT_NAMES else "featured"
+
+
+def search_plan_key(
+    search=None, vessel_type=None, location=None, min_daily_rate=None, max_daily_rate=None,
+    min_year_built=None, max_year_built=None, availability_status=None, is_featured=None,
+    tags=None, features=None, sort_by="featured", limit=None, offset=None
+) -> tuple:
+    """VesselSearchParams(**raw).plan_key() for values FastAPI has already typed, without building the model"""
+    # Inlined canonical_search_* for the common cases; this runs on every search
+    if tags is not None:
+        tags = canonical_search_terms(tags)
+        tags = tuple(tags) if tags else None
+    if features is not None:
+        features = canonical_search_terms(features)
+        features = tuple(features) if features else None
+    return (
+        search.strip() or None if search else None,
+        vessel_type.strip() or None if vessel_type else None,
+        location.strip() or None if location else None,
+        min_daily_rate, max_daily_rate, min_year_built, max_year_built,
+        availability_status.strip() or None if availability_status else None,
+        is_featured, tags, features,
+        sort_by if sort_by in VESSEL_SORT_NAMES else canonical_search_sort(sort_by),
+    )
+
+
+class SavedSearch(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    owner_id: str
+    name: Optional[str] = None
+    params: VesselSearchParams
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SavedSearchCreate(BaseModel):
+    owner_id: str
+    name: Optional[str] = None
+    params: VesselSearchParams
+
+class SavedSearchNotification(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    saved_search_id: str
+    owner_id: str
+    vessel_id: str
+    reason: str  # new, matched, repriced
+    daily_rate: Optional[float] = None
+    previous_daily_rate: Optional[float] = None
+    read: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class NotificationsRead(BaseModel):
+    owner_id: str
+    ids: List[str]
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str
+    params: Dict[str, Any] = {}
+    status: str = "queued"  # queued, running, succeeded, failed, cancelled
+    attempts: int = 0
+    max_attempts: int = 3
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    run_after: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class JobCreate(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+    max_attempts: int = Field(3, ge=1, le=10)
+
 class SearchQuery(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     query: str
@@ -122,162 +384,3685 @@ class SearchQueryCreate(BaseModel):
     results_count: Optional[int] = None
     session_id: Optional[str] = None
 
-# Add your routes to the router instead of directly to app
-@api_router.get("/")
-async def root():
-    return {"message": "Hello World"}
+class SearchEvent(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    search_id: str
+    event_type: str = "click"  # click, impression
+    vessel_id: str
+    query: Optional[str] = None
+    session_id: Optional[str] = None
+    position: Optional[int] = None
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
 
-@api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
-    status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
-    return status_obj
+class SearchImpressionsCreate(BaseModel):
+    vessel_ids: List[str]
 
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+# Search log storage
+#
+# search_queries is a time-series collection (timeField search_timestamp,
+# metaField meta) so analytics windows only touch the buckets they cover and
+# old buckets expire as a whole. Updating measurements in place needs
+# MongoDB 7.0; older servers keep a regular collection with a TTL index.
+# Every document carries the same ``meta`` sub-document either way.
 
-# Vessel API Endpoints
+SEARCH_LOG_RETENTION_DAYS = int(os.environ.get("SEARCH_LOG_RETENTION_DAYS", "180"))
+SEARCH_LOG_GRANULARITY = os.environ.get("SEARCH_LOG_GRANULARITY", "minutes")
+SEARCH_LOG_TIMESERIES_MIN_VERSION = (7, 0)
 
-@api_router.post("/vessels", response_model=Vessel)
-async def create_vessel(vessel: VesselCreate):
-    """Create a new vessel listing"""
-    vessel_dict = vessel.dict()
-    vessel_obj = Vessel(**vessel_dict)
-    result = await db.vessels.insert_one(vessel_obj.dict())
-    return vessel_obj
 
-@api_router.get("/vessels", response_model=List[Vessel])
-async def get_vessels(
-    search: Optional[str] = Query(None, description="Search query for vessel name, type, or location"),
-    vessel_type: Optional[str] = Query(None, description="Filter by vessel type"),
-    location: Optional[str] = Query(None, description="Filter by location"),
-    min_daily_rate: Optional[float] = Query(None, description="Minimum daily rate"),
-    max_daily_rate: Optional[float] = Query(None, description="Maximum daily rate"),
-    min_year_built: Optional[int] = Query(None, description="Minimum year built"),
-    max_year_built: Optional[int] = Query(None, description="Maximum year built"),
-    availability_status: Optional[str] = Query(None, description="Filter by availability status"),
-    is_featured: Optional[bool] = Query(None, description="Filter featured vessels"),
-    tags: Optional[str] = Query(None, description="Comma-separated tags to filter by"),
-    features: Optional[str] = Query(None, description="Comma-separated features to filter by"),
-    sort_by: Optional[str] = Query("featured", description="Sort by: featured, price-low, price-high, rating, newest"),
-    limit: Optional[int] = Query(50, description="Number of vessels to return"),
-    offset: Optional[int] = Query(0, description="Number of vessels to skip")
-):
-    """Get vessels with filtering and search capabilities"""
-    
-    # Build MongoDB query
-    query = {}
-    
-    # Search functionality
-    if search:
-        search_regex = re.compile(search, re.IGNORECASE)
-        query["$or"] = [
-            {"vessel_name": search_regex},
-            {"vessel_type": search_regex},
-            {"location": search_regex},
-            {"tags": {"$in": [search_regex]}},
-            {"features": {"$in": [search_regex]}}
-        ]
-    
-    # Filters
-    if vessel_type:
-        query["vessel_type"] = vessel_type
-    
-    if location:
-        query["location"] = {"$regex": location, "$options": "i"}
-    
-    if min_daily_rate is not None:
-        query["daily_rate"] = {"$gte": min_daily_rate}
-    
-    if max_daily_rate is not None:
-        if "daily_rate" in query:
-            query["daily_rate"]["$lte"] = max_daily_rate
+def search_log_document(search_obj: SearchQuery) -> Dict[str, Any]:
+    doc = search_obj.dict()
+    doc["meta"] = {"page_context": doc.get("page_context"), "query_type": doc.get("query_type")}
+    return doc
+
+
+async def search_log_collection_type() -> Optional[str]:
+    cursor = await db.list_collections(filter={"name": "search_queries"})
+    collections = await cursor.to_list(1)
+    return collections[0].get("type", "collection") if collections else None
+
+
+async def supports_timeseries_updates() -> bool:
+    info = await db.command("buildInfo")
+    return tuple(info.get("versionArray", [0, 0])[:2]) >= SEARCH_LOG_TIMESERIES_MIN_VERSION
+
+
+async def ensure_search_log_collection():
+    """Create the search log collection and apply the configured retention"""
+    expire_after = SEARCH_LOG_RETENTION_DAYS * 86400 if SEARCH_LOG_RETENTION_DAYS > 0 else None
+    collection_type = await search_log_collection_type()
+
+    if collection_type is None and await supports_timeseries_updates():
+        options = {
+            "timeseries": {
+                "timeField": "search_timestamp",
+                "metaField": "meta",
+                "granularity": SEARCH_LOG_GRANULARITY,
+            }
+        }
+        if expire_after:
+            options["expireAfterSeconds"] = expire_after
+        await db.create_collection("search_queries", **options)
+        collection_type = "timeseries"
+
+    if collection_type == "timeseries":
+        await db.command({"collMod": "search_queries", "expireAfterSeconds": expire_after or "off"})
+    else:
+        if collection_type == "collection":
+            logger.warning("search_queries is a regular collection; run `python server.py migrate-search-log`")
+        if expire_after:
+            try:
+                await db.search_queries.create_index(
+                    "search_timestamp", name="search_timestamp_ttl", expireAfterSeconds=expire_after
+                )
+            except OperationFailure:
+                await db.command({
+                    "collMod": "search_queries",
+                    "index": {"name": "search_timestamp_ttl", "expireAfterSeconds": expire_after},
+                })
         else:
-            query["daily_rate"] = {"$lte": max_daily_rate}
-    
-    if min_year_built is not None:
-        query["specifications.year_built"] = {"$gte": min_year_built}
-    
-    if max_year_built is not None:
-        if "specifications.year_built" in query:
-            query["specifications.year_built"]["$lte"] = max_year_built
+            await db.search_queries.create_index("search_timestamp", name="search_timestamp_ttl")
+
+    await db.search_queries.create_index("id")
+    await db.search_queries.create_index([("meta.page_context", 1), ("search_timestamp", -1)])
+
+
+async def migrate_search_log(batch_size: int = 1000, drop_legacy: bool = False) -> Dict[str, Any]:
+    """Move an existing regular search_queries collection into the time-series layout
+
+    The legacy collection is renamed out of the way first so new searches land
+    in the new collection immediately; copying resumes from the last migrated
+    _id if it is interrupted.
+    """
+    if not await supports_timeseries_updates():
+        raise RuntimeError("Time-series search log requires MongoDB %d.%d+" % SEARCH_LOG_TIMESERIES_MIN_VERSION)
+
+    state = await db.migrations.find_one({"_id": "search_log_timeseries"}) or {}
+    if state.get("completed_at"):
+        if drop_legacy:
+            await db.search_queries_legacy.drop()
+        return {"copied": state.get("copied", 0), "legacy_dropped": drop_legacy, "already_completed": True}
+
+    if await search_log_collection_type() == "collection":
+        await db.search_queries.rename("search_queries_legacy")
+    await ensure_search_log_collection()
+
+    query = {"_id": {"$gt": state["last_id"]}} if state.get("last_id") else {}
+    if SEARCH_LOG_RETENTION_DAYS > 0:
+        query["search_timestamp"] = {"$gte": datetime.utcnow() - timedelta(days=SEARCH_LOG_RETENTION_DAYS)}
+
+    copied = state.get("copied", 0)
+    last_id = state.get("last_id")
+    cursor = db.search_queries_legacy.find(query).sort("_id", 1)
+    batch = []
+    async for doc in cursor:
+        last_id = doc.pop("_id")
+        if not isinstance(doc.get("search_timestamp"), datetime):
+            continue
+        migrated = search_log_document(SearchQuery(**doc))
+        if "updated_at" in doc:
+            migrated["updated_at"] = doc["updated_at"]
+        batch.append(migrated)
+        if len(batch) >= batch_size:
+            await db.search_queries.insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+            await db.migrations.update_one(
+                {"_id": "search_log_timeseries"},
+                {"$set": {"last_id": last_id, "copied": copied}},
+                upsert=True
+            )
+    if batch:
+        await db.search_queries.insert_many(batch, ordered=False)
+        copied += len(batch)
+
+    await db.migrations.update_one(
+        {"_id": "search_log_timeseries"},
+        {"$set": {"last_id": last_id, "copied": copied, "completed_at": datetime.utcnow()}},
+        upsert=True
+    )
+    if drop_legacy:
+        await db.search_queries_legacy.drop()
+    return {"copied": copied, "legacy_dropped": drop_legacy}
+
+# Search event stream
+#
+# Clicks and impressions are appended to their own collection instead of being
+# pushed onto the search document. Events are buffered in-process and written
+# with one insert_many per flush; the per-vessel and per-query CTR tables are
+# maintained with one unordered bulk of $inc upserts per flush.
+
+SEARCH_EVENT_BATCH_SIZE = int(os.environ.get("SEARCH_EVENT_BATCH_SIZE", "500"))
+SEARCH_EVENT_FLUSH_INTERVAL = float(os.environ.get("SEARCH_EVENT_FLUSH_INTERVAL", "2.0"))
+
+
+def normalize_query(query: Optional[str]) -> str:
+    return (query or "").lower().strip()
+
+
+class SearchEventBuffer:
+    """Collects search events and CTR counters and flushes them in batches"""
+
+    def __init__(self, batch_size: int = SEARCH_EVENT_BATCH_SIZE, flush_interval: float = SEARCH_EVENT_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._events: List[Dict[str, Any]] = []
+        self._vessel_counts: Dict[str, Dict[str, int]] = {}
+        self._query_counts: Dict[str, Dict[str, int]] = {}
+        self._latency_counts: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _count(self, table: Dict[str, Dict[str, int]], key: str, field: str, amount: int = 1):
+        counters = table.setdefault(key, {})
+        counters[field] = counters.get(field, 0) + amount
+
+    def record_search(self, query: str):
+        """Count a logged search towards its query's CTR denominator"""
+        query = normalize_query(query)
+        if query:
+            self._count(self._query_counts, query, "searches")
+
+    def record_latency(
+        self,
+        page_context: Optional[str],
+        search_timestamp: datetime,
+        response_time_ms: float,
+        replaces_ms: Optional[float] = None
+    ):
+        """Count a search response time into its hourly latency histogram
+
+        ``replaces_ms`` is the search's previously recorded response time,
+        which is moved out of the histogram instead of adding an observation.
+        """
+        if replaces_ms == response_time_ms:
+            return
+        page_context = page_context or "unknown"
+        hour = hour_bucket(search_timestamp)
+        key = f"{hour.isoformat()}|{page_context}"
+        if key not in self._latency_counts:
+            self._latency_counts[key] = {"hour": hour, "page_context": page_context, "counts": {}}
+        counts = self._latency_counts[key]
+        self._count(counts, "counts", f"buckets.{latency_bucket(response_time_ms)}")
+        if replaces_ms is None:
+            self._count(counts, "counts", "count")
+            self._count(counts, "counts", "sum_ms", response_time_ms)
         else:
-            query["specifications.year_built"] = {"$lte": max_year_built}
-    
-    if availability_status:
-        query["availability_status"] = availability_status
-    
-    if is_featured is not None:
-        query["is_featured"] = is_featured
-    
-    if tags:
-        tag_list = [tag.strip() for tag in tags.split(",")]
-        query["tags"] = {"$in": tag_list}
-    
-    if features:
-        feature_list = [feature.strip() for feature in features.split(",")]
-        query["features"] = {"$in": feature_list}
-    
-    # Sorting
-    sort_criteria = []
-    if sort_by == "price-low":
-        sort_criteria = [("daily_rate", 1)]
-    elif sort_by == "price-high":
-        sort_criteria = [("daily_rate", -1)]
-    elif sort_by == "rating":
-        sort_criteria = [("rating", -1)]
-    elif sort_by == "newest":
-        sort_criteria = [("created_at", -1)]
-    else:  # featured
-        sort_criteria = [("is_featured", -1), ("rating", -1)]
-    
-    # Execute query
-    cursor = db.vessels.find(query)
-    if sort_criteria:
-        cursor = cursor.sort(sort_criteria)
-    
-    cursor = cursor.skip(offset).limit(limit)
-    vessels = await cursor.to_list(length=limit)
-    
-    return [Vessel(**vessel) for vessel in vessels]
+            self._count(counts, "counts", f"buckets.{latency_bucket(replaces_ms)}", -1)
+            self._count(counts, "counts", "sum_ms", response_time_ms - replaces_ms)
+
+    def add(self, event: SearchEvent):
+        field = "clicks" if event.event_type == "click" else "impressions"
+        self._events.append(event.dict())
+        self._count(self._vessel_counts, event.vessel_id, field)
+        if event.query:
+            self._count(self._query_counts, event.query, field)
+        if len(self._events) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        async with self._lock:
+            events, self._events = self._events, []
+            vessel_counts, self._vessel_counts = self._vessel_counts, {}
+            query_counts, self._query_counts = self._query_counts, {}
+            latency_counts, self._latency_counts = self._latency_counts, {}
+
+            if not (events or vessel_counts or query_counts or latency_counts):
+                return
+
+            now = datetime.utcnow()
+            try:
+                if events:
+                    await db.search_events.insert_many(events, ordered=False)
+                if vessel_counts:
+                    await db.vessel_ctr.bulk_write([
+                        UpdateOne({"_id": vessel_id}, {"$inc": counts, "$set": {"updated_at": now}}, upsert=True)
+                        for vessel_id, counts in vessel_counts.items()
+                    ], ordered=False)
+                if query_counts:
+                    await db.query_ctr.bulk_write([
+                        UpdateOne({"_id": query}, {"$inc": counts, "$set": {"updated_at": now}}, upsert=True)
+                        for query, counts in query_counts.items()
+                    ], ordered=False)
+                if latency_counts:
+                    await db.search_latency.bulk_write([
+                        UpdateOne(
+                            {"_id": key},
+                            {"$inc": entry["counts"], "$set": {"hour": entry["hour"], "page_context": entry["page_context"]}},
+                            upsert=True
+                        )
+                        for key, entry in latency_counts.items()
+                    ], ordered=False)
+            except Exception:
+                logger.exception("Failed to flush %d search events", len(events))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+search_event_buffer = SearchEventBuffer()
+
+
+def ctr_summary(doc: Dict[str, Any], denominator: str) -> Dict[str, Any]:
+    clicks = doc.get("clicks", 0)
+    total = doc.get(denominator, 0)
+    summary = {
+        "clicks": clicks,
+        "impressions": doc.get("impressions", 0),
+        "ctr": clicks / total if total else None,
+    }
+    if denominator == "searches":
+        summary["searches"] = total
+    return summary
+
+# Search latency
+#
+# Response times are counted into log-spaced buckets (relative error
+# SEARCH_LATENCY_ACCURACY), one histogram per (hour, page_context) in
+# ``search_latency``. Histograms merge by adding bucket counts, so any window
+# can be answered from a few documents instead of raw search rows.
+
+SEARCH_LATENCY_ACCURACY = float(os.environ.get("SEARCH_LATENCY_ACCURACY", "0.02"))
+SEARCH_LATENCY_MIN_MS = 0.1
+_latency_gamma = (1 + SEARCH_LATENCY_ACCURACY) / (1 - SEARCH_LATENCY_ACCURACY)
+
+
+def latency_bucket(value_ms: float) -> int:
+    return math.ceil(math.log(max(value_ms, SEARCH_LATENCY_MIN_MS)) / math.log(_latency_gamma))
+
+
+def latency_bucket_value(index: int) -> float:
+    return 2 * _latency_gamma ** index / (_latency_gamma + 1)
+
+
+def merge_latency_histograms(docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    buckets: Counter = Counter()
+    count, total = 0, 0.0
+    for doc in docs:
+        for index, bucket_count in (doc.get("buckets") or {}).items():
+            buckets[int(index)] += bucket_count
+        count += doc.get("count", 0)
+        total += doc.get("sum_ms", 0.0)
+    return {"buckets": buckets, "count": count, "sum_ms": total}
+
+
+def latency_percentiles(histogram: Dict[str, Any], quantiles=(0.5, 0.9, 0.95, 0.99)) -> Dict[str, Optional[float]]:
+    count = sum(histogram["buckets"].values())
+    if not count:
+        return {f"p{round(q * 100)}": None for q in quantiles}
+    ordered = sorted(histogram["buckets"].items())
+    percentiles = {}
+    for q in quantiles:
+        rank = q * (count - 1)
+        seen = 0
+        for index, bucket_count in ordered:
+            seen += bucket_count
+            if seen > rank:
+                break
+        percentiles[f"p{round(q * 100)}"] = round(latency_bucket_value(index), 2)
+    return percentiles
+
+
+async def search_latency_summary(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    page_context: Optional[str] = None
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if start or end:
+        query["hour"] = {}
+        if start:
+            query["hour"]["$gte"] = hour_bucket(start)
+        if end:
+            query["hour"]["$lte"] = end
+    if page_context:
+        query["page_context"] = page_context
+    docs = await db.search_latency.find(query, {"_id": 0}).to_list(None)
+
+    by_context: Dict[str, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        by_context.setdefault(doc["page_context"], []).append(doc)
+
+    def summarize(histogram):
+        return {
+            "count": histogram["count"],
+            "avg_ms": histogram["sum_ms"] / histogram["count"] if histogram["count"] else None,
+            **latency_percentiles(histogram),
+        }
+
+    return {
+        **summarize(merge_latency_histograms(docs)),
+        "page_contexts": {context: summarize(merge_latency_histograms(group)) for context, group in by_context.items()},
+    }
+
+# Top search queries
+#
+# Heavy hitters are tracked with Space-Saving summaries, one per
+# (hour, page_context) per worker. Each worker periodically upserts its
+# summaries into ``query_sketches``. A leased job folds settled hours from all
+# workers into one summary per (day, page_context) in ``query_sketch_days``,
+# recording the folded hour ids so a replay folds nothing twice. Reads merge
+# the daily rollups for whole days in the window with the hourly summaries of
+# the partial days and of hours not folded yet, in one pass; a window of the
+# last SEARCH_TOPK_DEFAULT_DAYS (the default) reads about that many rollups
+# plus a day or two of hours per context.
+
+SEARCH_TOPK_CAPACITY = int(os.environ.get("SEARCH_TOPK_CAPACITY", "200"))
+SEARCH_TOPK_DEFAULT_DAYS = int(os.environ.get("SEARCH_TOPK_DEFAULT_DAYS", "30"))
+SEARCH_TOPK_PERSIST_INTERVAL = float(os.environ.get("SEARCH_TOPK_PERSIST_INTERVAL", "30"))
+SEARCH_TOPK_FOLD_INTERVAL = float(os.environ.get("SEARCH_TOPK_FOLD_INTERVAL", "600"))
+SEARCH_TOPK_FOLD_DELAY_HOURS = 2  # hours stop changing once every worker has persisted them
+
+
+class SpaceSaving:
+    """Space-Saving top-k summary; counts overestimate by at most ``error``"""
+
+    def __init__(self, capacity: int = SEARCH_TOPK_CAPACITY, counters: Optional[Dict[str, List[int]]] = None):
+        self.capacity = capacity
+        self.counters: Dict[str, List[int]] = counters or {}  # item -> [count, error]
+        # One (count, item) entry per counter; counts only grow, so an entry may
+        # lag behind its counter and is refreshed when it reaches the top
+        self._heap = [(count, item) for item, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def _settle_min(self) -> tuple:
+        while True:
+            count, item = self._heap[0]
+            current = self.counters[item][0]
+            if count == current:
+                return count, item
+            heapq.heapreplace(self._heap, (current, item))
+
+    def add(self, item: str, weight: int = 1):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+            return
+        if len(self.counters) < self.capacity:
+            floor = 0
+        else:
+            floor, evicted = self._settle_min()
+            heapq.heappop(self._heap)
+            del self.counters[evicted]
+        self.counters[item] = [floor + weight, floor]
+        heapq.heappush(self._heap, (floor + weight, item))
+
+    def floor(self) -> int:
+        """Upper bound on the count of any item not in the summary"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return self._settle_min()[0]
+
+    @classmethod
+    def merge_many(cls, sketches: List["SpaceSaving"], capacity: int = SEARCH_TOPK_CAPACITY) -> "SpaceSaving":
+        """Merge any number of summaries in one pass, truncating once at the end"""
+        floors = [sketch.floor() for sketch in sketches]
+        total_floor = sum(floors)
+        merged: Dict[str, List[int]] = {}
+        for sketch, floor in zip(sketches, floors):
+            for item, (count, error) in sketch.counters.items():
+                entry = merged.get(item)
+                if entry is None:
+                    entry = merged[item] = [total_floor, total_floor]
+                entry[0] += count - floor
+                entry[1] += error - floor
+        top = heapq.nlargest(capacity, merged.items(), key=lambda entry: entry[1][0])
+        return cls(capacity, dict(top))
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        own_floor, other_floor = self.floor(), other.floor()
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, [own_floor, own_floor])
+            other_count, other_error = other.counters.get(item, [other_floor, other_floor])
+            merged[item] = [count + other_count, error + other_error]
+        top = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:self.capacity]
+        return SpaceSaving(self.capacity, dict(top))
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)[:n]
+        return [{"query": item, "count": count, "error": error} for item, (count, error) in ranked]
+
+    def to_document(self) -> List[List[Any]]:
+        # Stored as a list because queries may contain "." or "$"
+        return [[item, count, error] for item, (count, error) in self.counters.items()]
+
+    @classmethod
+    def from_document(cls, entries: List[List[Any]], capacity: int = SEARCH_TOPK_CAPACITY) -> "SpaceSaving":
+        return cls(capacity, {item: [count, error] for item, count, error in entries})
+
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class QueryHeavyHitters:
+    """Per-worker hourly Space-Saving summaries of logged search queries"""
+
+    def __init__(self, persist_interval: float = SEARCH_TOPK_PERSIST_INTERVAL):
+        self.persist_interval = persist_interval
+        self._sketches: Dict[tuple, SpaceSaving] = {}
+        self._dirty: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, query: str, page_context: Optional[str], timestamp: datetime):
+        query = normalize_query(query)
+        if not query:
+            return
+        key = (hour_bucket(timestamp), page_context or "unknown")
+        self._sketches.setdefault(key, SpaceSaving()).add(query)
+        self._dirty.add(key)
+
+    async def persist(self):
+        dirty, self._dirty = self._dirty, set()
+        if dirty:
+            try:
+                await db.query_sketches.bulk_write([
+                    UpdateOne(
+                        {"_id": f"{hour.isoformat()}|{page_context}|{WORKER_ID}"},
+                        {"$set": {
+                            "hour": hour,
+                            "page_context": page_context,
+                            "worker": WORKER_ID,
+                            "counters": self._sketches[(hour, page_context)].to_document(),
+                        }},
+                        upsert=True
+                    )
+                    for hour, page_context in dirty
+                ], ordered=False)
+            except Exception:
+                self._dirty |= dirty
+                logger.exception("Failed to persist %d query sketches", len(dirty))
+                return
+        current = hour_bucket(datetime.utcnow())
+        for key in [key for key in self._sketches if key[0] < current and key not in self._dirty]:
+            del self._sketches[key]
+
+    async def top_queries(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        page_context: Optional[str] = None,
+        limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Merge the rollups and stored summaries for a window; local summaries replace this worker's stored copies"""
+        first_hour = hour_bucket(start or datetime.utcnow() - timedelta(days=SEARCH_TOPK_DEFAULT_DAYS))
+        last_hour = end or datetime.utcnow()
+        # Whole days inside the window come from the daily rollups
+        full_from = first_hour if first_hour == day_bucket(first_hour) else day_bucket(first_hour) + timedelta(days=1)
+        full_to = day_bucket(last_hour + timedelta(hours=1))  # exclusive
+
+        def in_window(hour: datetime, context: str) -> bool:
+            return first_hour <= hour <= last_hour and (page_context is None or context == page_context)
+
+        context_filter = {"page_context": page_context} if page_context else {}
+        hourly_query = {"hour": {"$gte": first_hour, "$lte": last_hour}, **context_filter}
+        if full_from < full_to:
+            hourly_query["$or"] = [
+                {"hour": {"$lt": full_from}}, {"hour": {"$gte": full_to}}, {"folded": {"$ne": True}}
+            ]
+        # Hourly first: an hour folded in between shows up in its rollup's hours and is skipped below
+        hourly = await db.query_sketches.find(hourly_query).to_list(None)
+        rollups = []
+        if full_from < full_to:
+            rollups = await db.query_sketch_days.find({"day": {"$gte": full_from, "$lt": full_to}, **context_filter}).to_list(None)
+        folded = {hour_id for rollup in rollups for hour_id in rollup.get("hours", [])}
+
+        sketches = [SpaceSaving.from_document(rollup["counters"]) for rollup in rollups]
+        for doc in hourly:
+            if doc["_id"] in folded:
+                continue
+            if doc["worker"] == WORKER_ID and (doc["hour"], doc["page_context"]) in self._sketches:
+                continue
+            sketches.append(SpaceSaving.from_document(doc["counters"]))
+        for (hour, context), sketch in list(self._sketches.items()):
+            if in_window(hour, context):
+                sketches.append(sketch)
+        return SpaceSaving.merge_many(sketches).top(limit)
+
+    async def fold(self):
+        """Fold settled hourly summaries from every worker into per-day rollups"""
+        cutoff = hour_bucket(datetime.utcnow()) - timedelta(hours=SEARCH_TOPK_FOLD_DELAY_HOURS)
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        async for doc in db.query_sketches.find({"hour": {"$lt": cutoff}, "folded": {"$ne": True}}):
+            groups.setdefault((day_bucket(doc["hour"]), doc["page_context"]), []).append(doc)
+        for (day, page_context), docs in groups.items():
+            rollup_id = f"{day.isoformat()}|{page_context}"
+            rollup = await db.query_sketch_days.find_one({"_id": rollup_id}) or {}
+            already = set(rollup.get("hours", []))
+            new = [doc for doc in docs if doc["_id"] not in already]
+            if new:
+                merged = SpaceSaving.merge_many(
+                    [SpaceSaving.from_document(rollup.get("counters", []))]
+                    + [SpaceSaving.from_document(doc["counters"]) for doc in new]
+                )
+                await db.query_sketch_days.update_one(
+                    {"_id": rollup_id},
+                    {"$set": {"day": day, "page_context": page_context, "counters": merged.to_document()},
+                     "$addToSet": {"hours": {"$each": [doc["_id"] for doc in new]}}},
+                    upsert=True
+                )
+            await db.query_sketches.update_many(
+                {"_id": {"$in": [doc["_id"] for doc in docs]}}, {"$set": {"folded": True}}
+            )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            await self.persist()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.persist()
+
+
+query_heavy_hitters = QueryHeavyHitters()
+
+# Rate limiting and admission control
+#
+# Search endpoints are rate limited per client IP with token buckets, either
+# in-process or in Redis when RATE_LIMIT_REDIS_URL is set so the limit holds
+# across workers. X-Session-Id is client supplied and not part of the key:
+# rotating it must not buy a fresh bucket. Behind nginx, uvicorn must run with
+# --proxy-headers so request.client is the real client, not the proxy.
+# Independently, the admission middleware sheds load with 503 + Retry-After
+# when too many requests are in flight or Mongo connection pool waits grow,
+# which keeps latency bounded for the requests that are admitted.
+
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "100000"))
+RATE_LIMITS = {
+    # name: (tokens per second, burst)
+    "vessels": tuple(float(v) for v in os.environ.get("RATE_LIMIT_VESSELS", "10/40").split("/")),
+    "suggestions": tuple(float(v) for v in os.environ.get("RATE_LIMIT_SUGGESTIONS", "20/60").split("/")),
+    "search_log": tuple(float(v) for v in os.environ.get("RATE_LIMIT_SEARCH_LOG", "5/20").split("/")),
+}
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "256"))
+ADMISSION_MAX_POOL_WAIT_MS = float(os.environ.get("ADMISSION_MAX_POOL_WAIT_MS", "250"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+
+TOKEN_BUCKET_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or ARGV[2])
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or ARGV[3])
+tokens = math.min(tonumber(ARGV[2]), tokens + (tonumber(ARGV[3]) - updated) * tonumber(ARGV[1]))
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) / tonumber(ARGV[1])) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+def client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+
+def client_identity(request: Request) -> str:
+    return f"ip:{client_ip(request)}"
+
+
+class LocalTokenBuckets:
+    def __init__(self, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> tuple:
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class RedisTokenBuckets:
+    def __init__(self, url: str):
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float) -> tuple:
+        try:
+            allowed, tokens = await self._script(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time()])
+        except Exception:
+            logger.exception("Redis rate limiter unavailable; allowing request")
+            return True, 0.0
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else (1 - tokens) / rate
+
+
+rate_limit_backend = RedisTokenBuckets(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL and aioredis else LocalTokenBuckets()
+
+
+def rate_limited(name: str):
+    """Dependency that spends one token from the caller's ``name`` bucket or answers 429"""
+    rate, burst = RATE_LIMITS[name]
+
+    async def dependency(request: Request):
+        allowed, retry_after = await rate_limit_backend.take(f"{name}:{client_identity(request)}", rate, burst)
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+
+    return dependency
+
+
+class PoolWaitMonitor(monitoring.ConnectionPoolListener):
+    """Tracks how long operations wait to check out a Mongo connection (decaying average)"""
+
+    DECAY_SECONDS = 5.0
+
+    def __init__(self):
+        self._local = threading.local()
+        self._average_ms = 0.0
+        self._updated = time.monotonic()
+
+    @property
+    def wait_ms(self) -> float:
+        return self._average_ms * math.exp(-(time.monotonic() - self._updated) / self.DECAY_SECONDS)
+
+    def _observe(self, wait_ms: float):
+        self._average_ms = 0.8 * self.wait_ms + 0.2 * wait_ms
+        self._updated = time.monotonic()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            self._observe((time.perf_counter() - started) * 1000)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        self.connection_checked_out(event)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+pool_wait_monitor = PoolWaitMonitor()
+admission_state = {"in_flight": 0, "shed": 0}
+
+
+# Request tracing
+#
+# Every HTTP request gets a trace; spans record query building, each Mongo
+# command (via a PyMongo CommandListener; Motor runs commands in executor
+# threads with a copy of the request's contextvars, so the listener can find
+# the active trace), model construction and JSON encoding. Spans are always
+# recorded, but a trace is only exported when it was head-sampled
+# (TRACE_SAMPLE_RATE, or a sampled W3C traceparent) or turned out slow or
+# failed. Export is off by default; TRACE_EXPORTER selects a JSON-lines file
+# (rotated to TRACE_FILE.1 past TRACE_FILE_MAX_BYTES) or an OTLP/HTTP JSON
+# endpoint.
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")  # file, otlp, none
+TRACE_FILE = Path(os.environ.get("TRACE_FILE", "/tmp/vessel-traces.jsonl"))
+TRACE_FILE_MAX_BYTES = int(os.environ.get("TRACE_FILE_MAX_BYTES", str(100 * 1024 * 1024)))
+TRACE_OTLP_ENDPOINT = os.environ.get("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "500"))
+TRACE_EXPORT_INTERVAL = float(os.environ.get("TRACE_EXPORT_INTERVAL", "2"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "1000"))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "vessel-marketplace-api")
+_traceparent = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "_token")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._token = None
+
+    def end(self, **attributes):
+        self.attributes.update(attributes)
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+
+    def __enter__(self):
+        self._token = current_span_id.set(self.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span_id.reset(self._token)
+        self.end(**({"error": repr(exc)} if exc else {}))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None, sampled: Optional[bool] = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.parent_id = parent_id
+        self.sampled = random.random() < TRACE_SAMPLE_RATE if sampled is None else sampled
+        self.spans: List[Span] = []
+
+
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+current_span_id: contextvars.ContextVar = contextvars.ContextVar("current_span_id", default=None)
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """Start a span in the current trace; use as a context manager to parent nested spans, or call end()"""
+    trace = current_trace.get()
+    if trace is None:
+        return None
+    return Span(trace, name, current_span_id.get() or trace.parent_id, attributes)
+
+
+@contextmanager
+def traced(name: str, **attributes):
+    span = start_span(name, **attributes)
+    if span is None:
+        yield None
+        return
+    with span:
+        yield span
+
+
+class CommandTracer(monitoring.CommandListener):
+    """Turns Mongo commands issued during a traced request into spans"""
+
+    def __init__(self):
+        self._pending: Dict[tuple, Span] = {}
+
+    def started(self, event):
+        span = start_span(
+            f"mongo {event.command_name}",
+            **{"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name,
+               "db.collection": str(event.command.get(event.command_name))}
+        )
+        if span is not None:
+            self._pending[(event.connection_id, event.request_id)] = span
+
+    def _finish(self, event, **attributes):
+        span = self._pending.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end(duration_us=event.duration_micros, **attributes)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, error=str(event.failure))
+
+
+command_tracer = CommandTracer()
+
+
+class TraceExporter:
+    def __init__(self):
+        self._buffer: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, trace: Trace):
+        if TRACE_EXPORTER != "none":
+            self._buffer.append(trace)
+
+    def _write_file(self, traces: List[Trace]):
+        try:
+            if TRACE_FILE.stat().st_size >= TRACE_FILE_MAX_BYTES:
+                os.replace(TRACE_FILE, f"{TRACE_FILE}.1")
+        except FileNotFoundError:
+            pass
+        with open(TRACE_FILE, "a") as f:
+            for trace in traces:
+                for span in trace.spans:
+                    f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def _post_otlp(self, traces: List[Trace]):
+        def value(v):
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        spans = [{
+            "traceId": span.trace.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": value(v)} for key, v in span.attributes.items()],
+        } for trace in traces for span in trace.spans]
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "server"}, "spans": spans}],
+        }]}
+        request = urllib.request.Request(
+            TRACE_OTLP_ENDPOINT, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+    async def flush(self):
+        traces = list(self._buffer)
+        self._buffer.clear()
+        if not traces:
+            return
+        try:
+            if TRACE_EXPORTER == "otlp":
+                await asyncio.to_thread(self._post_otlp, traces)
+            else:
+                await asyncio.to_thread(self._write_file, traces)
+        except Exception:
+            logger.warning("Failed to export %d traces", len(traces), exc_info=True)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TRACE_EXPORT_INTERVAL)
+            await self.flush()
+
+    def start(self):
+        if self._task is None and TRACE_EXPORTER != "none":
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+trace_exporter = TraceExporter()
+
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with traced("encode json"):
+            return super().render(content)
+
+# Slow query capture
+#
+# Queries built by the search endpoints run through profiled_find /
+# profiled_distinct. Anything slower than SLOW_QUERY_THRESHOLD_MS is counted
+# under a fingerprint of its filter/sort shape (values replaced by
+# placeholders), and a sample of them is re-run with
+# explain("executionStats") in the background so the worst offenders can be
+# listed with their winning plan and docs examined vs returned.
+
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", "100"))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get("SLOW_QUERY_SAMPLE_RATE", "0.1"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+SLOW_QUERY_MAX_CONCURRENT_EXPLAINS = 2
+
+
+def query_shape(value: Any) -> Any:
+    """Replace literal values with placeholders so equivalent queries share a fingerprint"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    if isinstance(value, re.Pattern):
+        return "/regex/"
+    return "?"
+
+
+def query_fingerprint(collection: str, operation: str, spec: Dict[str, Any]) -> tuple:
+    # Sort, projection and distinct key are part of the shape; filter values are not
+    shaped = {
+        key: value if key in ("key", "sort", "projection") else query_shape(value)
+        for key, value in spec.items() if value is not None
+    }
+    shape = json.dumps({"collection": collection, "operation": operation, **shaped}, sort_keys=True)
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16], shape
+
+
+def summarize_plan(stage: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a winning plan into 'LIMIT > FETCH > IXSCAN(vessel_type_1)' plus scan/sort flags"""
+    stages = []
+    while stage:
+        name = stage.get("stage", "?")
+        stages.append(f"{name}({stage['indexName']})" if stage.get("indexName") else name)
+        stage = stage.get("inputStage") or (stage.get("inputStages") or [None])[0]
+    return {
+        "plan": " > ".join(stages),
+        "collscan": any(name.startswith("COLLSCAN") for name in stages),
+        "in_memory_sort": any(name.startswith("SORT") for name in stages),
+    }
+
+
+class SlowQueryProfiler:
+    def __init__(self):
+        self._last_explained: Dict[str, float] = {}
+        self._explain_slots = asyncio.Semaphore(SLOW_QUERY_MAX_CONCURRENT_EXPLAINS)
+        self._tasks: set = set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def observe(self, source: str, collection, operation: str, spec: Dict[str, Any], elapsed_ms: float):
+        if elapsed_ms < SLOW_QUERY_THRESHOLD_MS:
+            return
+        fingerprint, shape = query_fingerprint(collection.name, operation, spec)
+        self._spawn(self._record(fingerprint, shape, source, collection.name, operation, elapsed_ms))
+
+        now = time.monotonic()
+        if (
+            random.random() < SLOW_QUERY_SAMPLE_RATE
+            and now - self._last_explained.get(fingerprint, -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL
+        ):
+            self._last_explained[fingerprint] = now
+            self._spawn(self._explain(fingerprint, collection, operation, spec))
+
+    async def _record(self, fingerprint, shape, source, collection_name, operation, elapsed_ms):
+        try:
+            await db.slow_queries.update_one(
+                {"_id": fingerprint},
+                {
+                    "$inc": {"count": 1, "total_ms": elapsed_ms},
+                    "$max": {"max_ms": elapsed_ms},
+                    "$set": {"last_seen": datetime.utcnow()},
+                    "$setOnInsert": {
+                        "source": source,
+                        "collection": collection_name,
+                        "operation": operation,
+                        "shape": shape,
+                        "first_seen": datetime.utcnow(),
+                    },
+                },
+                upsert=True
+            )
+        except Exception:
+            logger.exception("Failed to record slow query %s", fingerprint)
+
+    async def _explain(self, fingerprint, collection, operation, spec):
+        async with self._explain_slots:
+            try:
+                command = {operation: collection.name, **{k: v for k, v in spec.items() if v is not None}}
+                result = await db.command({"explain": command, "verbosity": "executionStats"})
+                stats = result.get("executionStats", {})
+                returned = stats.get("nReturned", 0)
+                explain = {
+                    "docs_examined": stats.get("totalDocsExamined"),
+                    "keys_examined": stats.get("totalKeysExamined"),
+                    "returned": returned,
+                    "execution_ms": stats.get("executionTimeMillis"),
+                    "examined_per_returned": (stats.get("totalDocsExamined") or 0) / max(1, returned),
+                    "explained_at": datetime.utcnow(),
+                    **summarize_plan(result.get("queryPlanner", {}).get("winningPlan", {})),
+                }
+                await db.slow_queries.update_one({"_id": fingerprint}, {"$set": {"explain": explain}})
+            except Exception:
+                logger.exception("Failed to explain slow query %s", fingerprint)
+
+
+slow_query_profiler = SlowQueryProfiler()
+
+
+async def profiled_find(
+    source: str,
+    collection,
+    filter: Dict[str, Any],
+    sort: Optional[List[tuple]] = None,
+    skip: int = 0,
+    limit: int = 0,
+    projection: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    started = time.perf_counter()
+    cursor = collection.find(filter, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    cursor = cursor.skip(skip).limit(limit)
+    docs = await cursor.to_list(length=limit or None)
+    slow_query_profiler.observe(source, collection, "find", {
+        "filter": filter,
+        "sort": dict(sort) if sort else None,
+        "skip": skip or None,
+        "limit": limit or None,
+        "projection": projection,
+    }, (time.perf_counter() - started) * 1000)
+    return docs
+
+
+async def profiled_distinct(source: str, collection, key: str, filter: Optional[Dict[str, Any]] = None) -> List[Any]:
+    started = time.perf_counter()
+    values = await collection.distinct(key, filter)
+    slow_query_profiler.observe(source, collection, "distinct", {"key": key, "query": filter or {}},
+                                (time.perf_counter() - started) * 1000)
+    return values
+
+
+# Reference data
+#
+# Facet lists change only when vessels are written, so they are loaded once
+# (at startup, then lazily after each vessel write) instead of running four
+# distinct() queries on every page load.
+
+VESSEL_INDEXES = [
+    ([("id", 1)], {"unique": True}),
+    ([("vessel_type", 1)], {}),
+    ([("location", 1)], {}),
+    ([("daily_rate", 1)], {}),
+    ([("is_featured", -1), ("rating", -1)], {}),
+    ([("created_at", -1)], {}),
+    ([("tags", 1)], {}),
+    ([("features", 1)], {}),
+    ([("specifications.year_built", 1)], {}),
+    ([("vessel_type", 1), ("location", 1), ("daily_rate", 1)], {}),
+]
+
+REFERENCE_SECTIONS = ("vessel_types", "locations", "tags", "features")
+REFERENCE_SNAPSHOT_DIR = os.environ.get(
+    "REFERENCE_SNAPSHOT_DIR",
+    "/dev/shm/vessel-reference" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "vessel-reference")
+)
+REFERENCE_SNAPSHOT_MAX_AGE = float(os.environ.get("REFERENCE_SNAPSHOT_MAX_AGE", "30"))
+REFERENCE_REBUILD_DELAY = float(os.environ.get("REFERENCE_REBUILD_DELAY", "0.5"))
+REFERENCE_CHECK_INTERVAL = 0.25
+
+SNAPSHOT_MAGIC = b"VSLREF01"
+SNAPSHOT_HEADER = struct.Struct("<8sQI")  # magic, version (build time in ns), section count
+SNAPSHOT_ENTRY = struct.Struct("<16sII")  # section name, offset, length
+
+_reference_data: Optional[Dict[str, List[str]]] = None
+_reference_data_lock = asyncio.Lock()
+
+
+def _flatten_distinct(values: List[Any]) -> List[str]:
+    flattened = []
+    for value in values:
+        if isinstance(value, list):
+            flattened.extend(value)
+        else:
+            flattened.append(value)
+    return list(set(flattened))
+
+
+async def load_reference_data() -> Dict[str, List[str]]:
+    vessel_types, locations, tags, features = await asyncio.gather(
+        profiled_distinct("reference_data", db.vessels, "vessel_type"),
+        profiled_distinct("reference_data", db.vessels, "location"),
+        profiled_distinct("reference_data", db.vessels, "tags"),
+        profiled_distinct("reference_data", db.vessels, "features"),
+    )
+    return {
+        "vessel_types": vessel_types,
+        "locations": locations,
+        "tags": _flatten_distinct(tags),
+        "features": _flatten_distinct(features),
+    }
+
+
+def encode_reference_snapshot(data: Dict[str, List[str]], version: int) -> bytes:
+    """Pack string lists as: count, offsets[count + 1], utf-8 blob per section"""
+    table_end = SNAPSHOT_HEADER.size + SNAPSHOT_ENTRY.size * len(REFERENCE_SECTIONS)
+    entries = []
+    body = bytearray()
+    for name in REFERENCE_SECTIONS:
+        encoded = [str(value).encode("utf-8") for value in data.get(name, [])]
+        offsets = [0]
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        section = struct.pack(f"<{len(offsets) + 1}I", len(encoded), *offsets) + b"".join(encoded)
+        entries.append(SNAPSHOT_ENTRY.pack(name.encode("utf-8"), table_end + len(body), len(section)))
+        body += section
+        body += b"\0" * (-len(body) % 4)
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, version, len(entries)) + b"".join(entries) + bytes(body)
+
+
+class SnapshotStrings(Sequence):
+    """Read-only string list decoded on access straight from the mapped snapshot"""
+
+    def __init__(self, buffer: memoryview, offset: int):
+        (self._count,) = struct.unpack_from("<I", buffer, offset)
+        offsets_end = offset + 4 + 4 * (self._count + 1)
+        self._offsets = buffer[offset + 4:offsets_end].cast("I")
+        self._blob = buffer[offsets_end:]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("snapshot index out of range")
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+
+class ReferenceSnapshot:
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, self.version, count = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a reference snapshot")
+        self.sections: Dict[str, SnapshotStrings] = {}
+        for index in range(count):
+            name, offset, _ = SNAPSHOT_ENTRY.unpack_from(buffer, SNAPSHOT_HEADER.size + index * SNAPSHOT_ENTRY.size)
+            self.sections[name.rstrip(b"\0").decode("utf-8")] = SnapshotStrings(buffer, offset)
+
+
+class ReferenceSnapshotStore:
+    """Versioned reference-data snapshot shared by every worker on the host
+
+    One process builds the snapshot under an flock and publishes it with an
+    atomic rename; every worker maps the current file read-only and remaps
+    when the inode changes. Mappings of a replaced file stay valid until the
+    last reader drops them.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.path = Path(directory) / f"reference-{name}.bin"
+        self.lock_path = Path(directory) / f"reference-{name}.lock"
+        self._snapshot: Optional[ReferenceSnapshot] = None
+        self._identity = None
+        self._checked_at = 0.0
+        self._requested_at = 0
+        self._rebuild_task: Optional[asyncio.Task] = None
+
+    def current(self) -> Optional[ReferenceSnapshot]:
+        now = time.monotonic()
+        if now - self._checked_at >= REFERENCE_CHECK_INTERVAL:
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return self._snapshot
+            identity = (stat.st_ino, stat.st_mtime_ns)
+            if identity != self._identity:
+                self._snapshot = ReferenceSnapshot(self.path)
+                self._identity = identity
+        return self._snapshot
+
+    def _published_version(self) -> int:
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, _ = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            return version if magic == SNAPSHOT_MAGIC else 0
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    async def build(self, newer_than_ns: int = 0) -> bool:
+        """Publish a fresh snapshot unless another process already published one after ``newer_than_ns``"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+            if newer_than_ns and self._published_version() >= newer_than_ns:
+                return False
+            version = time.time_ns()
+            payload = encode_reference_snapshot(await load_reference_data(), version)
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+            logger.info("Published reference snapshot v%d (%d bytes)", version, len(payload))
+            return True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self._checked_at = 0.0
+
+    async def ensure_fresh(self, max_age_seconds: float = REFERENCE_SNAPSHOT_MAX_AGE):
+        await self.build(newer_than_ns=time.time_ns() - int(max_age_seconds * 1e9))
+        self.current()
+
+    def schedule_rebuild(self):
+        self._requested_at = time.time_ns()
+        if self._rebuild_task is None or self._rebuild_task.done():
+            self._rebuild_task = spawn(self._rebuild())
+
+    async def _rebuild(self):
+        built_for = 0
+        while built_for < self._requested_at:
+            requested = self._requested_at
+            await asyncio.sleep(REFERENCE_REBUILD_DELAY)
+            try:
+                await self.build(newer_than_ns=requested)
+            except Exception:
+                logger.exception("Failed to rebuild reference snapshot")
+                return
+            built_for = requested
+
+
+reference_snapshots = ReferenceSnapshotStore(REFERENCE_SNAPSHOT_DIR, os.environ['DB_NAME']) if REFERENCE_SNAPSHOT_DIR else None
+
+
+async def get_reference_data() -> Dict[str, Sequence[str]]:
+    global _reference_data
+    snapshot = reference_snapshots.current() if reference_snapshots else None
+    if snapshot is not None:
+        return snapshot.sections
+    if _reference_data is None:
+        async with _reference_data_lock:
+            if _reference_data is None:
+                _reference_data = await load_reference_data()
+    return _reference_data
+
+
+
+
+# Background maintenance
+#
+# Periodic jobs run in every worker but take a short Mongo lease first, so
+# only one process per deployment does the work for each interval.
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+background_tasks: set = set()
+
+
+def spawn(coro) -> asyncio.Task:
+    """Run ``coro`` in the background, keeping a reference so it is not garbage collected"""
+    # Outlives the request that spawned it, so its commands must not join that request's trace
+    context = contextvars.copy_context()
+    context.run(current_trace.set, None)
+    context.run(current_span_id.set, None)
+    task = asyncio.create_task(coro, context=context)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def drain_background_tasks():
+    """Wait for spawned work, including anything it spawns in turn; one-shot commands call this before exiting"""
+    while background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
+async def acquire_lease(name: str, seconds: float) -> bool:
+    now = datetime.utcnow()
+    try:
+        await db.leases.update_one(
+            {"_id": name, "expires_at": {"$lt": now}},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def run_periodically(name: str, interval: float, job, run_immediately: bool = False):
+    if not run_immediately:
+        await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+    while True:
+        try:
+            if await acquire_lease(name, interval * 0.9):
+                await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Periodic job %s failed", name)
+        await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+
+# Background jobs
+#
+# Long-running work (bulk loads, backfills, rollups) runs as jobs stored in
+# the ``jobs`` collection and executed by in-process workers. A worker claims
+# a job with find_one_and_update and keeps a lease on it while it runs, so a
+# job left behind by a crashed process is picked up again once its lease
+# expires. Failures are retried with exponential backoff; cancellation is a
+# flag the owning worker polls on every heartbeat.
+
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "2"))
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", "5"))
+JOB_HANDLERS: Dict[str, Any] = {}
+
+
+def job_handler(kind: str):
+    """Register ``async def handler(job: JobContext, **params)`` for a job kind"""
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+class JobContext:
+    def __init__(self, job: Dict[str, Any]):
+        self.id = job["id"]
+        self.kind = job["kind"]
+        self.attempt = job["attempts"]
+        self._last_report = 0.0
+
+    async def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None, force: bool = False):
+        """Record progress; writes are throttled to one per second"""
+        now = time.monotonic()
+        if not force and now - self._last_report < 1.0:
+            return
+        self._last_report = now
+        await db.jobs.update_one(
+            {"id": self.id},
+            {"$set": {"progress": {"done": done, "total": total, "message": message}, "updated_at": datetime.utcnow()}}
+        )
+
+
+class JobRunner:
+    def __init__(self, concurrency: int = JOB_CONCURRENCY):
+        self.concurrency = concurrency
+        self.running: Dict[str, asyncio.Task] = {}
+        self._workers: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    async def submit(self, kind: str, params: Optional[Dict[str, Any]] = None, max_attempts: int = 3) -> Job:
+        if kind not in JOB_HANDLERS:
+            raise HTTPException(status_code=400, detail=f"Unknown job kind: {kind}")
+        job = Job(kind=kind, params=params or {}, max_attempts=max_attempts)
+        await db.jobs.insert_one(job.dict())
+        self._wake.set()
+        return job
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        # A job whose lease expired on its last attempt (its worker died mid-run) is not retried
+        await db.jobs.update_many(
+            {"status": "running", "lease_expires_at": {"$lt": now}, "$expr": {"$gte": ["$attempts", "$max_attempts"]}},
+            {"$set": {
+                "status": "failed",
+                "error": "Lease expired on the last attempt",
+                "finished_at": now,
+                "updated_at": now,
+                "lease_expires_at": None,
+            }}
+        )
+        return await db.jobs.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "run_after": {"$lte": now}},
+                {"status": "running", "lease_expires_at": {"$lt": now}, "$expr": {"$lt": ["$attempts", "$max_attempts"]}},
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": WORKER_ID,
+                    "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "started_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_after", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _finish(self, job: Dict[str, Any], update: Dict[str, Any]):
+        now = datetime.utcnow()
+        await db.jobs.update_one(
+            {"id": job["id"], "lease_owner": WORKER_ID},
+            {"$set": {**update, "updated_at": now, "lease_expires_at": None}}
+        )
+
+    async def _heartbeat(self, job: Dict[str, Any], task: asyncio.Task):
+        while not task.done():
+            await asyncio.sleep(JOB_LEASE_SECONDS / 6)
+            current = await db.jobs.find_one_and_update(
+                {"id": job["id"], "lease_owner": WORKER_ID},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+                projection={"cancel_requested": 1}
+            )
+            if current is None or current.get("cancel_requested"):
+                task.cancel()
+                return
+
+    async def _execute(self, job: Dict[str, Any]):
+        handler = JOB_HANDLERS.get(job["kind"])
+        if handler is None:
+            await self._finish(job, {"status": "failed", "error": f"Unknown job kind: {job['kind']}", "finished_at": datetime.utcnow()})
+            return
+        if job.get("cancel_requested"):
+            await self._finish(job, {"status": "cancelled", "finished_at": datetime.utcnow()})
+            return
+
+        task = asyncio.create_task(handler(JobContext(job), **job["params"]))
+        self.running[job["id"]] = task
+        heartbeat = asyncio.create_task(self._heartbeat(job, task))
+        try:
+            result = await task
+            await self._finish(job, {"status": "succeeded", "result": jsonable_encoder(result), "finished_at": datetime.utcnow()})
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise
+            await self._finish(job, {"status": "cancelled", "finished_at": datetime.utcnow()})
+        except Exception as e:
+            logger.exception("Job %s (%s) failed on attempt %d", job["id"], job["kind"], job["attempts"])
+            if job["attempts"] < job["max_attempts"]:
+                delay = JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+                await self._finish(job, {
+                    "status": "queued",
+                    "error": str(e),
+                    "run_after": datetime.utcnow() + timedelta(seconds=delay),
+                })
+            else:
+                await self._finish(job, {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()})
+        finally:
+            heartbeat.cancel()
+            self.running.pop(job["id"], None)
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to claim a job")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    def start(self):
+        if not self._workers:
+            self._stopping = False
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Stop the workers and hand running jobs back to the queue for the next process"""
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        for task in self.running.values():
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await db.jobs.update_many(
+            {"status": "running", "lease_owner": WORKER_ID},
+            {"$set": {"status": "queued", "run_after": datetime.utcnow(), "lease_expires_at": None},
+             "$inc": {"attempts": -1}}
+        )
+
+
+job_runner = JobRunner()
+
+# Price histograms
+#
+# The marketplace price slider reads precomputed daily_rate buckets per
+# (vessel_type, location). Vessel writes adjust the affected bucket counts in
+# place (optimistic concurrency on a version field); a periodic $bucketAuto
+# recompute re-balances boundaries and corrects any drift.
+
+PRICE_HISTOGRAM_BUCKETS = int(os.environ.get("PRICE_HISTOGRAM_BUCKETS", "20"))
+PRICE_HISTOGRAM_RECOMPUTE_INTERVAL = float(os.environ.get("PRICE_HISTOGRAM_RECOMPUTE_INTERVAL", "3600"))
+
+
+def histogram_key(vessel_type: str, location: str) -> str:
+    return f"{vessel_type}|{location}"
+
+
+def adjust_buckets(buckets: List[Dict[str, Any]], rate: float, delta: int) -> List[Dict[str, Any]]:
+    buckets = [dict(bucket) for bucket in buckets]
+    if not buckets:
+        return [{"min": rate, "max": rate, "count": 1}] if delta > 0 else []
+    if delta > 0:
+        buckets[0]["min"] = min(buckets[0]["min"], rate)
+        buckets[-1]["max"] = max(buckets[-1]["max"], rate)
+    index = max(0, bisect.bisect_right([bucket["min"] for bucket in buckets], rate) - 1)
+    buckets[index]["count"] = max(0, buckets[index]["count"] + delta)
+    return buckets
+
+
+async def adjust_price_histogram(vessel_type: str, location: str, rate: float, delta: int, attempts: int = 5):
+    key = histogram_key(vessel_type, location)
+    for _ in range(attempts):
+        doc = await db.price_histograms.find_one({"_id": key})
+        now = datetime.utcnow()
+        if doc is None:
+            if delta < 0:
+                return
+            try:
+                await db.price_histograms.insert_one({
+                    "_id": key,
+                    "vessel_type": vessel_type,
+                    "location": location,
+                    "buckets": adjust_buckets([], rate, delta),
+                    "total": 1,
+                    "version": 0,
+                    "updated_at": now,
+                })
+                return
+            except DuplicateKeyError:
+                continue
+        buckets = adjust_buckets(doc["buckets"], rate, delta)
+        result = await db.price_histograms.update_one(
+            {"_id": key, "version": doc["version"]},
+            {
+                "$set": {"buckets": buckets, "total": sum(b["count"] for b in buckets), "updated_at": now},
+                "$inc": {"version": 1}
+            }
+        )
+        if result.modified_count:
+            return
+    logger.warning("Gave up adjusting price histogram %s after %d attempts", key, attempts)
+
+
+async def recompute_price_histograms() -> int:
+    """Rebuild every (vessel_type, location) histogram with $bucketAuto"""
+    pairs = await db.vessels.aggregate([
+        {"$match": {"daily_rate": {"$ne": None}}},
+        {"$group": {"_id": {"vessel_type": "$vessel_type", "location": "$location"}}},
+    ]).to_list(None)
+
+    keys = []
+    for pair in pairs:
+        vessel_type, location = pair["_id"]["vessel_type"], pair["_id"]["location"]
+        rows = await db.vessels.aggregate([
+            {"$match": {"vessel_type": vessel_type, "location": location, "daily_rate": {"$ne": None}}},
+            {"$bucketAuto": {"groupBy": "$daily_rate", "buckets": PRICE_HISTOGRAM_BUCKETS}},
+        ]).to_list(PRICE_HISTOGRAM_BUCKETS)
+        buckets = [{"min": row["_id"]["min"], "max": row["_id"]["max"], "count": row["count"]} for row in rows]
+        key = histogram_key(vessel_type, location)
+        keys.append(key)
+        now = datetime.utcnow()
+        await db.price_histograms.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "vessel_type": vessel_type,
+                    "location": location,
+                    "buckets": buckets,
+                    "total": sum(bucket["count"] for bucket in buckets),
+                    "recomputed_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"version": 1}
+            },
+            upsert=True
+        )
+    await db.price_histograms.delete_many({"_id": {"$nin": keys}})
+    return len(keys)
+
+
+def merge_histograms(histograms: List[Dict[str, Any]], bucket_count: int = PRICE_HISTOGRAM_BUCKETS) -> List[Dict[str, Any]]:
+    """Merge histograms with different boundaries, spreading counts by overlap, then coarsen"""
+    buckets = [bucket for histogram in histograms for bucket in histogram["buckets"] if bucket["count"]]
+    if len(histograms) == 1 or not buckets:
+        return buckets
+    edges = sorted({bucket["min"] for bucket in buckets} | {bucket["max"] for bucket in buckets})
+    if len(edges) == 1:
+        return [{"min": edges[0], "max": edges[0], "count": sum(bucket["count"] for bucket in buckets)}]
+
+    counts = [0.0] * (len(edges) - 1)
+    for bucket in buckets:
+        start = bisect.bisect_left(edges, bucket["min"])
+        end = bisect.bisect_left(edges, bucket["max"])
+        width = bucket["max"] - bucket["min"]
+        if width <= 0 or end <= start:
+            counts[min(start, len(counts) - 1)] += bucket["count"]
+            continue
+        for index in range(start, end):
+            counts[index] += bucket["count"] * (edges[index + 1] - edges[index]) / width
+
+    group = max(1, math.ceil(len(counts) / bucket_count))
+    return [
+        {
+            "min": edges[index],
+            "max": edges[min(index + group, len(counts))],
+            "count": round(sum(counts[index:index + group])),
+        }
+        for index in range(0, len(counts), group)
+    ]
+
+
+async def apply_price_histogram_changes(changes: Optional[List["VesselChange"]]):
+    if changes is None:
+        await recompute_price_histograms()
+        return
+
+    def entry(doc):
+        if doc and doc.get("daily_rate") is not None:
+            return doc["vessel_type"], doc["location"], float(doc["daily_rate"])
+        return None
+
+    for change in changes:
+        old, new = entry(change.before), entry(change.after)
+        if old == new:
+            continue
+        if old:
+            await adjust_price_histogram(*old, delta=-1)
+        if new:
+            await adjust_price_histogram(*new, delta=1)
+
+# Fuzzy suggestions
+#
+# Suggestions fall back to an in-memory n-gram index when the exact
+# substring match comes up short. Candidates are the terms sharing the most
+# of the query's rarest n-grams, re-ranked by edit distance to the closest
+# run of words in the term. The index tracks which terms each vessel contributes,
+# so applying a vessel document is idempotent and works the same from the
+# local write hook and from the change feed.
+
+SUGGESTION_FIELDS = (
+    ("vessel_name", "vessel_name"),
+    ("vessel_type", "vessel_type"),
+    ("location", "location"),
+    ("tag", "tags"),
+    ("feature", "features"),
+)
+SUGGESTION_GRAM_SIZE = 4
+SUGGESTION_MAX_EDITS = 2
+SUGGESTION_RERANK = 12
+_non_word = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_term(value: str) -> str:
+    return _non_word.sub(" ", value.lower()).strip()
+
+
+def ngrams(text: str, size: int = SUGGESTION_GRAM_SIZE) -> set:
+    padded = f" {text} "
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def edit_distance(pattern_masks: Dict[str, int], length: int, text: str) -> int:
+    """Levenshtein distance using Myers' bit-parallel algorithm; masks come from ``pattern_bitmasks``"""
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv, mv, score = mask, 0, length
+    for char in text:
+        eq = pattern_masks.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return score
+
+
+def pattern_bitmasks(pattern: str) -> Dict[str, int]:
+    masks: Dict[str, int] = {}
+    for index, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << index)
+    return masks
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self.terms: List[Optional[tuple]] = []  # term id -> (type, value, normalized, words)
+        self.term_ids: Dict[tuple, int] = {}
+        self.refcounts: List[int] = []
+        self.postings: Dict[str, set] = {}
+        self.vessel_terms: Dict[str, set] = {}
+        self.ready = False
+        self._pending: Optional[List[tuple]] = None  # changes seen while a rebuild reads Mongo
+        self._rebuild_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.term_ids)
+
+    def _acquire(self, key: tuple):
+        term_id = self.term_ids.get(key)
+        if term_id is None:
+            normalized = normalize_term(key[1])
+            if not normalized:
+                return
+            term_id = len(self.terms)
+            self.terms.append((key[0], key[1], normalized, normalized.split()))
+            self.refcounts.append(0)
+            self.term_ids[key] = term_id
+            for gram in ngrams(normalized):
+                self.postings.setdefault(gram, set()).add(term_id)
+        self.refcounts[term_id] += 1
+
+    def _release(self, key: tuple):
+        term_id = self.term_ids.get(key)
+        if term_id is None:
+            return
+        self.refcounts[term_id] -= 1
+        if self.refcounts[term_id] > 0:
+            return
+        del self.term_ids[key]
+        for gram in ngrams(self.terms[term_id][2]):
+            posting = self.postings[gram]
+            posting.discard(term_id)
+            if not posting:
+                del self.postings[gram]
+        self.terms[term_id] = None
+
+    def add_term(self, suggestion_type: str, value: str):
+        """Index a standalone term (not owned by any vessel)"""
+        self._acquire((suggestion_type, value))
+
+    def upsert_vessel(self, vessel: Dict[str, Any]):
+        keys = set()
+        for suggestion_type, field in SUGGESTION_FIELDS:
+            value = vessel.get(field)
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, str) and item:
+                    keys.add((suggestion_type, item))
+        previous = self.vessel_terms.get(vessel["id"], set())
+        for key in keys - previous:
+            self._acquire(key)
+        for key in previous - keys:
+            self._release(key)
+        self.vessel_terms[vessel["id"]] = keys
+
+    def remove_vessel(self, vessel_id: str):
+        for key in self.vessel_terms.pop(vessel_id, set()):
+            self._release(key)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        normalized = normalize_term(query)
+        if len(normalized) < 3:
+            return []
+        max_distance = min(SUGGESTION_MAX_EDITS, max(1, len(normalized) // 4))
+
+        # A match within max_distance edits keeps all but SUGGESTION_GRAM_SIZE grams per edit, so it
+        # shares at least one of the rarest few query grams; counting only those keeps lookups cheap
+        postings = sorted(
+            (self.postings[gram] for gram in ngrams(normalized) if gram in self.postings), key=len
+        )[:SUGGESTION_GRAM_SIZE * max_distance + 1]
+        counts: Counter = Counter()
+        for posting in postings:
+            counts.update(posting)
+
+        masks = pattern_bitmasks(normalized)
+        length = len(normalized)
+        query_words = normalized.count(" ") + 1
+        ranked = []
+        for term_id, count in counts.most_common(SUGGESTION_RERANK):
+            suggestion_type, value, term, words = self.terms[term_id]
+            if len(words) <= query_words:
+                windows = [term]
+            else:
+                windows = [" ".join(words[start:start + query_words]) for start in range(len(words) - query_words + 1)]
+            distance = min(
+                (edit_distance(masks, length, window) for window in windows
+                 if abs(len(window) - length) <= max_distance),
+                default=max_distance + 1
+            )
+            if distance <= max_distance:
+                ranked.append((distance, -count, -self.refcounts[term_id], len(term), suggestion_type, value))
+        ranked.sort()
+        return [
+            {"type": suggestion_type, "value": value, "distance": distance}
+            for distance, _, _, _, suggestion_type, value in ranked[:limit]
+        ]
+
+    async def rebuild(self):
+        """Replace the index with a full read; changes seen meanwhile are replayed on top"""
+        async with self._rebuild_lock:
+            self._pending = []
+            try:
+                index = SuggestionIndex()
+                projection = {"_id": 0, "id": 1, **{field: 1 for _, field in SUGGESTION_FIELDS}}
+                async for vessel in db.vessels.find({}, projection):
+                    index.upsert_vessel(vessel)
+                for operation, value in self._pending:
+                    index._apply(operation, value)
+            finally:
+                self._pending = None
+            index.ready = True
+            index._rebuild_lock = self._rebuild_lock
+            self.__dict__.update(index.__dict__)
+        logger.info("Suggestion index built with %d terms", len(self))
+
+    def _apply(self, operation: str, value: Any):
+        if self._pending is not None:
+            self._pending.append((operation, value))
+        elif operation == "upsert":
+            self.upsert_vessel(value)
+        else:
+            self.remove_vessel(value)
+
+    def apply_changes(self, changes: Optional[List["VesselChange"]]):
+        if changes is None:
+            spawn(self.rebuild())
+            return
+        for change in changes:
+            if change.after is not None:
+                self._apply("upsert", change.after)
+            elif change.before is not None:
+                self._apply("remove", change.before["id"])
+
+    def on_feed_event(self, event: Dict[str, Any]):
+        if event.get("vessel"):
+            self._apply("upsert", event["vessel"])
+        elif event["operation"] == "delete" and event.get("vessel_id"):
+            self._apply("remove", event["vessel_id"])
+
+
+suggestion_index = SuggestionIndex()
+
+
+def benchmark_suggestions(terms: int = 100_000, queries: int = 2_000, seed: int = 7) -> Dict[str, Any]:
+    """Time fuzzy lookups against a synthetic vocabulary with one or two typos per query"""
+    rng = random.Random(seed)
+    syllables = [c + v + coda for c in "bcdfghklmnprstvwz" for v in "aeiou" for coda in ("", "n", "r", "s", "t", "l")]
+    index = SuggestionIndex()
+    vocabulary = set()
+    while len(vocabulary) < terms:
+        words = [
+            "".join(rng.choice(syllables) for _ in range(rng.randint(2, 3)))
+            for _ in range(rng.randint(1, 3))
+        ]
+        vocabulary.add(" ".join(words))
+    vocabulary = sorted(vocabulary)
+    for value in vocabulary:
+        index.add_term("tag", value)
+
+    def typo(text: str) -> str:
+        chars = list(text)
+        for _ in range(rng.randint(1, 2)):
+            position = rng.randrange(len(chars))
+            action = rng.choice(("drop", "swap", "replace"))
+            if action == "drop" and len(chars) > 3:
+                del chars[position]
+            elif action == "swap" and position < len(chars) - 1:
+                chars[position], chars[position + 1] = chars[position + 1], chars[position]
+            else:
+                chars[position] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+        return "".join(chars)
+
+    samples = [rng.choice(vocabulary) for _ in range(queries)]
+    timings = []
+    hits = 0
+    for expected in samples:
+        query = typo(expected)
+        started = time.perf_counter()
+        results = index.search(query)
+        timings.append((time.perf_counter() - started) * 1000)
+        hits += any(result["value"] == expected for result in results)
+    timings.sort()
+    return {
+        "terms": len(index),
+        "queries": queries,
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p99_ms": round(timings[int(len(timings) * 0.99)], 3),
+        "recall": round(hits / queries, 3),
+    }
+
+# Similar vessels
+#
+# A dense feature matrix (one row per vessel) is kept in memory for
+# nearest-neighbour lookups: z-scored numeric columns (log-scaled sizes and
+# rates, missing values imputed at the mean) followed by weighted one-hot
+# vessel type and tag columns. Rows and columns grow in place as vessels are
+# written; normalization statistics are fixed at the last full rebuild.
+
+SIMILAR_NUMERIC_FIELDS = (
+    ("length", True),
+    ("crew_capacity", True),
+    ("tonnage", True),
+    ("year_built", False),
+    ("deck_space", True),
+    ("fuel_capacity", True),
+    ("daily_rate", True),
+)
+SIMILAR_TYPE_WEIGHT = float(os.environ.get("SIMILAR_TYPE_WEIGHT", "2.0"))
+SIMILAR_TAG_WEIGHT = float(os.environ.get("SIMILAR_TAG_WEIGHT", "1.0"))
+
+
+def vessel_numeric_features(vessel: Dict[str, Any]) -> np.ndarray:
+    specifications = vessel.get("specifications") or {}
+    values = []
+    for field, log_scaled in SIMILAR_NUMERIC_FIELDS:
+        value = vessel.get(field) if field == "daily_rate" else specifications.get(field)
+        if value is None or value < 0:
+            values.append(np.nan)
+        else:
+            values.append(math.log1p(value) if log_scaled else float(value))
+    return np.array(values, dtype=np.float32)
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self.ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.numeric_width = len(SIMILAR_NUMERIC_FIELDS)
+        self.columns: Dict[tuple, int] = {}  # ("type" | "tag", value) -> column
+        self.matrix = np.zeros((0, self.numeric_width), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.mean = np.zeros(self.numeric_width, dtype=np.float32)
+        self.std = np.ones(self.numeric_width, dtype=np.float32)
+        self.ready = False
+        self._pending: Optional[List[tuple]] = None  # changes seen while a rebuild reads Mongo
+        self._rebuild_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _column(self, key: tuple) -> int:
+        column = self.columns.get(key)
+        if column is None:
+            column = self.numeric_width + len(self.columns)
+            self.columns[key] = column
+            if column >= self.matrix.shape[1]:
+                extra = max(16, self.matrix.shape[1] - self.numeric_width)
+                self.matrix = np.hstack([self.matrix, np.zeros((self.matrix.shape[0], extra), dtype=np.float32)])
+        return column
+
+    def _row(self) -> int:
+        if self.free:
+            return self.free.pop()
+        row = len(self.ids)
+        self.ids.append(None)
+        if row >= self.matrix.shape[0]:
+            extra = max(64, self.matrix.shape[0])
+            self.matrix = np.vstack([self.matrix, np.zeros((extra, self.matrix.shape[1]), dtype=np.float32)])
+            self.norms = np.concatenate([self.norms, np.zeros(extra, dtype=np.float32)])
+            self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        return row
+
+    def vector(self, vessel: Dict[str, Any]) -> np.ndarray:
+        type_column = self._column(("type", vessel["vessel_type"])) if vessel.get("vessel_type") else None
+        tag_columns = [self._column(("tag", tag)) for tag in set(vessel.get("tags") or []) if tag]
+        vector = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        numeric = (vessel_numeric_features(vessel) - self.mean) / self.std
+        vector[:self.numeric_width] = np.nan_to_num(numeric, nan=0.0)
+        if type_column is not None:
+            vector[type_column] = SIMILAR_TYPE_WEIGHT
+        for column in tag_columns:
+            vector[column] = SIMILAR_TAG_WEIGHT / math.sqrt(len(tag_columns))
+        return vector
+
+    def upsert_vessel(self, vessel: Dict[str, Any]):
+        vector = self.vector(vessel)
+        row = self.rows.get(vessel["id"])
+        if row is None:
+            row = self._row()
+            self.rows[vessel["id"]] = row
+            self.ids[row] = vessel["id"]
+        self.matrix[row] = vector
+        self.norms[row] = vector @ vector
+        self.alive[row] = True
+
+    def remove_vessel(self, vessel_id: str):
+        row = self.rows.pop(vessel_id, None)
+        if row is not None:
+            self.alive[row] = False
+            self.matrix[row] = 0
+            self.norms[row] = 0
+            self.ids[row] = None
+            self.free.append(row)
+
+    def nearest(self, vessel: Dict[str, Any], limit: int = 6) -> List[tuple]:
+        """(vessel_id, distance) pairs for the closest vessels, excluding ``vessel`` itself"""
+        row = self.rows.get(vessel["id"])
+        vector = self.matrix[row] if row is not None else self.vector(vessel)
+        # |a - b|^2 = |a|^2 - 2ab + |b|^2, one matrix-vector product without a temporary copy
+        distances = self.norms - 2 * (self.matrix @ vector) + vector @ vector
+        distances[~self.alive] = np.inf
+        if row is not None:
+            distances[row] = np.inf
+        limit = min(limit, len(self.rows) - (row is not None))
+        if limit <= 0:
+            return []
+        nearest = np.argpartition(distances, limit - 1)[:limit]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(self.ids[index], float(np.sqrt(max(distances[index], 0.0)))) for index in nearest]
+
+    async def rebuild(self):
+        """Replace the index with a full read; changes seen meanwhile are replayed on top"""
+        async with self._rebuild_lock:
+            await self._rebuild()
+
+    async def ensure_ready(self):
+        """Build the index unless it is built already; concurrent callers share one build"""
+        async with self._rebuild_lock:
+            if not self.ready:
+                await self._rebuild()
+
+    async def _rebuild(self):
+        projection = {"_id": 0, "id": 1, "vessel_type": 1, "tags": 1, "daily_rate": 1, "specifications": 1}
+        self._pending = []
+        try:
+            vessels = await db.vessels.find({}, projection).to_list(None)
+            index = SimilarityIndex()
+            if vessels:
+                numeric = np.vstack([vessel_numeric_features(vessel) for vessel in vessels])
+                with np.errstate(all="ignore"):
+                    mean = np.nanmean(numeric, axis=0)
+                    std = np.nanstd(numeric, axis=0)
+                index.mean = np.nan_to_num(mean, nan=0.0).astype(np.float32)
+                index.std = np.where(np.nan_to_num(std, nan=0.0) > 0, std, 1.0).astype(np.float32)
+            for vessel in vessels:
+                index.upsert_vessel(vessel)
+            for operation, value in self._pending:
+                index._apply(operation, value)
+        finally:
+            self._pending = None
+        index.ready = True
+        index._rebuild_lock = self._rebuild_lock
+        self.__dict__.update(index.__dict__)
+        logger.info("Similarity index built with %d vessels and %d columns", len(self), self.matrix.shape[1])
+
+    def _apply(self, operation: str, value: Any):
+        if self._pending is not None:
+            self._pending.append((operation, value))
+        elif operation == "upsert":
+            self.upsert_vessel(value)
+        else:
+            self.remove_vessel(value)
+
+    def apply_changes(self, changes: Optional[List["VesselChange"]]):
+        if changes is None:
+            spawn(self.rebuild())
+            return
+        for change in changes:
+            if change.after is not None:
+                self._apply("upsert", change.after)
+            elif change.before is not None:
+                self._apply("remove", change.before["id"])
+
+    def on_feed_event(self, event: Dict[str, Any]):
+        if event.get("vessel"):
+            self._apply("upsert", event["vessel"])
+        elif event["operation"] == "delete" and event.get("vessel_id"):
+            self._apply("remove", event["vessel_id"])
+
+
+similarity_index = SimilarityIndex()
+
+# Vessel catalog
+#
+# Optional in-process replica of the vessels collection
+# (VESSEL_CATALOG_ENABLED). It is loaded in full at startup and kept in sync
+# from the vessel change feed and from this process's own writes; it only
+# answers queries while the feed is up and has not lost history since the
+# last load, and reloads as soon as a feed event shows history was lost
+# (on MongoDB before 6.0 that is every delete). Documents are kept as Vessel dicts next to column arrays:
+# dictionary-coded strings, float columns (nan for missing) with lazily
+# sorted indexes for range filters, and postings for tags and features.
+# The catalog evaluates the filter and sort documents vessel_search_query
+# builds; anything else raises CatalogUnsupported and goes to Mongo.
+
+VESSEL_CATALOG_ENABLED = os.environ.get("VESSEL_CATALOG_ENABLED", "false").lower() == "true"
+VESSEL_CATALOG_CHECK_INTERVAL = float(os.environ.get("VESSEL_CATALOG_CHECK_INTERVAL", "300"))
+VESSEL_CATALOG_RECHECK_DELAY = 1.0  # lets in-flight feed events land before differences are re-read
+CATALOG_CATEGORICAL_FIELDS = ("vessel_type", "location", "availability_status")
+CATALOG_NUMERIC_FIELDS = ("daily_rate", "rating", "specifications.year_built", "created_at", "is_featured")
+CATALOG_RANGE_INDEXED = ("daily_rate", "specifications.year_built")
+CATALOG_MULTI_FIELDS = ("tags", "features")
+
+
+class CatalogUnsupported(Exception):
+    """A filter or sort the catalog cannot evaluate"""
+
+
+def catalog_document(vessel: Dict[str, Any]) -> Dict[str, Any]:
+    """``vessel`` as MongoDB would return it after a round trip (datetimes at millisecond precision)"""
+    doc = Vessel(**vessel).dict()
+    for field in ("created_at", "updated_at"):
+        doc[field] = doc[field].replace(microsecond=doc[field].microsecond // 1000 * 1000)
+    return doc
+
+
+def catalog_numeric_value(doc: Dict[str, Any], field: str) -> float:
+    if field == "specifications.year_built":
+        value = (doc.get("specifications") or {}).get("year_built")
+    else:
+        value = doc.get(field)
+    if value is None:
+        return np.nan
+    if isinstance(value, datetime):
+        return (value - datetime(1970, 1, 1)).total_seconds()
+    return float(value)
+
+
+class VesselCatalog:
+    def __init__(self):
+        self.rows: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.docs: List[Optional[Dict[str, Any]]] = []
+        self.names: List[str] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.codes = {field: np.zeros(0, dtype=np.int32) for field in CATALOG_CATEGORICAL_FIELDS}
+        self.dictionaries: Dict[str, Dict[str, int]] = {field: {} for field in CATALOG_CATEGORICAL_FIELDS}
+        self.numeric = {field: np.zeros(0, dtype=np.float64) for field in CATALOG_NUMERIC_FIELDS}
+        self.postings: Dict[str, Dict[str, set]] = {field: {} for field in CATALOG_MULTI_FIELDS}
+        self.row_values: Dict[str, List[set]] = {field: [] for field in CATALOG_MULTI_FIELDS}
+        self.sorted: Dict[str, tuple] = {}
+        self.ready = False
+        self.loaded_at: Optional[datetime] = None
+        self.feed_resets = 0
+        self.last_check: Optional[Dict[str, Any]] = None
+        self._pending: Optional[List[tuple]] = None
+        self._load_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._reload: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def serving(self) -> bool:
+        return self.ready and vessel_feed.available and self.feed_resets == vessel_feed.history_resets
+
+    def _row(self) -> int:
+        if self.free:
+            return self.free.pop()
+        row = len(self.docs)
+        self.docs.append(None)
+        self.names.append("")
+        for values in self.row_values.values():
+            values.append(set())
+        if row >= len(self.alive):
+            extra = max(1024, len(self.alive))
+            self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+            for field, codes in self.codes.items():
+                self.codes[field] = np.concatenate([codes, np.full(extra, -1, dtype=np.int32)])
+            for field, column in self.numeric.items():
+                self.numeric[field] = np.concatenate([column, np.full(extra, np.nan)])
+        return row
+
+    def _unindex(self, row: int):
+        for field, values in self.row_values.items():
+            for value in values[row]:
+                self.postings[field][value].discard(row)
+            values[row] = set()
+
+    def upsert_vessel(self, vessel: Dict[str, Any]):
+        doc = catalog_document(vessel)
+        row = self.rows.get(doc["id"])
+        if row is None:
+            row = self._row()
+            self.rows[doc["id"]] = row
+        else:
+            self._unindex(row)
+        numeric = [catalog_numeric_value(doc, field) for field in CATALOG_NUMERIC_FIELDS]
+        self._invalidate_sorted(row, numeric)
+        self.docs[row] = doc
+        self.names[row] = doc["vessel_name"]
+        self.alive[row] = True
+        for field in CATALOG_CATEGORICAL_FIELDS:
+            value = doc.get(field)
+            self.codes[field][row] = -1 if value is None else self.dictionaries[field].setdefault(value, len(self.dictionaries[field]))
+        for field, value in zip(CATALOG_NUMERIC_FIELDS, numeric):
+            self.numeric[field][row] = value
+        for field in CATALOG_MULTI_FIELDS:
+            values = set(doc.get(field) or [])
+            self.row_values[field][row] = values
+            for value in values:
+                self.postings[field].setdefault(value, set()).add(row)
+
+    def remove_vessel(self, vessel_id: str):
+        row = self.rows.pop(vessel_id, None)
+        if row is None:
+            return
+        self._unindex(row)
+        self._invalidate_sorted(row, [np.nan] * len(CATALOG_NUMERIC_FIELDS))
+        self.docs[row] = None
+        self.names[row] = ""
+        self.alive[row] = False
+        for codes in self.codes.values():
+            codes[row] = -1
+        for column in self.numeric.values():
+            column[row] = np.nan
+        self.free.append(row)
+
+    def _invalidate_sorted(self, row: int, values: List[float]):
+        """Drop the sorted indexes of fields whose value at ``row`` changes"""
+        for field, value in zip(CATALOG_NUMERIC_FIELDS, values):
+            old = self.numeric[field][row]
+            if field in self.sorted and not (old == value or (np.isnan(old) and np.isnan(value))):
+                del self.sorted[field]
+
+    def get(self, vessel_id: str) -> Optional[Dict[str, Any]]:
+        row = self.rows.get(vessel_id)
+        return self.docs[row] if row is not None else None
+
+    # Query evaluation
+
+    def _rows_mask(self, rows) -> np.ndarray:
+        mask = np.zeros(len(self.alive), dtype=bool)
+        if rows:
+            mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+        return mask
+
+    def _equals(self, field: str, value: Any) -> np.ndarray:
+        pattern = value if isinstance(value, re.Pattern) else None
+        if field == "id" and pattern is None:
+            return self._rows_mask([self.rows[value]] if value in self.rows else [])
+        if field == "vessel_name":
+            mask = np.zeros(len(self.alive), dtype=bool)
+            mask[:len(self.names)] = [
+                pattern.search(name) is not None if pattern else name == value for name in self.names
+            ]
+            return mask
+        if field in self.codes:
+            dictionary = self.dictionaries[field]
+            if pattern is None:
+                return self.codes[field] == dictionary.get(value, -2)
+            matched = [code for text, code in dictionary.items() if pattern.search(text)]
+            return np.isin(self.codes[field], matched)
+        if field in self.postings:
+            postings = self.postings[field]
+            if pattern is None:
+                return self._rows_mask(postings.get(value, ()))
+            rows = set()
+            for text, value_rows in postings.items():
+                if pattern.search(text):
+                    rows |= value_rows
+            return self._rows_mask(rows)
+        if field in self.numeric and pattern is None and isinstance(value, (bool, int, float)):
+            return self.numeric[field] == float(value)
+        raise CatalogUnsupported(f"{field}: {value!r}")
+
+    def _sorted_index(self, field: str) -> tuple:
+        if field not in self.sorted:
+            order = np.argsort(self.numeric[field], kind="stable")  # nan (missing or dead) sorts last
+            self.sorted[field] = (order, self.numeric[field][order])
+        return self.sorted[field]
+
+    def _range(self, field: str, operators: Dict[str, Any]) -> np.ndarray:
+        if field in CATALOG_RANGE_INDEXED:
+            order, values = self._sorted_index(field)
+            low, high = 0, int(np.count_nonzero(~np.isnan(values)))
+            for operator, bound in operators.items():
+                if operator in ("$gte", "$gt"):
+                    low = max(low, int(np.searchsorted(values, bound, "left" if operator == "$gte" else "right")))
+                else:
+                    high = min(high, int(np.searchsorted(values, bound, "right" if operator == "$lte" else "left")))
+            return self._rows_mask(order[low:high].tolist())
+        column = self.numeric[field]
+        mask = ~np.isnan(column)
+        with np.errstate(invalid="ignore"):
+            for operator, bound in operators.items():
+                mask &= {"$gte": column >= bound, "$gt": column > bound, "$lte": column <= bound, "$lt": column < bound}[operator]
+        return mask
+
+    def _match(self, query: Dict[str, Any]) -> np.ndarray:
+        mask = self.alive.copy()
+        for field, condition in query.items():
+            if field == "$or":
+                any_clause = np.zeros(len(self.alive), dtype=bool)
+                for clause in condition:
+                    any_clause |= self._match(clause)
+                mask &= any_clause
+            elif not isinstance(condition, dict):
+                mask &= self._equals(field, condition)
+            elif set(condition) <= {"$regex", "$options"}:
+                flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+                mask &= self._equals(field, re.compile(condition["$regex"], flags))
+            elif set(condition) <= {"$gte", "$gt", "$lte", "$lt"} and field in self.numeric:
+                mask &= self._range(field, condition)
+            elif set(condition) == {"$in"}:
+                any_value = np.zeros(len(self.alive), dtype=bool)
+                for value in condition["$in"]:
+                    any_value |= self._equals(field, value)
+                mask &= any_value
+            else:
+                raise CatalogUnsupported(f"{field}: {condition!r}")
+        return mask
+
+    def find(
+        self,
+        query: Dict[str, Any],
+        sort: Optional[List[tuple]] = None,
+        skip: int = 0,
+        limit: int = 0
+    ) -> List[Dict[str, Any]]:
+        """Matching documents in Mongo's order for ``sort`` (missing values lowest); do not mutate them"""
+        rows = np.flatnonzero(self._match(query))
+        if sort:
+            keys = []
+            for field, direction in reversed(sort):
+                if field not in self.numeric:
+                    raise CatalogUnsupported(f"sort on {field}")
+                key = np.nan_to_num(self.numeric[field][rows], nan=-np.inf)
+                keys.append(key if direction == 1 else -key)
+            rows = rows[np.lexsort(keys)]
+        rows = rows[skip:skip + limit] if limit else rows[skip:]
+        return [self.docs[row] for row in rows]
+
+    # Sync
+
+    def _apply(self, operation: str, value: Any):
+        if self._pending is not None:
+            self._pending.append((operation, value))
+        elif operation == "upsert":
+            self.upsert_vessel(value)
+        else:
+            self.remove_vessel(value)
+
+    def apply_changes(self, changes: Optional[List["VesselChange"]]):
+        if not self.ready and self._pending is None:
+            return
+        if changes is None:
+            spawn(self.load())
+            return
+        for change in changes:
+            if change.after is not None:
+                self._apply("upsert", change.after)
+            elif change.before is not None:
+                self._apply("remove", change.before["id"])
+
+    def on_feed_event(self, event: Dict[str, Any]):
+        if event.get("vessel"):
+            self._apply("upsert", event["vessel"])
+        elif event["operation"] == "delete" and event.get("vessel_id"):
+            self._apply("remove", event["vessel_id"])
+        if self.ready and self.feed_resets != vessel_feed.history_resets:
+            self.reload_soon()
+
+    def reload_soon(self):
+        """Queue a load unless one is already waiting; a load in progress may predate the latest reset"""
+        if self._reload is None or self._reload.done():
+            self._reload = spawn(self.load())
+
+    async def load(self):
+        """Replace the catalog with a full read; changes seen meanwhile are replayed on top
+
+        Loads run one at a time, so each one's buffer of changes is its own.
+        """
+        async with self._load_lock:
+            self._pending = []
+            feed_resets = vessel_feed.history_resets
+            started = time.perf_counter()
+            try:
+                catalog = VesselCatalog()
+                async for vessel in db.vessels.find({}, {"_id": 0}):
+                    catalog.upsert_vessel(vessel)
+                    if len(catalog.docs) % 1000 == 0:
+                        await asyncio.sleep(0)
+                for operation, value in self._pending:
+                    catalog._apply(operation, value)
+            finally:
+                self._pending = None
+            catalog.ready = True
+            catalog.loaded_at = datetime.utcnow()
+            catalog.feed_resets = feed_resets
+            catalog.last_check = self.last_check
+            catalog._task = self._task
+            catalog._reload = self._reload
+            catalog._load_lock = self._load_lock
+            self.__dict__.update(catalog.__dict__)
+        logger.info("Vessel catalog loaded %d vessels in %.0f ms", len(self), (time.perf_counter() - started) * 1000)
+
+    async def check(self, queries: int = 20, seed: Optional[int] = None) -> Dict[str, Any]:
+        """Compare every document and a sample of searches against Mongo"""
+        expected = {}
+        async for vessel in db.vessels.find({}, {"_id": 0}):
+            expected[vessel["id"]] = catalog_document(vessel)
+        missing = [vessel_id for vessel_id in expected if vessel_id not in self.rows]
+        extra = [vessel_id for vessel_id in self.rows if vessel_id not in expected]
+        stale = [
+            vessel_id for vessel_id, doc in expected.items()
+            if vessel_id in self.rows and self.get(vessel_id) != doc
+        ]
+        mismatched = []
+        for query, sort in sample_vessel_queries(self, queries, seed):
+            if not await self._query_agrees(query):
+                mismatched.append(query)
+
+        # The full read spans the feed's updates; only differences that persist count
+        if missing or extra or stale or mismatched:
+            await asyncio.sleep(VESSEL_CATALOG_RECHECK_DELAY)
+            differing = set(missing + extra + stale)
+            current = {
+                vessel["id"]: catalog_document(vessel)
+                async for vessel in db.vessels.find({"id": {"$in": list(differing)}}, {"_id": 0})
+            }
+            missing = [vessel_id for vessel_id in current if vessel_id not in self.rows]
+            extra = [vessel_id for vessel_id in differing if vessel_id in self.rows and vessel_id not in current]
+            stale = [
+                vessel_id for vessel_id, doc in current.items()
+                if vessel_id in self.rows and self.get(vessel_id) != doc
+            ]
+            mismatched = [query for query in mismatched if not await self._query_agrees(query)]
+        result = {
+            "checked_at": datetime.utcnow(),
+            "vessels": len(expected),
+            "missing": missing[:20],
+            "extra": extra[:20],
+            "stale": stale[:20],
+            "mismatched_queries": [str(query) for query in mismatched[:5]],
+            "consistent": not (missing or extra or stale or mismatched),
+        }
+        self.last_check = result
+        return result
+
+    async def _query_agrees(self, query: Dict[str, Any]) -> bool:
+        found = {doc["id"] for doc in await db.vessels.find(query, {"_id": 0, "id": 1}).to_list(None)}
+        return found == {doc["id"] for doc in self.find(query)}
+
+    async def _run(self):
+        await self.load()
+        while True:
+            await asyncio.sleep(VESSEL_CATALOG_CHECK_INTERVAL)
+            try:
+                if self.feed_resets != vessel_feed.history_resets or not (await self.check())["consistent"]:
+                    logger.warning("Vessel catalog out of sync with MongoDB; reloading")
+                    await self.load()
+            except Exception:
+                logger.exception("Vessel catalog check failed")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.ready = False
+
+
+vessel_catalog = VesselCatalog()
+
+
+def sample_vessel_queries(catalog: VesselCatalog, count: int, seed: Optional[int] = None) -> List[tuple]:
+    """(query, sort) pairs shaped like get_vessels requests, drawn from the catalog's values"""
+    rng = random.Random(seed)
+    types = list(catalog.dictionaries["vessel_type"])
+    locations = list(catalog.dictionaries["location"])
+    tags = [tag for tag, rows in catalog.postings["tags"].items() if rows]
+    features = [feature for feature, rows in catalog.postings["features"].items() if rows]
+    samples = []
+    for _ in range(count):
+        params = {"sort_by": rng.choice(["featured", "price-low", "price-high", "rating", "newest"])}
+        if types and rng.random() < 0.4:
+            params["vessel_type"] = rng.choice(types)
+        if locations and rng.random() < 0.3:
+            params["location"] = rng.choice(locations).split()[0]
+        if rng.random() < 0.3:
+            params["min_daily_rate"] = rng.choice([5000, 10000, 20000])
+        if rng.random() < 0.3:
+            params["max_daily_rate"] = rng.choice([15000, 30000, 60000])
+        if rng.random() < 0.2:
+            params["min_year_built"] = rng.randint(1995, 2020)
+        if tags and rng.random() < 0.3:
+            params["tags"] = ",".join(rng.sample(tags, min(len(tags), rng.randint(1, 2))))
+        if features and rng.random() < 0.2:
+            params["features"] = rng.choice(features)
+        if rng.random() < 0.15:
+            params["search"] = rng.choice(types + locations + tags or ["vessel"])[:5]
+        samples.append(vessel_search_query(**params))
+    return samples
+
+
+async def benchmark_catalog(queries: int = 500, limit: int = 50, seed: int = 7) -> Dict[str, Any]:
+    """Time sample searches against MongoDB and the in-memory catalog, checking they agree"""
+    catalog = VesselCatalog()
+    await catalog.load()
+    samples = sample_vessel_queries(catalog, queries, seed)
+
+    def percentiles(timings: List[float]) -> Dict[str, float]:
+        timings = sorted(timings)
+        return {
+            "p50_ms": round(timings[len(timings) // 2], 3),
+            "p99_ms": round(timings[int(len(timings) * 0.99)], 3),
+        }
+
+    db_timings, catalog_timings, mismatches = [], [], 0
+    for query, sort in samples:
+        started = time.perf_counter()
+        found = await db.vessels.find(query, {"_id": 0}).sort(sort).limit(limit).to_list(limit)
+        db_timings.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        page = catalog.find(query, sort, 0, limit)
+        catalog_timings.append((time.perf_counter() - started) * 1000)
+        # Ties may be ordered differently, so compare the sort keys rather than the ids
+        keys = [tuple(catalog_numeric_value(doc, field) for field, _ in sort) for doc in page]
+        expected = [tuple(catalog_numeric_value(doc, field) for field, _ in sort) for doc in found]
+        mismatches += not np.array_equal(np.array(keys), np.array(expected), equal_nan=True)
+    return {
+        "vessels": len(catalog),
+        "queries": queries,
+        "mongo": percentiles(db_timings),
+        "catalog": percentiles(catalog_timings),
+        "mismatches": int(mismatches),
+    }
+
+# Vessel write hooks
+
+@dataclass
+class VesselChange:
+    before: Optional[Dict[str, Any]]  # None for inserts
+    after: Optional[Dict[str, Any]]  # None for deletes
+
+
+async def on_vessels_changed(changes: Optional[List[VesselChange]] = None):
+    """Called once after every vessel write; ``None`` means an unknown set of vessels changed"""
+    global _reference_data
+    _reference_data = None
+    if reference_snapshots:
+        reference_snapshots.schedule_rebuild()
+    suggestion_index.apply_changes(changes)
+    similarity_index.apply_changes(changes)
+    vessel_catalog.apply_changes(changes)
+    spawn(apply_price_histogram_changes(changes))
+    if changes:
+        spawn(notify_saved_searches(changes))
+
+
+async def ensure_indexes():
+    for keys, options in VESSEL_INDEXES:
+        await db.vessels.create_index(keys, **options)
+    await ensure_search_log_collection()
+    await db.search_events.create_index([("search_id", 1)])
+    await db.search_events.create_index([("vessel_id", 1), ("timestamp", -1)])
+    await db.query_sketches.create_index([("hour", 1), ("page_context", 1)])
+    await db.query_sketch_days.create_index([("day", 1), ("page_context", 1)])
+    await db.search_latency.create_index([("hour", 1), ("page_context", 1)])
+    await db.session_funnels.create_index([("day", 1)])
+    await db.saved_searches.create_index([("id", 1)], unique=True)
+    await db.jobs.create_index([("id", 1)], unique=True)
+    await db.jobs.create_index([("status", 1), ("run_after", 1)])
+    await db.jobs.create_index([("created_at", -1)])
+    await db.saved_searches.create_index([("owner_id", 1), ("created_at", -1)])
+    await db.notifications.create_index([("id", 1)], unique=True)
+    await db.notifications.create_index([("owner_id", 1), ("read", 1), ("created_at", -1)])
+    if SEARCH_LOG_RETENTION_DAYS > 0:
+        await db.query_sketches.create_index(
+            [("hour", 1)], name="query_sketch_ttl", expireAfterSeconds=SEARCH_LOG_RETENTION_DAYS * 86400
+        )
+        await db.query_sketch_days.create_index(
+            [("day", 1)], name="query_sketch_day_ttl", expireAfterSeconds=SEARCH_LOG_RETENTION_DAYS * 86400
+        )
+        await db.search_latency.create_index(
+            [("hour", 1)], name="search_latency_ttl", expireAfterSeconds=SEARCH_LOG_RETENTION_DAYS * 86400
+        )
+    try:
+        # Lets change stream delete events carry the deleted vessel (MongoDB 6.0+)
+        await db.command({"collMod": "vessels", "changeStreamPreAndPostImages": {"enabled": True}})
+    except OperationFailure:
+        pass
+
+# Add your routes to the router instead of directly to app
+@api_router.get("/")
+async def root():
+    return {"message": "Hello World"}
+
+@api_router.post("/status", response_model=StatusCheck)
+async def create_status_check(input: StatusCheckCreate):
+    status_dict = input.dict()
+    status_obj = StatusCheck(**status_dict)
+    _ = await db.status_checks.insert_one(status_obj.dict())
+    return status_obj
+
+@api_router.get("/status", response_model=List[StatusCheck])
+async def get_status_checks():
+    status_checks = await db.status_checks.find().to_list(1000)
+    return [StatusCheck(**status_check) for status_check in status_checks]
+
+# Vessel API Endpoints
+
+@api_router.post("/vessels", response_model=Vessel)
+async def create_vessel(vessel: VesselCreate):
+    """Create a new vessel listing"""
+    vessel_dict = vessel.dict()
+    vessel_obj = Vessel(**vessel_dict)
+    vessel_doc = vessel_obj.dict()
+    result = await db.vessels.insert_one(vessel_doc)
+    await on_vessels_changed([VesselChange(None, vessel_doc)])
+    return vessel_obj
+
+# Vessel search plans
+#
+# get_vessels parameters are normalized into a canonical VesselSearchParams
+# (blank values dropped, tag and feature lists trimmed, de-duplicated and
+# sorted, unknown sorts mapped to "featured") so that equivalent requests
+# share one compiled plan: the Mongo filter with its regexes compiled, the
+# sort and the projection. Plans are memoized in a bounded LRU; the plan
+# hash names the search shape (paging excluded) for caching and metrics.
+# Request parameters arrive typed, so a lookup computes the cache key with
+# the validators' functions directly and plans compile from the key; the
+# VesselSearchParams model is only built when a plan's params are read.
+# Saved-search percolation matches vessels with the plan's compiled regexes.
+
+VESSEL_PLAN_CACHE_SIZE = int(os.environ.get("VESSEL_PLAN_CACHE_SIZE", "1024"))
+VESSEL_SORT_CRITERIA = {
+    "featured": [("is_featured", -1), ("rating", -1)],
+    "price-low": [("daily_rate", 1)],
+    "price-high": [("daily_rate", -1)],
+    "rating": [("rating", -1)],
+    "newest": [("created_at", -1)],
+}
+VESSEL_SORT_NAMES = frozenset(VESSEL_SORT_CRITERIA) | {"quote"}
+
+
+@dataclass(eq=False)
+class VesselSearchPlan:
+    """Shared between requests; treat as read-only"""
+
+    key: tuple  # VesselSearchParams.plan_key()
+    filter: Dict[str, Any]
+    sort: List[tuple]
+    projection: Dict[str, Any]
+    sort_by: str
+    search_pattern: Optional[re.Pattern] = None  # the compiled regexes in ``filter``
+    location_pattern: Optional[re.Pattern] = None
+
+    @cached_property
+    def params(self) -> VesselSearchParams:
+        return VesselSearchParams(**dict(zip(VESSEL_PLAN_KEY_FIELDS, self.key)))
+
+    @cached_property
+    def hash(self) -> str:
+        shape = json.dumps(self.params.dict(exclude={"limit", "offset"}), default=str)
+        return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:16]
+
+
+def compile_vessel_plan(key: tuple) -> VesselSearchPlan:
+    """Plan for a VesselSearchParams.plan_key()"""
+    (search, vessel_type, location, min_daily_rate, max_daily_rate, min_year_built, max_year_built,
+     availability_status, is_featured, tags, features, sort_by) = key
+    query = {}
+    search_regex = location_regex = None
+    
+    # Search functionality
+    if search:
+        search_regex = re.compile(search, re.IGNORECASE)
+        query["$or"] = [
+            {"vessel_name": search_regex},
+            {"vessel_type": search_regex},
+            {"location": search_regex},
+            {"tags": {"$in": [search_regex]}},
+            {"features": {"$in": [search_regex]}}
+        ]
+    
+    # Filters
+    if vessel_type:
+        query["vessel_type"] = vessel_type
+    
+    if location:
+        location_regex = query["location"] = re.compile(location, re.IGNORECASE)
+    
+    daily_rate = {}
+    if min_daily_rate is not None:
+        daily_rate["$gte"] = min_daily_rate
+    if max_daily_rate is not None:
+        daily_rate["$lte"] = max_daily_rate
+    if daily_rate:
+        query["daily_rate"] = daily_rate
+    
+    year_built = {}
+    if min_year_built is not None:
+        year_built["$gte"] = min_year_built
+    if max_year_built is not None:
+        year_built["$lte"] = max_year_built
+    if year_built:
+        query["specifications.year_built"] = year_built
+    
+    if availability_status:
+        query["availability_status"] = availability_status
+    
+    if is_featured is not None:
+        query["is_featured"] = is_featured
+    
+    if tags:
+        query["tags"] = {"$in": list(tags)}
+    
+    if features:
+        query["features"] = {"$in": list(features)}
+    
+    return VesselSearchPlan(
+        key,
+        query,
+        VESSEL_SORT_CRITERIA.get(sort_by, VESSEL_SORT_CRITERIA["featured"]),
+        QUOTE_FIELDS if sort_by == "quote" else {"_id": 0},
+        sort_by,
+        search_regex,
+        location_regex,
+    )
+
+
+@dataclass(eq=False)
+class VesselPlanEntry:
+    key: tuple
+    plan: VesselSearchPlan
+    uses: int = 0
+
+
+class VesselPlanCache:
+    """Bounded LRU of compiled plans keyed by canonical parameters"""
+
+    def __init__(self, max_plans: int = VESSEL_PLAN_CACHE_SIZE):
+        self.max_plans = max_plans
+        self._plans: OrderedDict = OrderedDict()  # plan key -> VesselPlanEntry
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key: tuple) -> VesselPlanEntry:
+        """Cached entry for a plan key, compiling the plan on a miss"""
+        entry = self._plans.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._plans.move_to_end(key)
+        else:
+            self.misses += 1
+            entry = self._plans[key] = VesselPlanEntry(key, compile_vessel_plan(key))
+            if len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        entry.uses += 1
+        return entry
+
+    def get(self, params: VesselSearchParams) -> VesselSearchPlan:
+        return self._entry(params.plan_key()).plan
+
+    def lookup(self, **raw) -> VesselSearchPlan:
+        """Plan for typed request parameters, canonicalized without building VesselSearchParams"""
+        return self._entry(search_plan_key(**raw)).plan
+
+    def stats(self, limit: int = 20) -> Dict[str, Any]:
+        top = heapq.nlargest(limit, self._plans.values(), key=lambda entry: entry.uses)
+        return {
+            "plans": len(self._plans),
+            "max_plans": self.max_plans,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / max(1, self.hits + self.misses),
+            "top_plans": [
+                {"hash": entry.plan.hash, "uses": entry.uses, "params": entry.plan.params.dict(exclude={"limit", "offset"})}
+                for entry in top
+            ],
+        }
+
+
+vessel_plans = VesselPlanCache()
+
+
+def vessel_search_query(**params) -> tuple:
+    """MongoDB filter and sort for get_vessels parameters, via the plan cache"""
+    plan = vessel_plans.lookup(**params)
+    return plan.filter, plan.sort
+
+
+async def find_vessels(
+    source: str,
+    query: Dict[str, Any],
+    sort: Optional[List[tuple]] = None,
+    skip: int = 0,
+    limit: int = 0,
+    projection: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """profiled_find on vessels, answered from the in-memory catalog when it is serving"""
+    if vessel_catalog.serving:
+        try:
+            with traced("catalog find", source=source):
+                return vessel_catalog.find(query, sort, skip, limit)
+        except CatalogUnsupported:
+            pass
+    return await profiled_find(source, db.vessels, query, sort, skip, limit, projection)
+
+@api_router.get("/vessels", response_model=List[VesselWithQuote], dependencies=[Depends(rate_limited("vessels"))])
+async def get_vessels(
+    response: Response,
+    search: Optional[str] = Query(None, description="Search query for vessel name, type, or location"),
+    vessel_type: Optional[str] = Query(None, description="Filter by vessel type"),
+    location: Optional[str] = Query(None, description="Filter by location"),
+    min_daily_rate: Optional[float] = Query(None, description="Minimum daily rate"),
+    max_daily_rate: Optional[float] = Query(None, description="Maximum daily rate"),
+    min_year_built: Optional[int] = Query(None, description="Minimum year built"),
+    max_year_built: Optional[int] = Query(None, description="Maximum year built"),
+    availability_status: Optional[str] = Query(None, description="Filter by availability status"),
+    is_featured: Optional[bool] = Query(None, description="Filter featured vessels"),
+    tags: Optional[str] = Query(None, description="Comma-separated tags to filter by"),
+    features: Optional[str] = Query(None, description="Comma-separated features to filter by"),
+    sort_by: Optional[str] = Query("featured", description="Sort by: featured, price-low, price-high, rating, newest, quote"),
+    limit: Optional[int] = Query(50, description="Number of vessels to return"),
+    offset: Optional[int] = Query(0, description="Number of vessels to skip"),
+    days: Optional[int] = Query(None, le=CHARTER_MAX_DAYS, description="Charter length in days; adds a quote to each vessel"),
+    start_date: Optional[str] = Query(None, description="Charter start (YYYY-MM-DD), with end_date instead of days"),
+    end_date: Optional[str] = Query(None, description="Charter end (YYYY-MM-DD)")
+):
+    """Get vessels with filtering and search capabilities"""
+    days = charter_days(days, start_date, end_date)
+    with traced("build query") as span:
+        try:
+            plan = vessel_plans.lookup(
+                search=search, vessel_type=vessel_type, location=location,
+                min_daily_rate=min_daily_rate, max_daily_rate=max_daily_rate,
+                min_year_built=min_year_built, max_year_built=max_year_built,
+                availability_status=availability_status, is_featured=is_featured,
+                tags=tags, features=features, sort_by=sort_by
+            )
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid search pattern: {e}")
+        if span:
+            span.attributes["plan"] = plan.hash
+    response.headers["X-Search-Plan"] = plan.hash
+    query, sort_criteria = plan.filter, plan.sort
+    if plan.sort_by == "quote" and days is None:
+        raise HTTPException(status_code=400, detail="sort_by=quote needs days or start_date/end_date")
+    
+    if plan.sort_by == "quote":
+        # Quote every candidate from its rate fields only, then load the requested page
+        candidates = await find_vessels("get_vessels_quote", query, projection=plan.projection)
+        if not candidates:
+            return []
+        priced = price_charters(candidates, days)
+        order = np.argsort(priced["total"], kind="stable")[:np.isfinite(priced["total"]).sum()]
+        order = order[offset:offset + limit] if limit else order[offset:]
+        page = [charter_quote(candidates[index], priced, index, days) for index in order]
+        docs = await find_vessels("get_vessels_quote_page", {"id": {"$in": [quote["vessel_id"] for quote in page]}})
+        by_id = {doc["id"]: doc for doc in docs}
+        return [VesselWithQuote(**by_id[quote["vessel_id"]], quote=quote) for quote in page if quote["vessel_id"] in by_id]
+
+    # Execute query
+    vessels = await find_vessels("get_vessels", query, sort_criteria, offset, limit, plan.projection)
+
+    with traced("build models", count=len(vessels)):
+        if days is not None:
+            quotes = quote_vessels(vessels, days)
+            return [VesselWithQuote(**vessel, quote=quote) for vessel, quote in zip(vessels, quotes)]
+        
+        return [Vessel(**vessel) for vessel in vessels]
+
+# Charter quotes
+#
+# A charter of N days is priced as the cheapest mix of 30-day months,
+# 7-day weeks and single days (overshooting into a longer block when that is
+# cheaper), minus the vessel's discount. Every (months, weeks, days) plan
+# worth considering for N is enumerated once and priced against the vessels
+# with one matrix product per chunk of CHARTER_PRICE_CHUNK vessels.
+#
+# Blocks covering the same days can be traded for each other (a week for 7
+# days, a month for 30 days, 7 months for 30 weeks) and one direction of a
+# trade is never dearer, so some cheapest plan leaves fewer than 7 single
+# days unless it has no weeks, fewer than 30 unless it has no months, and
+# has fewer than 30 weeks or fewer than 7 months. Only such plans are
+# enumerated, which keeps their number linear in N.
+
+CHARTER_MONTH_DAYS = 30
+CHARTER_WEEK_DAYS = 7
+CHARTER_MISSING_RATE = 1e15
+CHARTER_EXCHANGE_MONTHS = 7
+CHARTER_EXCHANGE_WEEKS = 30  # 7 * 30 == 30 * 7 days
+CHARTER_PRICE_CHUNK = 4096
+QUOTE_FIELDS = {"_id": 0, "id": 1, "daily_rate": 1, "weekly_rate": 1, "monthly_rate": 1, "discount_percentage": 1}
+
+
+def charter_plans(days: int) -> np.ndarray:
+    """Candidate (months, weeks, days) block counts covering ``days``"""
+    plans = []
+    for months in range(-(-days // CHARTER_MONTH_DAYS) + 1):
+        remaining = max(0, days - months * CHARTER_MONTH_DAYS)
+        for weeks in sorted({0, remaining // CHARTER_WEEK_DAYS, -(-remaining // CHARTER_WEEK_DAYS)}):
+            extra_days = max(0, remaining - weeks * CHARTER_WEEK_DAYS)
+            if months and extra_days >= CHARTER_MONTH_DAYS:
+                continue
+            if months >= CHARTER_EXCHANGE_MONTHS and weeks >= CHARTER_EXCHANGE_WEEKS:
+                continue
+            plans.append((months, weeks, extra_days))
+    return np.array(plans, dtype=np.float64)
+
+
+def price_charters(vessels: List[Dict[str, Any]], days: int) -> Dict[str, np.ndarray]:
+    """Cheapest plan per vessel as arrays; ``total`` is inf when a vessel's rates cannot cover ``days``"""
+
+    def column(field):
+        return np.array([vessel.get(field) for vessel in vessels], dtype=np.float64)  # None -> nan
+
+    # Missing rates become a huge finite price, so unused blocks still cost 0 in the product
+    rates = np.nan_to_num(
+        np.stack([column("monthly_rate"), column("weekly_rate"), column("daily_rate")]), nan=CHARTER_MISSING_RATE
+    )
+    discounts = np.clip(np.nan_to_num(column("discount_percentage")), 0, 100)
+    plans = charter_plans(days)
+    best = np.empty(len(vessels), dtype=np.int64)
+    subtotals = np.empty(len(vessels), dtype=np.float64)
+    for start in range(0, len(vessels), CHARTER_PRICE_CHUNK):
+        chunk = slice(start, start + CHARTER_PRICE_CHUNK)
+        costs = plans @ rates[:, chunk]  # (plans, vessels in chunk)
+        best[chunk] = costs.argmin(axis=0)
+        subtotals[chunk] = costs[best[chunk], np.arange(costs.shape[1])]
+    subtotals[subtotals >= CHARTER_MISSING_RATE] = np.inf
+    return {
+        "plan": plans[best].astype(int),
+        "subtotal": subtotals,
+        "discount_percentage": discounts,
+        "total": subtotals * (1 - discounts / 100),
+    }
+
+
+def charter_quote(vessel: Dict[str, Any], priced: Dict[str, np.ndarray], index: int, days: int) -> Optional[Dict[str, Any]]:
+    total = float(priced["total"][index])
+    if not math.isfinite(total):
+        return None
+    months, weeks, extra_days = (int(count) for count in priced["plan"][index])
+    return {
+        "vessel_id": vessel["id"],
+        "days": days,
+        "months": months,
+        "weeks": weeks,
+        "extra_days": extra_days,
+        "subtotal": round(float(priced["subtotal"][index]), 2),
+        "discount_percentage": float(priced["discount_percentage"][index]),
+        "total": round(total, 2),
+        "effective_daily_rate": round(total / days, 2),
+    }
+
+
+def quote_vessels(vessels: List[Dict[str, Any]], days: int) -> List[Optional[Dict[str, Any]]]:
+    """Cheapest charter for each vessel, or None when its rates cannot cover ``days``"""
+    if not vessels:
+        return []
+    priced = price_charters(vessels, days)
+    return [charter_quote(vessel, priced, index, days) for index, vessel in enumerate(vessels)]
+
+
+def charter_days(days: Optional[int], start_date: Optional[str], end_date: Optional[str]) -> Optional[int]:
+    if start_date or end_date:
+        if not (start_date and end_date):
+            raise HTTPException(status_code=400, detail="start_date and end_date must be given together")
+        try:
+            days = (datetime.fromisoformat(end_date) - datetime.fromisoformat(start_date)).days
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if days is not None and days < 1:
+        raise HTTPException(status_code=400, detail="A charter must last at least one day")
+    if days is not None and days > CHARTER_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"A charter may last at most {CHARTER_MAX_DAYS} days")
+    return days
+
+# Live vessel updates
+#
+# One change stream on vessels per process, fanned out to SSE subscribers
+# through bounded queues. A subscriber whose queue fills up is dropped and
+# told so; it reconnects with Last-Event-ID and is replayed from the recent
+# event buffer. Change streams need a replica set; for local testing run a
+# single-node one:
+#
+#   mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval "rs.initiate()"
+#   MONGO_URL="mongodb://localhost:27017/?replicaSet=rs0"
+
+VESSEL_FEED_ENABLED = os.environ.get("VESSEL_FEED_ENABLED", "true").lower() == "true"
+VESSEL_FEED_QUEUE_SIZE = int(os.environ.get("VESSEL_FEED_QUEUE_SIZE", "100"))
+VESSEL_FEED_REPLAY_SIZE = int(os.environ.get("VESSEL_FEED_REPLAY_SIZE", "1000"))
+VESSEL_FEED_HEARTBEAT = float(os.environ.get("VESSEL_FEED_HEARTBEAT", "15"))
+CHANGE_STREAM_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_PRE_IMAGES_MIN_VERSION = (6, 0)
+
+
+async def supports_change_stream_pre_images() -> bool:
+    info = await db.command("buildInfo")
+    return tuple(info.get("versionArray", [0, 0])[:2]) >= CHANGE_STREAM_PRE_IMAGES_MIN_VERSION
+
+
+class VesselFeedSubscriber:
+    def __init__(self, vessel_ids: Optional[List[str]], vessel_type: Optional[str], location: Optional[str]):
+        self.vessel_ids = set(vessel_ids) if vessel_ids else None
+        self.vessel_type = vessel_type
+        self.location = location.lower() if location else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=VESSEL_FEED_QUEUE_SIZE)
+        self.dropped = False
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.vessel_ids is not None and event["vessel_id"] not in self.vessel_ids:
+            return False
+        vessel = event.get("vessel") or event.get("previous") or {}
+        if self.vessel_type and vessel.get("vessel_type") != self.vessel_type:
+            return False
+        if self.location and self.location not in (vessel.get("location") or "").lower():
+            return False
+        return True
+
+
+class VesselChangeFeed:
+    """Shared change stream on vessels with in-process fan-out"""
+
+    def __init__(self):
+        self.subscribers: set = set()
+        self.listeners: List[Any] = []
+        self.recent: deque = deque(maxlen=VESSEL_FEED_REPLAY_SIZE)
+        self.resume_token: Optional[Dict[str, Any]] = None
+        self.history_resets = 0  # times events were lost; in-memory replicas must reload
+        self.available = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.available = False
+
+    def add_listener(self, callback):
+        """Register ``callback(event)`` for every change, e.g. to keep an in-memory replica in sync"""
+        self.listeners.append(callback)
+
+    def subscribe(self, subscriber: VesselFeedSubscriber):
+        self.subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber: VesselFeedSubscriber):
+        self.subscribers.discard(subscriber)
+
+    def replay_after(self, event_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Events after ``event_id``, or None when it has already left the replay buffer"""
+        events = list(self.recent)
+        for index, event in enumerate(events):
+            if event["id"] == event_id:
+                return events[index + 1:]
+        return None
+
+    def _to_event(self, change: Dict[str, Any]) -> Dict[str, Any]:
+        vessel = change.get("fullDocument")
+        previous = change.get("fullDocumentBeforeChange")
+        # Without pre-images a delete carries only documentKey ({"_id": ObjectId}), so its vessel id is unknown
+        vessel_id = (vessel or previous or {}).get("id")
+        return {
+            "id": change["_id"]["_data"],
+            "operation": change["operationType"],
+            "vessel_id": vessel_id,
+            "vessel": jsonable_encoder(Vessel(**vessel)) if vessel else None,
+            "previous": jsonable_encoder(Vessel(**previous)) if previous else None,
+            "updated_fields": sorted(change.get("updateDescription", {}).get("updatedFields", {})),
+            "cluster_time": change["clusterTime"].time if change.get("clusterTime") else None,
+        }
+
+    def _publish(self, event: Dict[str, Any]):
+        self.recent.append(event)
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Vessel feed listener failed")
+        for subscriber in list(self.subscribers):
+            if not subscriber.matches(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop it rather than buffer without bound
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                options = {"full_document": "updateLookup", "resume_after": self.resume_token}
+                if await supports_change_stream_pre_images():
+                    options["full_document_before_change"] = "whenAvailable"
+                async with db.vessels.watch(**options) as stream:
+                    self.available = True
+                    backoff = 1.0
+                    async for change in stream:
+                        self.resume_token = stream.resume_token
+                        if change["operationType"] in ("insert", "update", "replace", "delete"):
+                            event = self._to_event(change)
+                            if event["operation"] == "delete" and event["vessel_id"] is None:
+                                # Replicas cannot tell which vessel went away; make them reload
+                                self.history_resets += 1
+                            self._publish(event)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.available = False
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    logger.warning("Vessel change feed disabled: MongoDB is not running as a replica set")
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    self.resume_token = None
+                    self.recent.clear()
+                    self.history_resets += 1
+                logger.warning("Vessel change stream failed (%s); retrying in %.0fs", e, backoff)
+            except Exception:
+                self.available = False
+                logger.exception("Vessel change stream failed; retrying in %.0fs", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+vessel_feed = VesselChangeFeed()
+
+
+def format_sse(event: Dict[str, Any], event_type: str = "vessel") -> str:
+    return f"id: {event['id']}\nevent: {event_type}\ndata: {json.dumps(event)}\n\n"
+
+@api_router.get("/vessels/stream")
+async def stream_vessel_updates(
+    request: Request,
+    ids: Optional[str] = Query(None, description="Comma-separated vessel ids to follow"),
+    vessel_type: Optional[str] = Query(None, description="Only changes to vessels of this type"),
+    location: Optional[str] = Query(None, description="Only changes to vessels in this location"),
+    last_event_id: Optional[str] = Query(None, description="Resume after this event id (or send Last-Event-ID)")
+):
+    """Server-Sent Events stream of vessel price and availability changes"""
+    if not vessel_feed.available:
+        raise HTTPException(status_code=503, detail="Live updates are unavailable")
+
+    id_list = [vessel_id.strip() for vessel_id in ids.split(",") if vessel_id.strip()] if ids else None
+    subscriber = VesselFeedSubscriber(id_list, vessel_type, location)
+    vessel_feed.subscribe(subscriber)
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    replay = vessel_feed.replay_after(resume_from) if resume_from else []
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            replayed = set()
+            if replay is None:
+                # Too far behind for the replay buffer; the client should refetch
+                yield "event: reset\ndata: {}\n\n"
+            else:
+                for event in replay:
+                    if subscriber.matches(event):
+                        replayed.add(event["id"])
+                        yield format_sse(event)
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), VESSEL_FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield "event: dropped\ndata: {}\n\n"
+                    break
+                if event["id"] not in replayed:
+                    yield format_sse(event)
+        finally:
+            vessel_feed.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+VESSEL_BULK_MAX_ITEMS = int(os.environ.get("VESSEL_BULK_MAX_ITEMS", "1000"))
+
+
+def bulk_filter_query(bulk_filter: VesselBulkFilter) -> Dict[str, Any]:
+    query = {}
+    if bulk_filter.ids:
+        query["id"] = {"$in": bulk_filter.ids}
+    if bulk_filter.vessel_type:
+        query["vessel_type"] = bulk_filter.vessel_type
+    if bulk_filter.location:
+        query["location"] = {"$regex": re.escape(bulk_filter.location), "$options": "i"}
+    if bulk_filter.availability_status:
+        query["availability_status"] = bulk_filter.availability_status
+    if bulk_filter.tags:
+        query["tags"] = {"$in": bulk_filter.tags}
+    return query
+
+@api_router.post("/vessels/bulk")
+async def bulk_update_vessels(bulk: VesselBulkUpdate):
+    """Apply many partial vessel updates as one unordered bulk_write"""
+    if bool(bulk.items) == bool(bulk.filter):
+        raise HTTPException(status_code=400, detail="Provide either items or filter with update")
+
+    if bulk.filter:
+        if bulk.update is None:
+            raise HTTPException(status_code=400, detail="A filter needs an update")
+        query = bulk_filter_query(bulk.filter)
+        if not query:
+            raise HTTPException(status_code=400, detail="Refusing to update every vessel with an empty filter")
+        matched = await db.vessels.find(query, {"_id": 0, "id": 1}).to_list(VESSEL_BULK_MAX_ITEMS + 1)
+        if len(matched) > VESSEL_BULK_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Filter matches more than {VESSEL_BULK_MAX_ITEMS} vessels")
+        items = [VesselBulkItem(id=doc["id"], update=bulk.update) for doc in matched]
+    else:
+        if len(bulk.items) > VESSEL_BULK_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {VESSEL_BULK_MAX_ITEMS} items per request")
+        items = bulk.items
+
+    existing = {
+        doc["id"]: doc for doc in await db.vessels.find(
+            {"id": {"$in": [item.id for item in items]}}, {"_id": 0}
+        ).to_list(len(items))
+    }
+
+    now = datetime.utcnow()
+    outcomes = []
+    operations = []
+    operation_items = []
+    vessel_changes = {}
+    for item in items:
+        changes = item.update.update_document(existing[item.id]) if item.id in existing else None
+        if item.id not in existing:
+            outcomes.append({"id": item.id, "status": "not_found"})
+        elif not changes:
+            outcomes.append({"id": item.id, "status": "unchanged"})
+        else:
+            outcomes.append({"id": item.id, "status": "updated"})
+            operations.append(UpdateOne({"id": item.id}, {"$set": {**changes, "updated_at": now}}))
+            operation_items.append(len(outcomes) - 1)
+            after = {**existing[item.id], "updated_at": now}
+            for field, value in changes.items():
+                if field.startswith("specifications."):
+                    after["specifications"] = {**after["specifications"], field.split(".", 1)[1]: value}
+                else:
+                    after[field] = value
+            vessel_changes[item.id] = VesselChange(existing[item.id], after)
+
+    if operations:
+        try:
+            await db.vessels.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                outcome = outcomes[operation_items[error["index"]]]
+                outcome["status"] = "error"
+                outcome["error"] = error.get("errmsg")
+
+    updated_ids = [outcome["id"] for outcome in outcomes if outcome["status"] == "updated"]
+    if updated_ids:
+        await on_vessels_changed([vessel_changes[vessel_id] for vessel_id in updated_ids])
+
+    return {
+        "updated": len(updated_ids),
+        "not_found": sum(1 for outcome in outcomes if outcome["status"] == "not_found"),
+        "errors": sum(1 for outcome in outcomes if outcome["status"] == "error"),
+        "results": outcomes,
+    }
+
+VESSEL_BATCH_MAX_IDS = int(os.environ.get("VESSEL_BATCH_MAX_IDS", "500"))
+
+
+def vessel_projection(fields: Optional[List[str]]) -> Optional[Dict[str, int]]:
+    """Build a Mongo projection for a list of Vessel fields; ``id`` is always included"""
+    if not fields:
+        return None
+    unknown = sorted(set(fields) - set(Vessel.__fields__))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown vessel fields: {', '.join(unknown)}")
+    projection = {"_id": 0, "id": 1}
+    projection.update({field: 1 for field in fields})
+    return projection
+
+
+async def fetch_vessels_by_ids(ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > VESSEL_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {VESSEL_BATCH_MAX_IDS} ids per batch")
+
+    projection = vessel_projection(fields)
+    docs = await db.vessels.find({"id": {"$in": ids}}, projection).to_list(len(ids))
+    by_id = {doc["id"]: doc for doc in docs}
+
+    vessels = []
+    for vessel_id in ids:
+        doc = by_id.get(vessel_id)
+        if doc is not None:
+            vessels.append(doc if projection else Vessel(**doc))
+    return {"vessels": vessels, "missing": [vessel_id for vessel_id in ids if vessel_id not in by_id]}
+
+@api_router.post("/vessels/quotes")
+async def quote_vessels_batch(request: VesselQuoteRequest):
+    """Quote several vessels for the same charter length, in the order requested"""
+    ids = list(dict.fromkeys(request.ids))
+    if len(ids) > VESSEL_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {VESSEL_BATCH_MAX_IDS} ids per batch")
+    docs = await db.vessels.find({"id": {"$in": ids}}, QUOTE_FIELDS).to_list(len(ids))
+    by_id = {doc["id"]: doc for doc in docs}
+    found = [by_id[vessel_id] for vessel_id in ids if vessel_id in by_id]
+    quotes = quote_vessels(found, request.days)
+    return {
+        "quotes": [quote for quote in quotes if quote],
+        "unquotable": [vessel["id"] for vessel, quote in zip(found, quotes) if quote is None],
+        "missing": [vessel_id for vessel_id in ids if vessel_id not in by_id],
+    }
+
+@api_router.get("/vessels/batch")
+async def get_vessels_batch(
+    ids: str = Query(..., description="Comma-separated vessel ids"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return")
+):
+    """Get several vessels in one request, in the order requested"""
+    id_list = [vessel_id.strip() for vessel_id in ids.split(",") if vessel_id.strip()]
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    return await fetch_vessels_by_ids(id_list, field_list)
+
+@api_router.post("/vessels/batch")
+async def post_vessels_batch(batch: VesselBatchRequest):
+    """Get several vessels in one request; use POST when the id list is too long for a URL"""
+    return await fetch_vessels_by_ids(batch.ids, batch.fields)
+
+@api_router.get("/vessels/{vessel_id}", response_model=Vessel)
+async def get_vessel(vessel_id: str):
+    """Get a specific vessel by ID"""
+    vessel = await db.vessels.find_one({"id": vessel_id})
+    if not vessel:
+        raise HTTPException(status_code=404, detail="Vessel not found")
+    return Vessel(**vessel)
+
+@api_router.get("/vessels/{vessel_id}/quote", response_model=CharterQuote)
+async def get_vessel_quote(
+    vessel_id: str,
+    days: Optional[int] = Query(None, le=CHARTER_MAX_DAYS, description="Charter length in days"),
+    start_date: Optional[str] = Query(None, description="Charter start (YYYY-MM-DD), with end_date instead of days"),
+    end_date: Optional[str] = Query(None, description="Charter end (YYYY-MM-DD)")
+):
+    """Get the cheapest charter price for a vessel over a number of days"""
+    days = charter_days(days, start_date, end_date)
+    if days is None:
+        raise HTTPException(status_code=400, detail="Give days or start_date/end_date")
+    vessel = await db.vessels.find_one({"id": vessel_id}, QUOTE_FIELDS)
+    if not vessel:
+        raise HTTPException(status_code=404, detail="Vessel not found")
+    quote = quote_vessels([vessel], days)[0]
+    if quote is None:
+        raise HTTPException(status_code=422, detail="Vessel has no rates that cover this charter")
+    return quote
+
+@api_router.get("/vessels/{vessel_id}/similar", response_model=List[Vessel])
+async def get_similar_vessels(
+    vessel_id: str,
+    limit: int = Query(6, ge=1, le=50, description="Number of similar vessels to return")
+):
+    """Get the vessels closest to this one by specifications, type, tags and rate"""
+    vessel = await db.vessels.find_one({"id": vessel_id}, {"_id": 0})
+    if not vessel:
+        raise HTTPException(status_code=404, detail="Vessel not found")
+    if not similarity_index.ready:
+        await similarity_index.ensure_ready()
+    nearest = similarity_index.nearest(vessel, limit)
+    result = await fetch_vessels_by_ids([similar_id for similar_id, _ in nearest])
+    return result["vessels"]
+
+@api_router.put("/vessels/{vessel_id}", response_model=Vessel)
+async def update_vessel(vessel_id: str, vessel_update: VesselCreate):
+    """Update a vessel"""
+    update_dict = vessel_update.dict()
+    update_dict["updated_at"] = datetime.utcnow()
+    
+    previous_vessel = await db.vessels.find_one_and_update(
+        {"id": vessel_id},
+        {"$set": update_dict},
+        return_document=ReturnDocument.BEFORE
+    )
+    
+    if previous_vessel is None:
+        raise HTTPException(status_code=404, detail="Vessel not found")
+    
+    updated_vessel = {**previous_vessel, **update_dict}
+    await on_vessels_changed([VesselChange(previous_vessel, updated_vessel)])
+    return Vessel(**updated_vessel)
+
+@api_router.delete("/vessels/{vessel_id}")
+async def delete_vessel(vessel_id: str):
+    """Delete a vessel"""
+    deleted_vessel = await db.vessels.find_one_and_delete({"id": vessel_id})
+    if deleted_vessel is None:
+        raise HTTPException(status_code=404, detail="Vessel not found")
+    await on_vessels_changed([VesselChange(deleted_vessel, None)])
+    return {"message": "Vessel deleted successfully"}
+
+# Vessel image pipeline
+#
+# Originals are stored content-addressed under MEDIA_ROOT/<hash[:2]>/<hash>/
+# next to their resized WebP/JPEG variants and a manifest.json that is written
+# last, so a directory with a manifest is complete and never reprocessed.
+# Resizing runs in a process pool to keep the event loop free.
+
+MEDIA_ROOT = Path(os.environ.get("MEDIA_ROOT", ROOT_DIR / "media"))
+MEDIA_URL_PREFIX = "/api/media"
+MEDIA_MAX_UPLOAD_BYTES = int(os.environ.get("MEDIA_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+IMAGE_VARIANT_WIDTHS = tuple(int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(","))
+IMAGE_VARIANT_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CONTENT_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+MEDIA_NAME_PATTERN = re.compile(r"^(original|\d+\.(webp|jpg))$")
+
+_image_pool: Optional[ProcessPoolExecutor] = None
+_images_in_flight: Dict[str, "asyncio.Future"] = {}
+
+
+def media_dir(content_hash: str) -> Path:
+    return MEDIA_ROOT / content_hash[:2] / content_hash
+
+
+def render_image_variants(directory: str, widths: tuple, quality: int) -> Dict[str, Any]:
+    """Resize ``directory/original`` into every variant and write the manifest (runs in a worker process)"""
+    directory = Path(directory)
+    with Image.open(directory / "original") as source:
+        original_format = source.format
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    variants = []
+    targets = sorted({min(width, image.width) for width in widths})
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for extension, pil_format in IMAGE_VARIANT_FORMATS.items():
+            target = directory / f"{width}.{extension}"
+            tmp = directory / f".{width}.{extension}.tmp"
+            resized.save(tmp, pil_format, quality=quality, optimize=True)
+            os.replace(tmp, target)
+            variants.append({"width": width, "height": height, "format": extension})
+
+    manifest = {
+        "content_hash": directory.name,
+        "original_format": original_format,
+        "width": image.width,
+        "height": image.height,
+        "variants": variants,
+    }
+    tmp = directory / ".manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, directory / "manifest.json")
+    return manifest
+
+
+def store_original(data: bytes) -> str:
+    content_hash = hashlib.sha256(data).hexdigest()
+    directory = media_dir(content_hash)
+    original = directory / "original"
+    if not original.exists():
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / f".original.{os.getpid()}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, original)
+    return content_hash
+
+
+def read_manifest(content_hash: str) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads((media_dir(content_hash) / "manifest.json").read_text())
+    except FileNotFoundError:
+        return None
+
+
+async def process_image(content_hash: str) -> Dict[str, Any]:
+    """Generate variants for a stored original; idempotent and deduplicated while in flight"""
+    global _image_pool
+    manifest = read_manifest(content_hash)
+    if manifest is not None:
+        return manifest
+    if Image is None:
+        raise HTTPException(status_code=503, detail="Image processing requires Pillow")
+
+    if content_hash not in _images_in_flight:
+        if _image_pool is None:
+            _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        _images_in_flight[content_hash] = loop.run_in_executor(
+            _image_pool, render_image_variants, str(media_dir(content_hash)), IMAGE_VARIANT_WIDTHS, IMAGE_QUALITY
+        )
+    try:
+        return await asyncio.shield(_images_in_flight[content_hash])
+    finally:
+        _images_in_flight.pop(content_hash, None)
+
+
+def vessel_image_from_manifest(manifest: Dict[str, Any]) -> VesselImage:
+    base = f"{MEDIA_URL_PREFIX}/{manifest['content_hash']}"
+    return VesselImage(
+        content_hash=manifest["content_hash"],
+        original_url=f"{base}/original",
+        variants=[
+            ImageVariant(url=f"{base}/{variant['width']}.{variant['format']}", **variant)
+            for variant in manifest["variants"]
+        ]
+    )
+
+
+async def process_local_originals(root: Optional[Path] = None) -> Dict[str, int]:
+    """Import every image file under ``root`` and generate its variants; already processed files are skipped"""
+    processed = skipped = failed = 0
+    for path in sorted(p for p in Path(root or MEDIA_ROOT).rglob("*") if p.is_file()):
+        if root is None and path.name != "original":
+            continue
+        content_hash = path.parent.name if root is None else store_original(path.read_bytes())
+        if read_manifest(content_hash) is not None:
+            skipped += 1
+            continue
+        try:
+            await process_image(content_hash)
+            processed += 1
+        except Exception:
+            logger.exception("Failed to process image %s", path)
+            failed += 1
+    return {"processed": processed, "skipped": skipped, "failed": failed}
 
-@api_router.get("/vessels/{vessel_id}", response_model=Vessel)
-async def get_vessel(vessel_id: str):
-    """Get a specific vessel by ID"""
-    vessel = await db.vessels.find_one({"id": vessel_id})
-    if not vessel:
+
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+@api_router.post("/vessels/{vessel_id}/images", response_model=VesselImage)
+async def upload_vessel_image(vessel_id: str, file: UploadFile = File(...)):
+    """Upload an original image for a vessel and generate its thumbnails"""
+    if not await db.vessels.find_one({"id": vessel_id}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Vessel not found")
-    return Vessel(**vessel)
 
-@api_router.put("/vessels/{vessel_id}", response_model=Vessel)
-async def update_vessel(vessel_id: str, vessel_update: VesselCreate):
-    """Update a vessel"""
-    update_dict = vessel_update.dict()
-    update_dict["updated_at"] = datetime.utcnow()
-    
-    result = await db.vessels.update_one(
-        {"id": vessel_id},
-        {"$set": update_dict}
+    data = await file.read(MEDIA_MAX_UPLOAD_BYTES + 1)
+    if len(data) > MEDIA_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image is too large")
+
+    content_hash = await asyncio.to_thread(store_original, data)
+    try:
+        manifest = await process_image(content_hash)
+    except HTTPException:
+        raise
+    except Exception:
+        if read_manifest(content_hash) is None:
+            shutil.rmtree(media_dir(content_hash), ignore_errors=True)
+        raise HTTPException(status_code=400, detail="File is not a supported image")
+
+    image = vessel_image_from_manifest(manifest)
+    now = datetime.utcnow()
+    previous_vessel = await db.vessels.find_one_and_update(
+        {"id": vessel_id, "thumbnails.content_hash": {"$ne": content_hash}},
+        {
+            "$push": {"thumbnails": image.dict(), "images": image.original_url},
+            "$set": {"updated_at": now}
+        },
+        return_document=ReturnDocument.BEFORE
     )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Vessel not found")
-    
-    updated_vessel = await db.vessels.find_one({"id": vessel_id})
-    return Vessel(**updated_vessel)
+    if previous_vessel is not None:
+        await on_vessels_changed([VesselChange(previous_vessel, {
+            **previous_vessel,
+            "thumbnails": (previous_vessel.get("thumbnails") or []) + [image.dict()],
+            "images": (previous_vessel.get("images") or []) + [image.original_url],
+            "updated_at": now,
+        })])
+    return image
 
-@api_router.delete("/vessels/{vessel_id}")
-async def delete_vessel(vessel_id: str):
-    """Delete a vessel"""
-    result = await db.vessels.delete_one({"id": vessel_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Vessel not found")
-    return {"message": "Vessel deleted successfully"}
+@api_router.get("/media/{content_hash}/{name}")
+async def get_media(content_hash: str, name: str):
+    """Serve an original or a resized variant; content-addressed, so cacheable forever"""
+    if not CONTENT_HASH_PATTERN.match(content_hash) or not MEDIA_NAME_PATTERN.match(name):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    path = media_dir(content_hash) / name
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
 
-@api_router.get("/vessels/search/suggestions")
+    if name == "original":
+        manifest = read_manifest(content_hash) or {}
+        media_type = Image.MIME.get(manifest.get("original_format"), "application/octet-stream") if Image else "application/octet-stream"
+    else:
+        media_type = "image/webp" if name.endswith(".webp") else "image/jpeg"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": MEDIA_CACHE_CONTROL})
+
+@api_router.get("/vessels/search/suggestions", dependencies=[Depends(rate_limited("suggestions"))])
 async def get_search_suggestions(q: str = Query(..., description="Search query")):
     """Get search suggestions for vessels"""
     if len(q) < 2:
@@ -285,136 +4070,247 @@ async def get_search_suggestions(q: str = Query(..., description="Search query")
     
     search_regex = re.compile(q, re.IGNORECASE)
     
-    # Get unique vessel types, locations, and tags that match
-    pipeline = [
-        {
-            "$match": {
-                "$or": [
-                    {"vessel_type": search_regex},
-                    {"location": search_regex},
-                    {"tags": {"$in": [search_regex]}},
-                    {"vessel_name": search_regex}
-                ]
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "vessel_types": {"$addToSet": "$vessel_type"},
-                "locations": {"$addToSet": "$location"},
-                "tags": {"$addToSet": "$tags"}
-            }
-        }
-    ]
-    
-    result = await db.vessels.aggregate(pipeline).to_list(1)
-    
+    # Match against the reference vocabulary instead of aggregating vessels
+    reference = await get_reference_data()
     suggestions = []
-    if result:
-        data = result[0]
-        # Add matching vessel types
-        for vt in data.get("vessel_types", []):
-            if re.search(search_regex, vt):
-                suggestions.append({"type": "vessel_type", "value": vt})
-        
-        # Add matching locations
-        for loc in data.get("locations", []):
-            if re.search(search_regex, loc):
-                suggestions.append({"type": "location", "value": loc})
-        
-        # Add matching tags
-        for tag_list in data.get("tags", []):
-            for tag in tag_list:
-                if re.search(search_regex, tag) and tag not in [s["value"] for s in suggestions]:
-                    suggestions.append({"type": "tag", "value": tag})
+    seen = set()
+    for suggestion_type, values in (
+        ("vessel_type", reference["vessel_types"]),
+        ("location", reference["locations"]),
+        ("tag", reference["tags"]),
+    ):
+        for value in values:
+            if len(suggestions) >= 10:
+                break
+            if search_regex.search(value) and (suggestion_type != "tag" or value not in seen):
+                suggestions.append({"type": suggestion_type, "value": value})
+                seen.add(value)
+
+    # Fill up with typo-tolerant matches, e.g. "stavangr" -> "Stavanger"
+    if len(suggestions) < 10:
+        for match in suggestion_index.search(q, limit=10):
+            if len(suggestions) >= 10:
+                break
+            if match["value"] not in seen:
+                suggestions.append({"type": match["type"], "value": match["value"], "fuzzy": True})
+                seen.add(match["value"])
     
     return {"suggestions": suggestions[:10]}  # Limit to 10 suggestions
 
+@api_router.get("/vessels/rates/histogram")
+async def get_price_histogram(
+    vessel_type: Optional[str] = Query(None, description="Filter by vessel type"),
+    location: Optional[str] = Query(None, description="Filter by location")
+):
+    """Get the daily_rate distribution for the price range slider"""
+    query = {}
+    if vessel_type:
+        query["vessel_type"] = vessel_type
+    if location:
+        query["location"] = {"$regex": re.escape(location), "$options": "i"}
+    histograms = await db.price_histograms.find(query, {"buckets": 1}).to_list(None)
+    buckets = merge_histograms(histograms)
+    return {
+        "vessel_type": vessel_type,
+        "location": location,
+        "total": sum(bucket["count"] for bucket in buckets),
+        "buckets": buckets,
+    }
+
 @api_router.get("/vessels/types/list")
 async def get_vessel_types():
     """Get list of all vessel types"""
-    vessel_types = await db.vessels.distinct("vessel_type")
-    return {"vessel_types": vessel_types}
+    reference = await get_reference_data()
+    return {"vessel_types": list(reference["vessel_types"])}
 
 @api_router.get("/vessels/locations/list")
 async def get_locations():
     """Get list of all locations"""
-    locations = await db.vessels.distinct("location")
-    return {"locations": locations}
+    reference = await get_reference_data()
+    return {"locations": list(reference["locations"])}
 
 @api_router.get("/vessels/tags/list")
 async def get_tags():
     """Get list of all tags"""
-    tags = await db.vessels.distinct("tags")
-    flattened_tags = []
-    for tag_list in tags:
-        if isinstance(tag_list, list):
-            flattened_tags.extend(tag_list)
-        else:
-            flattened_tags.append(tag_list)
-    return {"tags": list(set(flattened_tags))}
+    reference = await get_reference_data()
+    return {"tags": list(reference["tags"])}
 
 @api_router.get("/vessels/features/list")
 async def get_features():
     """Get list of all features"""
-    features = await db.vessels.distinct("features")
-    flattened_features = []
-    for feature_list in features:
-        if isinstance(feature_list, list):
-            flattened_features.extend(feature_list)
-        else:
-            flattened_features.append(feature_list)
-    return {"features": list(set(flattened_features))}
+    reference = await get_reference_data()
+    return {"features": list(reference["features"])}
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    sort_by: Optional[str] = Query("total_ms", description="Sort by: total_ms, max_ms, count, examined_per_returned"),
+    limit: Optional[int] = Query(20, description="Number of fingerprints to return")
+):
+    """List the slowest query shapes with their captured explain plans"""
+    sort_fields = {
+        "total_ms": "total_ms",
+        "max_ms": "max_ms",
+        "count": "count",
+        "examined_per_returned": "explain.examined_per_returned",
+    }
+    if sort_by not in sort_fields:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {', '.join(sort_fields)}")
+    docs = await db.slow_queries.find().sort(sort_fields[sort_by], -1).limit(limit).to_list(limit)
+    for doc in docs:
+        doc["fingerprint"] = doc.pop("_id")
+        doc["avg_ms"] = doc["total_ms"] / max(1, doc["count"])
+    return {"slow_queries": docs}
+
+@api_router.get("/admin/search-plans")
+async def get_search_plans(limit: int = Query(20, ge=1, le=200, description="Number of plans to list")):
+    """Compiled vessel search plans with cache statistics, most used first"""
+    return vessel_plans.stats(limit)
+
+@api_router.get("/admin/catalog")
+async def get_catalog_status():
+    """State of the in-memory vessel catalog"""
+    return {
+        "enabled": VESSEL_CATALOG_ENABLED,
+        "ready": vessel_catalog.ready,
+        "serving": vessel_catalog.serving,
+        "vessels": len(vessel_catalog),
+        "loaded_at": vessel_catalog.loaded_at,
+        "last_check": vessel_catalog.last_check,
+    }
+
+@api_router.post("/admin/catalog/check")
+async def check_catalog(queries: int = Query(20, ge=0, le=500, description="Sample searches to compare")):
+    """Compare the in-memory vessel catalog with MongoDB"""
+    if not vessel_catalog.ready:
+        raise HTTPException(status_code=409, detail="Vessel catalog is not loaded")
+    return await vessel_catalog.check(queries)
 
 # Search logging endpoints
 
-@api_router.post("/search/log", response_model=SearchQuery)
+@api_router.post("/search/log", response_model=SearchQuery, dependencies=[Depends(rate_limited("search_log"))])
 async def log_search_query(search_query: SearchQueryCreate, request: Request = None):
     """Log a search query for analytics and UX improvement"""
     search_dict = search_query.dict()
     
     # Add IP address if available and not provided
     if request and not search_dict.get("user_ip"):
-        search_dict["user_ip"] = request.client.host if request.client else None
+        search_dict["user_ip"] = client_ip(request)
     
     # Add user agent if available and not provided
     if request and not search_dict.get("user_agent"):
         search_dict["user_agent"] = request.headers.get("user-agent")
     
     search_obj = SearchQuery(**search_dict)
-    result = await db.search_queries.insert_one(search_obj.dict())
+    document = search_log_document(search_obj)
+    if search_obj.response_time_ms is not None:
+        document["latency_counted"] = True
+    result = await db.search_queries.insert_one(document)
+    search_event_buffer.record_search(search_obj.query)
+    query_heavy_hitters.record(search_obj.query, search_obj.page_context, search_obj.search_timestamp)
+    if search_obj.response_time_ms is not None:
+        search_event_buffer.record_latency(
+            search_obj.page_context, search_obj.search_timestamp, search_obj.response_time_ms
+        )
     return search_obj
 
 @api_router.put("/search/log/{search_id}/results")
 async def update_search_results(search_id: str, results_count: int, response_time_ms: float):
     """Update search query with results count and response time"""
-    result = await db.search_queries.update_one(
+    # Read the previous time in the same write that flags it as counted, so
+    # concurrent updates each move exactly the observation they replaced.
+    # Rows without the flag (legacy or migrated) were never counted.
+    search = await db.search_queries.find_one_and_update(
         {"id": search_id},
         {"$set": {
             "results_count": results_count,
             "response_time_ms": response_time_ms,
+            "latency_counted": True,
             "updated_at": datetime.utcnow()
-        }}
+        }},
+        projection={"_id": 0, "page_context": 1, "search_timestamp": 1, "response_time_ms": 1, "latency_counted": 1},
+        return_document=ReturnDocument.BEFORE
     )
-    
-    if result.matched_count == 0:
+    if not search:
         raise HTTPException(status_code=404, detail="Search query not found")
+
+    replaces_ms = search.get("response_time_ms") if search.get("latency_counted") else None
+    search_event_buffer.record_latency(
+        search.get("page_context"), search["search_timestamp"], response_time_ms, replaces_ms
+    )
     
     return {"message": "Search results updated successfully"}
 
+async def find_logged_search(search_id: str) -> Dict[str, Any]:
+    search = await db.search_queries.find_one({"id": search_id}, {"_id": 0, "query": 1, "session_id": 1})
+    if not search:
+        raise HTTPException(status_code=404, detail="Search query not found")
+    return search
+
 @api_router.put("/search/log/{search_id}/click")
-async def log_search_click(search_id: str, clicked_vessel_id: str):
+async def log_search_click(search_id: str, clicked_vessel_id: str, position: Optional[int] = None):
     """Log when a user clicks on a search result"""
-    result = await db.search_queries.update_one(
-        {"id": search_id},
-        {"$push": {"clicked_result_ids": clicked_vessel_id}}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Search query not found")
-    
+    search = await find_logged_search(search_id)
+    search_event_buffer.add(SearchEvent(
+        search_id=search_id,
+        event_type="click",
+        vessel_id=clicked_vessel_id,
+        query=normalize_query(search.get("query")) or None,
+        session_id=search.get("session_id"),
+        position=position
+    ))
     return {"message": "Click logged successfully"}
 
+@api_router.put("/search/log/{search_id}/impressions")
+async def log_search_impressions(search_id: str, impressions: SearchImpressionsCreate):
+    """Log the vessels shown for a search so per-vessel CTR has a denominator"""
+    search = await find_logged_search(search_id)
+    query = normalize_query(search.get("query")) or None
+    for position, vessel_id in enumerate(impressions.vessel_ids):
+        search_event_buffer.add(SearchEvent(
+            search_id=search_id,
+            event_type="impression",
+            vessel_id=vessel_id,
+            query=query,
+            session_id=search.get("session_id"),
+            position=position
+        ))
+    return {"message": f"Logged {len(impressions.vessel_ids)} impressions"}
+
+@api_router.get("/search/ctr/vessels")
+async def get_vessel_ctr_list(
+    limit: Optional[int] = Query(50, description="Number of vessels to return"),
+    min_impressions: Optional[int] = Query(0, description="Ignore vessels with fewer impressions")
+):
+    """Get click-through rates for the most clicked vessels"""
+    docs = await db.vessel_ctr.find(
+        {"impressions": {"$gte": min_impressions}} if min_impressions else {}
+    ).sort("clicks", -1).limit(limit).to_list(limit)
+    return {"vessels": [{"vessel_id": doc["_id"], **ctr_summary(doc, "impressions")} for doc in docs]}
+
+@api_router.get("/search/ctr/vessels/{vessel_id}")
+async def get_vessel_ctr(vessel_id: str):
+    """Get click-through rate for a single vessel"""
+    doc = await db.vessel_ctr.find_one({"_id": vessel_id}) or {}
+    return {"vessel_id": vessel_id, **ctr_summary(doc, "impressions")}
+
+@api_router.get("/search/ctr/queries")
+async def get_query_ctr_list(limit: Optional[int] = Query(50, description="Number of queries to return")):
+    """Get clicks per search for the most searched queries"""
+    docs = await db.query_ctr.find().sort("searches", -1).limit(limit).to_list(limit)
+    return {"queries": [{"query": doc["_id"], **ctr_summary(doc, "searches")} for doc in docs]}
+
+@api_router.get("/search/top-queries")
+async def get_top_queries(
+    window: str = Query("day", pattern="^(hour|day|week)$", description="Look-back window"),
+    page_context: Optional[str] = Query(None, description="Filter by page context"),
+    limit: int = Query(10, ge=1, le=SEARCH_TOPK_CAPACITY, description="Number of queries to return")
+):
+    """Get the most frequent search queries for a recent window"""
+    hours = {"hour": 1, "day": 24, "week": 168}[window]
+    start = datetime.utcnow() - timedelta(hours=hours - 1)
+    queries = await query_heavy_hitters.top_queries(start, None, page_context, limit)
+    return {"window": window, "page_context": page_context, "queries": queries}
+
 @api_router.get("/search/analytics")
 async def get_search_analytics(
     start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
@@ -435,20 +4331,25 @@ async def get_search_analytics(
         query["search_timestamp"] = date_filter
     
     # Get search queries
-    searches = await db.search_queries.find(query).sort("search_timestamp", -1).limit(limit).to_list(limit)
+    searches = await profiled_find(
+        "get_search_analytics", db.search_queries, query, [("search_timestamp", -1)], limit=limit,
+        projection={"_id": 0, "meta": 0}
+    )
     
     # Calculate analytics
     total_searches = len(searches)
-    avg_response_time = sum(s.get("response_time_ms", 0) for s in searches if s.get("response_time_ms")) / max(1, len([s for s in searches if s.get("response_time_ms")]))
-    
-    # Most common queries
-    query_counts = {}
-    for search in searches:
-        query = search.get("query", "").lower().strip()
-        if query:
-            query_counts[query] = query_counts.get(query, 0) + 1
+    latency = await search_latency_summary(date_filter.get("$gte"), date_filter.get("$lte"))
+    avg_response_time = latency["avg_ms"]
+    if not latency["count"]:
+        # Logs written before the histograms existed only carry the stored field
+        timed = [s["response_time_ms"] for s in searches if s.get("response_time_ms")]
+        avg_response_time = sum(timed) / len(timed) if timed else 0
     
-    most_common_queries = sorted(query_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    # Most common queries over the whole window, not just the fetched documents
+    top_queries = await query_heavy_hitters.top_queries(
+        date_filter.get("$gte"), date_filter.get("$lte"), limit=10
+    )
+    most_common_queries = [(entry["query"], entry["count"]) for entry in top_queries]
     
     # Page context analytics
     page_contexts = {}
@@ -459,12 +4360,602 @@ async def get_search_analytics(
     return {
         "total_searches": total_searches,
         "avg_response_time_ms": avg_response_time,
+        "response_time_percentiles_ms": {key: latency[key] for key in ("p50", "p90", "p95", "p99")},
+        "response_time_by_page_context": latency["page_contexts"],
         "most_common_queries": most_common_queries,
         "page_contexts": page_contexts,
         "recent_searches": searches[:20]  # Last 20 searches
     }
 
+# Search funnels
+#
+# A leased background job folds newly settled search_queries (older than
+# SEARCH_FUNNEL_SETTLE_SECONDS, so result counts and clicks have arrived)
+# into per-session funnel rows, then recomputes the per-day rollups for the
+# days it touched. Progress is a search_timestamp watermark in ``watermarks``.
+#
+# Searches are folded in fixed SEARCH_FUNNEL_CHUNK_MINUTES chunks aligned to
+# the epoch, and each session row keeps its partial totals per chunk under
+# ``chunks``. A chunk is always recomputed from its start and replaces its
+# previous partial, so replaying a chunk after a crash between the merge and
+# the watermark write counts nothing twice; the session totals are derived
+# from the partials.
+
+SEARCH_FUNNEL_INTERVAL = float(os.environ.get("SEARCH_FUNNEL_INTERVAL", "300"))
+SEARCH_FUNNEL_SETTLE_SECONDS = int(os.environ.get("SEARCH_FUNNEL_SETTLE_SECONDS", "600"))
+SEARCH_FUNNEL_CHUNK_MINUTES = int(os.environ.get("SEARCH_FUNNEL_CHUNK_MINUTES", "60"))
+SEARCH_FUNNEL_MAX_CHAIN = 50
+
+
+def _dedupe_consecutive(array_expr) -> Dict[str, Any]:
+    return {"$reduce": {
+        "input": array_expr,
+        "initialValue": [],
+        "in": {"$cond": [
+            {"$eq": [{"$arrayElemAt": [{"$concatArrays": [[None], "$$value"]}, -1]}, "$$this"]},
+            "$$value",
+            {"$concatArrays": ["$$value", ["$$this"]]}
+        ]}
+    }}
+
+
+def _funnel_chunk_start(timestamp: datetime) -> datetime:
+    chunk = timedelta(minutes=SEARCH_FUNNEL_CHUNK_MINUTES)
+    return datetime(1970, 1, 1) + (timestamp - datetime(1970, 1, 1)) // chunk * chunk
+
+
+def _funnel_totals() -> Dict[str, Any]:
+    """Session totals derived from the per-chunk partials, in chunk order"""
+    partials = {"$map": {"input": {"$objectToArray": "$chunks"}, "in": "$$this.v"}}
+    return {"$let": {"vars": {"partials": partials}, "in": {
+        "first_search_at": {"$min": "$$partials.first_search_at"},
+        "last_search_at": {"$max": "$$partials.last_search_at"},
+        "searches": {"$sum": "$$partials.searches"},
+        "zero_result_searches": {"$sum": "$$partials.zero_result_searches"},
+        "clicked_searches": {"$sum": "$$partials.clicked_searches"},
+        "first_click_at": {"$min": "$$partials.first_click_at"},
+        "query_chain": {"$slice": [
+            _dedupe_consecutive({"$reduce": {
+                "input": "$$partials.query_chain",
+                "initialValue": [],
+                "in": {"$concatArrays": ["$$value", "$$this"]}
+            }}),
+            -SEARCH_FUNNEL_MAX_CHAIN
+        ]},
+        "page_contexts": {"$reduce": {
+            "input": "$$partials.page_contexts",
+            "initialValue": [],
+            "in": {"$setUnion": ["$$value", "$$this"]}
+        }},
+    }}}
+
+
+async def refresh_search_funnels() -> Dict[str, Any]:
+    """Process settled searches since the watermark, one chunk at a time so a backlog stays bounded"""
+    state = await db.watermarks.find_one({"_id": "search_funnels"})
+    if state:
+        start = state["search_timestamp"]
+    else:
+        oldest = await db.search_queries.find_one({}, {"search_timestamp": 1}, sort=[("search_timestamp", 1)])
+        if not oldest:
+            return {"sessions": 0, "days": 0}
+        start = oldest["search_timestamp"] - timedelta(microseconds=1)
+    end = datetime.utcnow() - timedelta(seconds=SEARCH_FUNNEL_SETTLE_SECONDS)
+
+    # Stay well inside the job lease; a large backlog continues on the next run
+    deadline = time.monotonic() + SEARCH_FUNNEL_INTERVAL / 2
+    totals = {"sessions": 0, "days": 0}
+    while start < end and time.monotonic() < deadline:
+        chunk_start = _funnel_chunk_start(start)
+        chunk_end = min(end, chunk_start + timedelta(minutes=SEARCH_FUNNEL_CHUNK_MINUTES))
+        processed = await _fold_search_funnels(chunk_start, chunk_end)
+        await db.watermarks.update_one(
+            {"_id": "search_funnels"}, {"$set": {"search_timestamp": chunk_end}}, upsert=True
+        )
+        totals["sessions"] += processed["sessions"]
+        totals["days"] += processed["days"]
+        start = chunk_end
+    return totals
+
+
+async def _fold_search_funnels(start: datetime, end: datetime) -> Dict[str, Any]:
+    chunk_key = start.strftime("%Y%m%dT%H%M")
+    window = {"search_timestamp": {"$gt": start, "$lte": end}, "session_id": {"$ne": None}}
+    sessions = await db.search_queries.distinct("session_id", window)
+    if not sessions:
+        return {"sessions": 0, "days": 0}
+
+    await db.search_queries.aggregate([
+        {"$match": window},
+        {"$lookup": {
+            "from": "search_events",
+            "let": {"search_id": "$id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$search_id", "$$search_id"]}, "event_type": "click"}},
+                {"$group": {"_id": None, "first_click_at": {"$min": "$timestamp"}}},
+            ],
+            "as": "clicks"
+        }},
+        {"$sort": {"search_timestamp": 1}},
+        {"$group": {
+            "_id": "$session_id",
+            "first_search_at": {"$min": "$search_timestamp"},
+            "last_search_at": {"$max": "$search_timestamp"},
+            "searches": {"$sum": 1},
+            "zero_result_searches": {"$sum": {"$cond": [{"$eq": ["$results_count", 0]}, 1, 0]}},
+            "clicked_searches": {"$sum": {"$cond": [{"$gt": [{"$size": "$clicks"}, 0]}, 1, 0]}},
+            "first_click_at": {"$min": {"$arrayElemAt": ["$clicks.first_click_at", 0]}},
+            "queries": {"$push": {"$toLower": {"$trim": {"input": {"$ifNull": ["$query", ""]}}}}},
+            "page_contexts": {"$addToSet": "$page_context"},
+        }},
+        {"$project": {"chunks": {chunk_key: {
+            "first_search_at": "$first_search_at",
+            "last_search_at": "$last_search_at",
+            "searches": "$searches",
+            "zero_result_searches": "$zero_result_searches",
+            "clicked_searches": "$clicked_searches",
+            "first_click_at": "$first_click_at",
+            "query_chain": _dedupe_consecutive("$queries"),
+            "page_contexts": "$page_contexts",
+        }}}},
+        {"$merge": {
+            "into": "session_funnels",
+            "on": "_id",
+            "whenMatched": [
+                # Replace this chunk's partial; rows written before partials existed keep their totals as one
+                {"$set": {"chunks": {"$mergeObjects": [
+                    {"$ifNull": ["$chunks", {"legacy": {
+                        "first_search_at": "$first_search_at",
+                        "last_search_at": "$last_search_at",
+                        "searches": "$searches",
+                        "zero_result_searches": "$zero_result_searches",
+                        "clicked_searches": "$clicked_searches",
+                        "first_click_at": "$first_click_at",
+                        "query_chain": "$query_chain",
+                        "page_contexts": "$page_contexts",
+                    }}]},
+                    "$$new.chunks"
+                ]}}}
+            ],
+            "whenNotMatched": "insert"
+        }},
+    ]).to_list(None)
+
+    # Totals and derived fields are recomputed for every touched session so they stay consistent after merges
+    await db.session_funnels.update_many({"_id": {"$in": sessions}}, [
+        {"$replaceWith": {"$mergeObjects": ["$$ROOT", _funnel_totals()]}},
+        {"$set": {
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$first_search_at"}},
+            "refinements": {"$max": [0, {"$subtract": [{"$size": "$query_chain"}, 1]}]},
+            "had_zero_results": {"$gt": ["$zero_result_searches", 0]},
+            "converted": {"$gt": ["$clicked_searches", 0]},
+            "time_to_first_click_ms": {"$cond": [
+                {"$eq": [{"$ifNull": ["$first_click_at", None]}, None]},
+                None,
+                {"$subtract": ["$first_click_at", "$first_search_at"]}
+            ]},
+            "updated_at": "$$NOW",
+        }}
+    ])
+
+    days = await db.session_funnels.distinct("day", {"_id": {"$in": sessions}})
+    await db.session_funnels.aggregate([
+        {"$match": {"day": {"$in": days}}},
+        {"$group": {
+            "_id": "$day",
+            "sessions": {"$sum": 1},
+            "searches": {"$sum": "$searches"},
+            "zero_result_searches": {"$sum": "$zero_result_searches"},
+            "sessions_with_zero_results": {"$sum": {"$cond": ["$had_zero_results", 1, 0]}},
+            "converted_sessions": {"$sum": {"$cond": ["$converted", 1, 0]}},
+            "refined_sessions": {"$sum": {"$cond": [{"$gt": ["$refinements", 0]}, 1, 0]}},
+            "avg_refinements": {"$avg": "$refinements"},
+            "avg_time_to_first_click_ms": {"$avg": "$time_to_first_click_ms"},
+        }},
+        {"$set": {
+            "zero_result_rate": {"$divide": ["$zero_result_searches", "$searches"]},
+            "conversion_rate": {"$divide": ["$converted_sessions", "$sessions"]},
+            "updated_at": "$$NOW",
+        }},
+        {"$merge": {"into": "daily_funnels", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]).to_list(None)
+    return {"sessions": len(sessions), "days": len(days)}
+
+@api_router.get("/search/funnels/daily")
+async def get_daily_funnels(
+    start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)")
+):
+    """Get precomputed daily search funnels"""
+    query: Dict[str, Any] = {}
+    if start_date or end_date:
+        query["_id"] = {}
+        if start_date:
+            query["_id"]["$gte"] = start_date
+        if end_date:
+            query["_id"]["$lte"] = end_date
+    docs = await db.daily_funnels.find(query).sort("_id", 1).to_list(None)
+    watermark = await db.watermarks.find_one({"_id": "search_funnels"}) or {}
+    return {
+        "days": [{"day": doc.pop("_id"), **doc} for doc in docs],
+        "processed_through": watermark.get("search_timestamp"),
+    }
+
+@api_router.get("/search/funnels/sessions/{session_id}")
+async def get_session_funnel(session_id: str):
+    """Get the precomputed funnel for one search session"""
+    doc = await db.session_funnels.find_one({"_id": session_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Session funnel not found")
+    doc.pop("chunks", None)
+    return {"session_id": doc.pop("_id"), **doc}
+
+# Saved searches
+#
+# Saved searches are percolated: each vessel write is matched against the
+# saved searches whose type, location, tags and price range could accept it,
+# found through an in-memory reverse index, and matches are stored as
+# notifications. Every worker keeps its own index and reloads it when the
+# ``saved_searches`` generation counter moves.
+
+SAVED_SEARCH_PRICE_BUCKETS = 48  # log2 daily_rate buckets
+SAVED_SEARCH_PATTERN_MAX_LENGTH = int(os.environ.get("SAVED_SEARCH_PATTERN_MAX_LENGTH", "100"))
+
+# Saved patterns run against every vessel write, so a pattern that can
+# backtrack catastrophically would stall the worker: repeated groups and
+# backreferences are refused when the search is saved.
+_unsafe_pattern = re.compile(r"\)[*+{]|\\[1-9]|\(\?P=")
+
+
+def saved_search_pattern_error(pattern: str) -> Optional[str]:
+    if len(pattern) > SAVED_SEARCH_PATTERN_MAX_LENGTH:
+        return f"longer than {SAVED_SEARCH_PATTERN_MAX_LENGTH} characters"
+    if _unsafe_pattern.search(pattern):
+        return "repeated groups and backreferences are not supported"
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return str(e)
+    return None
+
+
+def vessel_matches_plan(vessel: Dict[str, Any], plan: VesselSearchPlan) -> bool:
+    """Python equivalent of the get_vessels filters (sorting and paging are ignored), using the plan's regexes"""
+    params = plan.params
+    if plan.search_pattern:
+        texts = [vessel.get("vessel_name"), vessel.get("vessel_type"), vessel.get("location")]
+        texts += (vessel.get("tags") or []) + (vessel.get("features") or [])
+        if not any(isinstance(text, str) and plan.search_pattern.search(text) for text in texts):
+            return False
+    if params.vessel_type and vessel.get("vessel_type") != params.vessel_type:
+        return False
+    if plan.location_pattern and not plan.location_pattern.search(vessel.get("location") or ""):
+        return False
+    rate = vessel.get("daily_rate")
+    if params.min_daily_rate is not None and (rate is None or rate < params.min_daily_rate):
+        return False
+    if params.max_daily_rate is not None and (rate is None or rate > params.max_daily_rate):
+        return False
+    year_built = (vessel.get("specifications") or {}).get("year_built")
+    if params.min_year_built is not None and (year_built is None or year_built < params.min_year_built):
+        return False
+    if params.max_year_built is not None and (year_built is None or year_built > params.max_year_built):
+        return False
+    if params.availability_status and vessel.get("availability_status") != params.availability_status:
+        return False
+    if params.is_featured is not None and vessel.get("is_featured") != params.is_featured:
+        return False
+    if params.tags and not set(params.tags) & set(vessel.get("tags") or []):
+        return False
+    if params.features and not set(params.features) & set(vessel.get("features") or []):
+        return False
+    return True
+
+
+def price_bucket(rate: float) -> int:
+    return min(SAVED_SEARCH_PRICE_BUCKETS - 1, max(0, int(math.log2(rate)) if rate >= 1 else 0))
+
+
+class SavedSearchIndex:
+    """Reverse index from vessel attributes to the saved searches that may match them"""
+
+    def __init__(self):
+        self.searches: Dict[str, SavedSearch] = {}
+        self.plans: Dict[str, VesselSearchPlan] = {}  # saved search id -> compiled plan
+        self.by_type: Dict[str, set] = {}
+        self.by_location: Dict[str, set] = {}
+        self.location_patterns: Dict[str, re.Pattern] = {}
+        self.by_tag: Dict[str, set] = {}
+        self.by_price: List[set] = [set() for _ in range(SAVED_SEARCH_PRICE_BUCKETS)]
+        self.any_type: set = set()
+        self.any_location: set = set()
+        self.any_tag: set = set()
+        self.any_price: set = set()
+        self.generation: Optional[int] = None
+
+    def add(self, saved: SavedSearch):
+        params = saved.params
+        plan = self.plans[saved.id] = compile_vessel_plan(params.plan_key())
+        self.searches[saved.id] = saved
+        if params.vessel_type:
+            self.by_type.setdefault(params.vessel_type, set()).add(saved.id)
+        else:
+            self.any_type.add(saved.id)
+        if params.location:
+            # Matched the way vessel_matches_plan matches: with the plan's case-insensitive regex
+            self.location_patterns.setdefault(params.location, plan.location_pattern)
+            self.by_location.setdefault(params.location, set()).add(saved.id)
+        else:
+            self.any_location.add(saved.id)
+        for tag in params.tags or []:
+            self.by_tag.setdefault(tag, set()).add(saved.id)
+        if not params.tags:
+            self.any_tag.add(saved.id)
+        if params.min_daily_rate is None and params.max_daily_rate is None:
+            self.any_price.add(saved.id)
+        else:
+            low = price_bucket(params.min_daily_rate) if params.min_daily_rate is not None else 0
+            high = price_bucket(params.max_daily_rate) if params.max_daily_rate is not None else SAVED_SEARCH_PRICE_BUCKETS - 1
+            for bucket in range(low, high + 1):
+                self.by_price[bucket].add(saved.id)
+
+    def candidates(self, vessel: Dict[str, Any]) -> List[SavedSearch]:
+        location = vessel.get("location") or ""
+        rate = vessel.get("daily_rate")
+        dimensions = [
+            self.any_type | self.by_type.get(vessel.get("vessel_type"), set()),
+            # Saved locations are regex patterns; there are few distinct ones
+            self.any_location.union(*(
+                ids for pattern, ids in self.by_location.items() if self.location_patterns[pattern].search(location)
+            )),
+            self.any_tag.union(*(self.by_tag.get(tag, set()) for tag in vessel.get("tags") or [])),
+            self.any_price | (self.by_price[price_bucket(rate)] if rate is not None else set()),
+        ]
+        dimensions.sort(key=len)
+        ids = dimensions[0].intersection(*dimensions[1:])
+        return [self.searches[search_id] for search_id in ids]
+
+    async def refresh(self):
+        """Reload when another worker (or this one) changed the saved searches"""
+        counter = await db.counters.find_one({"_id": "saved_searches"}) or {}
+        generation = counter.get("generation", 0)
+        if generation == self.generation:
+            return
+        index = SavedSearchIndex()
+        async for doc in db.saved_searches.find({}, {"_id": 0}):
+            index.add(SavedSearch(**doc))
+        index.generation = generation
+        self.__dict__.update(index.__dict__)
+
+
+saved_search_index = SavedSearchIndex()
+
+
+async def bump_saved_search_generation():
+    await db.counters.update_one({"_id": "saved_searches"}, {"$inc": {"generation": 1}}, upsert=True)
+
+
+def saved_search_notification(
+    saved: SavedSearch, plan: VesselSearchPlan, change: "VesselChange"
+) -> Optional[SavedSearchNotification]:
+    after, before = change.after, change.before
+    if not vessel_matches_plan(after, plan):
+        return None
+    rate = after.get("daily_rate")
+    if before is None:
+        reason = "new"
+    elif not vessel_matches_plan(before, plan):
+        reason = "matched"
+    elif before.get("daily_rate") != rate:
+        reason = "repriced"
+    else:
+        return None
+    return SavedSearchNotification(
+        saved_search_id=saved.id,
+        owner_id=saved.owner_id,
+        vessel_id=after["id"],
+        reason=reason,
+        daily_rate=rate,
+        previous_daily_rate=before.get("daily_rate") if before else None,
+    )
+
+
+async def notify_saved_searches(changes: List["VesselChange"]):
+    await saved_search_index.refresh()
+    notifications = []
+    for change in changes:
+        if change.after is None:
+            continue
+        for saved in saved_search_index.candidates(change.after):
+            notification = saved_search_notification(saved, saved_search_index.plans[saved.id], change)
+            if notification:
+                notifications.append(notification.dict())
+    if notifications:
+        await db.notifications.insert_many(notifications, ordered=False)
+
+@api_router.post("/saved-searches", response_model=SavedSearch)
+async def create_saved_search(saved_search: SavedSearchCreate):
+    """Save a vessel search; new and repriced matches are delivered as notifications"""
+    for pattern in (saved_search.params.search, saved_search.params.location):
+        error = saved_search_pattern_error(pattern) if pattern else None
+        if error:
+            raise HTTPException(status_code=400, detail=f"Invalid search pattern: {error}")
+    saved = SavedSearch(**saved_search.dict())
+    await db.saved_searches.insert_one(saved.dict())
+    await bump_saved_search_generation()
+    return saved
+
+@api_router.get("/saved-searches", response_model=List[SavedSearch])
+async def list_saved_searches(owner_id: str = Query(..., description="Owner of the saved searches")):
+    """List an owner's saved searches"""
+    return await db.saved_searches.find({"owner_id": owner_id}, {"_id": 0}).sort("created_at", -1).to_list(None)
+
+@api_router.delete("/saved-searches/{search_id}")
+async def delete_saved_search(search_id: str):
+    """Delete a saved search"""
+    result = await db.saved_searches.delete_one({"id": search_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Saved search not found")
+    await bump_saved_search_generation()
+    return {"message": "Saved search deleted successfully"}
+
+@api_router.get("/notifications", response_model=List[SavedSearchNotification])
+async def get_notifications(
+    owner_id: str = Query(..., description="Owner of the saved searches"),
+    unread_only: bool = Query(False, description="Only return unread notifications"),
+    limit: int = Query(50, ge=1, le=500, description="Number of notifications to return")
+):
+    """Get saved search notifications, newest first"""
+    query: Dict[str, Any] = {"owner_id": owner_id}
+    if unread_only:
+        query["read"] = False
+    return await db.notifications.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
+@api_router.post("/notifications/read")
+async def mark_notifications_read(body: NotificationsRead):
+    """Mark an owner's notifications as read"""
+    result = await db.notifications.update_many(
+        {"id": {"$in": body.ids}, "owner_id": body.owner_id}, {"$set": {"read": True}}
+    )
+    return {"updated": result.modified_count}
+
 # Seed data endpoint for development
+SAMPLE_VESSELS = [
+    {
+        "vessel_name": "Ocean Pioneer PSV",
+        "vessel_type": "Platform Supply Vessel",
+        "location": "Aberdeen, Scotland",
+        "daily_rate": 15000,
+        "weekly_rate": 98000,
+        "monthly_rate": 420000,
+        "images": ["https://images.unsplash.com/photo-1568347877321-f8935c7dc5a3"],
+        "specifications": {
+            "length": 76,
+            "crew_capacity": 28,
+            "tonnage": 3200,
+            "year_built": 2018,
+            "deck_space": 650,
+            "fuel_capacity": 1200
+        },
+        "availability_status": "Available",
+        "rating": 4.8,
+        "total_reviews": 42,
+        "tags": ["DP2", "Offshore", "North Sea"],
+        "is_featured": True,
+        "discount_percentage": 15,
+        "features": ["Dynamic Positioning", "ROV Support", "Crane Capability", "Mud Tanks"],
+        "description": "Modern PSV with excellent safety record and experienced crew."
+    },
+    {
+        "vessel_name": "Atlantic Anchor AHTS",
+        "vessel_type": "Anchor Handling Tug Supply",
+        "location": "Houston, Texas",
+        "daily_rate": 22000,
+        "weekly_rate": 140000,
+        "monthly_rate": 600000,
+        "images": ["https://images.unsplash.com/photo-1609337231803-2adad48ea1d1"],
+        "specifications": {
+            "length": 89,
+            "crew_capacity": 35,
+            "tonnage": 4500,
+            "year_built": 2020,
+            "deck_space": 800
+        },
+        "availability_status": "Limited",
+        "rating": 4.9,
+        "total_reviews": 38,
+        "tags": ["DP3", "Heavy Lifting", "Gulf of Mexico"],
+        "features": ["Advanced DP System", "Heavy Anchor Handling", "Towing Capability"],
+        "description": "High-spec AHTS vessel perfect for demanding offshore operations."
+    },
+    {
+        "vessel_name": "Nordic Crew Boat",
+        "vessel_type": "Crew Transfer Vessel",
+        "location": "Stavanger, Norway",
+        "daily_rate": 8500,
+        "weekly_rate": 52000,
+        "monthly_rate": 220000,
+        "images": ["https://images.unsplash.com/photo-1601311852860-1d8f42381551"],
+        "specifications": {
+            "length": 42,
+            "crew_capacity": 60,
+            "tonnage": 450,
+            "year_built": 2019
+        },
+        "availability_status": "Available",
+        "rating": 4.6,
+        "total_reviews": 29,
+        "tags": ["High Speed", "Passenger", "North Sea"],
+        "features": ["High Speed Transfer", "Weather Protection", "Helipad"],
+        "description": "Fast and efficient crew transfer vessel for North Sea operations."
+    },
+    {
+        "vessel_name": "Deep Sea Constructor",
+        "vessel_type": "Construction Support Vessel",
+        "location": "Singapore",
+        "daily_rate": 35000,
+        "weekly_rate": 230000,
+        "monthly_rate": 980000,
+        "images": ["https://images.unsplash.com/photo-1568347877321-f8935c7dc5a3"],
+        "specifications": {
+            "length": 145,
+            "crew_capacity": 120,
+            "tonnage": 12000,
+            "year_built": 2017,
+            "deck_space": 2400
+        },
+        "availability_status": "Available",
+        "rating": 4.9,
+        "total_reviews": 56,
+        "tags": ["DP3", "Heavy Lift", "Construction"],
+        "is_featured": True,
+        "features": ["Heavy Lift Crane", "ROV Support", "Diving Support", "Large Deck"],
+        "description": "Specialized construction vessel for complex offshore projects."
+    },
+    {
+        "vessel_name": "Wind Farm Support",
+        "vessel_type": "Wind Farm Support Vessel",
+        "location": "Amsterdam, Netherlands",
+        "daily_rate": 18000,
+        "weekly_rate": 115000,
+        "monthly_rate": 490000,
+        "images": ["https://images.unsplash.com/photo-1568347877321-f8935c7dc5a3"],
+        "specifications": {
+            "length": 78,
+            "crew_capacity": 40,
+            "tonnage": 3800,
+            "year_built": 2021
+        },
+        "availability_status": "Available",
+        "rating": 4.7,
+        "total_reviews": 23,
+        "tags": ["DP2", "Wind Farm", "Green Energy"],
+        "features": ["Offshore Wind Support", "Walk-to-Work", "DP System"],
+        "description": "Modern vessel designed specifically for offshore wind operations."
+    },
+    {
+        "vessel_name": "Subsea Explorer",
+        "vessel_type": "Dive Support Vessel",
+        "location": "Rio de Janeiro, Brazil",
+        "daily_rate": 28000,
+        "weekly_rate": 180000,
+        "monthly_rate": 770000,
+        "images": ["https://images.unsplash.com/photo-1609337231803-2adad48ea1d1"],
+        "specifications": {
+            "length": 95,
+            "crew_capacity": 80,
+            "tonnage": 5200,
+            "year_built": 2016
+        },
+        "availability_status": "Available",
+        "rating": 4.8,
+        "total_reviews": 44,
+        "tags": ["DP3", "Saturation Diving", "ROV"],
+        "features": ["Saturation Diving", "ROV Operations", "Hyperbaric Chamber"],
+        "description": "Advanced dive support vessel for deep water operations."
+    }
+]
+
 @api_router.post("/vessels/seed")
 async def seed_vessels():
     """Seed the database with sample vessels for development"""
@@ -474,155 +4965,474 @@ async def seed_vessels():
     if count > 0:
         return {"message": f"Database already contains {count} vessels. Skipping seed."}
     
-    sample_vessels = [
-        {
-            "vessel_name": "Ocean Pioneer PSV",
-            "vessel_type": "Platform Supply Vessel",
-            "location": "Aberdeen, Scotland",
-            "daily_rate": 15000,
-            "weekly_rate": 98000,
-            "monthly_rate": 420000,
-            "images": ["https://images.unsplash.com/photo-1568347877321-f8935c7dc5a3"],
-            "specifications": {
-                "length": 76,
-                "crew_capacity": 28,
-                "tonnage": 3200,
-                "year_built": 2018,
-                "deck_space": 650,
-                "fuel_capacity": 1200
-            },
-            "availability_status": "Available",
-            "rating": 4.8,
-            "total_reviews": 42,
-            "tags": ["DP2", "Offshore", "North Sea"],
-            "is_featured": True,
-            "discount_percentage": 15,
-            "features": ["Dynamic Positioning", "ROV Support", "Crane Capability", "Mud Tanks"],
-            "description": "Modern PSV with excellent safety record and experienced crew."
-        },
-        {
-            "vessel_name": "Atlantic Anchor AHTS",
-            "vessel_type": "Anchor Handling Tug Supply",
-            "location": "Houston, Texas",
-            "daily_rate": 22000,
-            "weekly_rate": 140000,
-            "monthly_rate": 600000,
-            "images": ["https://images.unsplash.com/photo-1609337231803-2adad48ea1d1"],
-            "specifications": {
-                "length": 89,
-                "crew_capacity": 35,
-                "tonnage": 4500,
-                "year_built": 2020,
-                "deck_space": 800
-            },
-            "availability_status": "Limited",
-            "rating": 4.9,
-            "total_reviews": 38,
-            "tags": ["DP3", "Heavy Lifting", "Gulf of Mexico"],
-            "features": ["Advanced DP System", "Heavy Anchor Handling", "Towing Capability"],
-            "description": "High-spec AHTS vessel perfect for demanding offshore operations."
-        },
-        {
-            "vessel_name": "Nordic Crew Boat",
-            "vessel_type": "Crew Transfer Vessel",
-            "location": "Stavanger, Norway",
-            "daily_rate": 8500,
-            "weekly_rate": 52000,
-            "monthly_rate": 220000,
-            "images": ["https://images.unsplash.com/photo-1601311852860-1d8f42381551"],
-            "specifications": {
-                "length": 42,
-                "crew_capacity": 60,
-                "tonnage": 450,
-                "year_built": 2019
-            },
-            "availability_status": "Available",
-            "rating": 4.6,
-            "total_reviews": 29,
-            "tags": ["High Speed", "Passenger", "North Sea"],
-            "features": ["High Speed Transfer", "Weather Protection", "Helipad"],
-            "description": "Fast and efficient crew transfer vessel for North Sea operations."
-        },
-        {
-            "vessel_name": "Deep Sea Constructor",
-            "vessel_type": "Construction Support Vessel",
-            "location": "Singapore",
-            "daily_rate": 35000,
-            "weekly_rate": 230000,
-            "monthly_rate": 980000,
-            "images": ["https://images.unsplash.com/photo-1568347877321-f8935c7dc5a3"],
-            "specifications": {
-                "length": 145,
-                "crew_capacity": 120,
-                "tonnage": 12000,
-                "year_built": 2017,
-                "deck_space": 2400
-            },
-            "availability_status": "Available",
-            "rating": 4.9,
-            "total_reviews": 56,
-            "tags": ["DP3", "Heavy Lift", "Construction"],
-            "is_featured": True,
-            "features": ["Heavy Lift Crane", "ROV Support", "Diving Support", "Large Deck"],
-            "description": "Specialized construction vessel for complex offshore projects."
-        },
-        {
-            "vessel_name": "Wind Farm Support",
-            "vessel_type": "Wind Farm Support Vessel",
-            "location": "Amsterdam, Netherlands",
-            "daily_rate": 18000,
-            "weekly_rate": 115000,
-            "monthly_rate": 490000,
-            "images": ["https://images.unsplash.com/photo-1568347877321-f8935c7dc5a3"],
-            "specifications": {
-                "length": 78,
-                "crew_capacity": 40,
-                "tonnage": 3800,
-                "year_built": 2021
-            },
-            "availability_status": "Available",
-            "rating": 4.7,
-            "total_reviews": 23,
-            "tags": ["DP2", "Wind Farm", "Green Energy"],
-            "features": ["Offshore Wind Support", "Walk-to-Work", "DP System"],
-            "description": "Modern vessel designed specifically for offshore wind operations."
-        },
-        {
-            "vessel_name": "Subsea Explorer",
-            "vessel_type": "Dive Support Vessel",
-            "location": "Rio de Janeiro, Brazil",
-            "daily_rate": 28000,
-            "weekly_rate": 180000,
-            "monthly_rate": 770000,
-            "images": ["https://images.unsplash.com/photo-1609337231803-2adad48ea1d1"],
-            "specifications": {
-                "length": 95,
-                "crew_capacity": 80,
-                "tonnage": 5200,
-                "year_built": 2016
-            },
-            "availability_status": "Available",
-            "rating": 4.8,
-            "total_reviews": 44,
-            "tags": ["DP3", "Saturation Diving", "ROV"],
-            "features": ["Saturation Diving", "ROV Operations", "Hyperbaric Chamber"],
-            "description": "Advanced dive support vessel for deep water operations."
-        }
-    ]
-    
     # Create Vessel objects and insert them
     vessels_to_insert = []
-    for vessel_data in sample_vessels:
+    for vessel_data in SAMPLE_VESSELS:
         vessel_obj = Vessel(**vessel_data)
         vessels_to_insert.append(vessel_obj.dict())
     
     result = await db.vessels.insert_many(vessels_to_insert)
+    await on_vessels_changed()
     
     return {
         "message": f"Successfully seeded {len(result.inserted_ids)} vessels",
         "vessel_ids": [str(id) for id in result.inserted_ids]
     }
 
+# Synthetic fleet generation for scale testing
+#
+# Every distribution is derived from SAMPLE_VESSELS so the generated fleet has
+# the same types, locations, tags and rate ranges as the seed data, just more
+# of it. Output is fully determined by the seed and the end of the time window.
+
+SEARCH_PAGE_CONTEXTS = [("marketplace", 0.6), ("home", 0.3), ("vessel_detail", 0.1)]
+SEARCH_QUERY_TYPES = [("natural_language", 0.5), ("keyword", 0.35), ("filtered", 0.15)]
+SEARCH_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148",
+]
+
+
+def fleet_profile(samples: List[Dict[str, Any]] = SAMPLE_VESSELS) -> Dict[str, Any]:
+    """Distributions the generator samples from, taken from the seed vessels"""
+    tag_counts = Counter(tag for v in samples for tag in v.get("tags", []))
+    feature_counts = Counter(feature for v in samples for feature in v.get("features", []))
+    vocabulary = sorted(
+        {v["vessel_type"] for v in samples}
+        | {v["location"].split(",")[0] for v in samples}
+        | set(tag_counts)
+        | set(feature_counts)
+        | {f'{tag} {v["location"].split(",")[0]}' for v in samples for tag in v.get("tags", [])}
+    )
+    return {
+        "templates": samples,
+        "locations": [v["location"] for v in samples],
+        "tags": list(tag_counts),
+        "tag_weights": list(tag_counts.values()),
+        "features": list(feature_counts),
+        "feature_weights": list(feature_counts.values()),
+        "name_words": sorted({word for v in samples for word in v["vessel_name"].split()[:-1]}),
+        "featured_share": sum(1 for v in samples if v.get("is_featured")) / len(samples),
+        "search_vocabulary": vocabulary,
+    }
+
+
+def _weighted(rng: random.Random, choices: List[tuple]) -> Any:
+    return rng.choices([value for value, _ in choices], weights=[weight for _, weight in choices])[0]
+
+
+def _stable_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_vessels(count: int, seed: int = 42, end: Optional[datetime] = None, run_id: Optional[str] = None):
+    """Yield ``count`` realistic vessel documents
+
+    Ids come from their own generator salted with ``run_id``, so repeated
+    loads with one seed produce the same fleet under fresh ids.
+    """
+    rng = random.Random(seed)
+    id_rng = random.Random(f"{seed}:{run_id or ''}")
+    profile = fleet_profile()
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    for index in range(count):
+        template = rng.choice(profile["templates"])
+        scale = rng.lognormvariate(0, 0.25)
+        specs = {
+            key: round(value * rng.uniform(0.85, 1.15))
+            for key, value in (template.get("specifications") or {}).items()
+            if key != "year_built"
+        }
+        template_year = (template.get("specifications") or {}).get("year_built", end.year - 8)
+        specs["year_built"] = min(end.year, template_year + rng.randint(-12, 4))
+
+        tags = [tag for tag in template.get("tags", []) if rng.random() < 0.8]
+        if rng.random() < 0.4:
+            tags.append(rng.choices(profile["tags"], weights=profile["tag_weights"])[0])
+        features = [feature for feature in template.get("features", []) if rng.random() < 0.85]
+        if rng.random() < 0.3:
+            features.append(rng.choices(profile["features"], weights=profile["feature_weights"])[0])
+
+        created_at = end - timedelta(days=rng.uniform(0, 720))
+        vessel = Vessel(
+            id=_stable_uuid(id_rng),
+            vessel_name=f'{rng.choice(profile["name_words"])} {rng.choice(profile["name_words"])} {template["vessel_name"].split()[-1]} {index + 1}',
+            vessel_type=template["vessel_type"],
+            location=template["location"] if rng.random() < 0.7 else rng.choice(profile["locations"]),
+            daily_rate=round(template["daily_rate"] * scale, -2),
+            weekly_rate=round(template["weekly_rate"] * scale, -2),
+            monthly_rate=round(template["monthly_rate"] * scale, -3),
+            images=template.get("images", []),
+            specifications=specs,
+            availability_status=rng.choices(["Available", "Limited", "Booked"], weights=[0.7, 0.2, 0.1])[0],
+            rating=round(min(5.0, max(3.0, template.get("rating", 4.5) + rng.gauss(0, 0.25))), 1),
+            total_reviews=rng.randint(0, 120),
+            tags=list(dict.fromkeys(tags)),
+            is_featured=rng.random() < profile["featured_share"] / 4,
+            discount_percentage=rng.choice([None, None, 5, 10, 15]) if template.get("discount_percentage") else None,
+            features=list(dict.fromkeys(features)),
+            description=template.get("description"),
+            created_at=created_at,
+            updated_at=created_at,
+        ).dict()
+        vessel["synthetic"] = True
+        yield vessel
+
+
+def generate_search_logs(
+    count: int,
+    seed: int = 42,
+    days: int = 30,
+    end: Optional[datetime] = None,
+    run_id: Optional[str] = None
+):
+    """Yield ``count`` search log documents with Zipf-skewed query popularity
+
+    Search and session ids are salted with ``run_id`` like generate_vessels ids.
+    """
+    rng = random.Random(seed + 1)
+    id_rng = random.Random(f"{seed + 1}:{run_id or ''}")
+    profile = fleet_profile()
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    window = days * 86400
+
+    vocabulary = list(profile["search_vocabulary"])
+    rng.shuffle(vocabulary)
+    popularity = [1 / (rank + 1) ** 1.1 for rank in range(len(vocabulary))]
+    cumulative = []
+    running = 0.0
+    for weight in popularity:
+        running += weight
+        cumulative.append(running)
+
+    generated = 0
+    while generated < count:
+        session_id = _stable_uuid(id_rng)
+        user_ip = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        user_agent = rng.choice(SEARCH_USER_AGENTS)
+        page_context = _weighted(rng, SEARCH_PAGE_CONTEXTS)
+        timestamp = end - timedelta(seconds=rng.uniform(0, window))
+
+        for _ in range(min(count - generated, rng.randint(1, 5))):
+            query = rng.choices(vocabulary, cum_weights=cumulative)[0]
+            doc = search_log_document(SearchQuery(
+                id=_stable_uuid(id_rng),
+                query=query if rng.random() < 0.7 else query.lower(),
+                query_type=_weighted(rng, SEARCH_QUERY_TYPES),
+                user_ip=user_ip,
+                user_agent=user_agent,
+                page_context=page_context,
+                search_timestamp=timestamp,
+                response_time_ms=round(rng.lognormvariate(4.6, 0.5), 1),
+                results_count=0 if rng.random() < 0.08 else rng.randint(1, 50),
+                session_id=session_id,
+            ))
+            doc["synthetic"] = True
+            yield doc
+            generated += 1
+            timestamp += timedelta(seconds=rng.uniform(3, 90))
+
+
+async def _insert_batches(collection, documents, batch_size: int, progress=None) -> int:
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            await collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+            if progress:
+                await progress(inserted)
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def _track_search_logs(docs):
+    for doc in docs:
+        query_heavy_hitters.record(doc["query"], doc.get("page_context"), doc["search_timestamp"])
+        if doc.get("response_time_ms") is not None:
+            doc["latency_counted"] = True
+            search_event_buffer.record_latency(doc.get("page_context"), doc["search_timestamp"], doc["response_time_ms"])
+        yield doc
+
+
+async def load_synthetic_fleet(
+    vessels: int,
+    searches: int = 0,
+    seed: int = 42,
+    days: int = 30,
+    batch_size: int = 5000,
+    clear: bool = False,
+    progress=None
+) -> Dict[str, Any]:
+    """Bulk-load a generated fleet and search log through batched insert_many
+
+    ``progress(done, total, message)`` is awaited after every batch when given.
+    """
+    end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    if clear:
+        await db.vessels.delete_many({"synthetic": True})
+        await db.search_queries.delete_many({"synthetic": True})
+
+    started = datetime.utcnow()
+    total = vessels + searches
+
+    def reporter(message: str, offset: int):
+        if progress is None:
+            return None
+
+        async def report(done: int):
+            await progress(offset + done, total, message)
+        return report
+
+    run_id = uuid.uuid4().hex
+    vessel_count = await _insert_batches(
+        db.vessels, generate_vessels(vessels, seed, end, run_id=run_id), batch_size, reporter("vessels", 0)
+    )
+    await on_vessels_changed()
+    search_count = await _insert_batches(
+        db.search_queries, _track_search_logs(generate_search_logs(searches, seed, days, end, run_id=run_id)), batch_size,
+        reporter("search logs", vessel_count)
+    )
+    await query_heavy_hitters.persist()
+    await search_event_buffer.flush()
+    return {
+        "vessels_inserted": vessel_count,
+        "searches_inserted": search_count,
+        "seed": seed,
+        "elapsed_seconds": (datetime.utcnow() - started).total_seconds(),
+    }
+
+@api_router.post("/vessels/generate", response_model=Job, status_code=202)
+async def generate_synthetic_fleet(
+    vessels: int = Query(1000, ge=0, le=1_000_000, description="Number of vessels to generate"),
+    searches: int = Query(0, ge=0, le=50_000_000, description="Number of search log entries to generate"),
+    seed: int = Query(42, description="Random seed; the same seed produces the same data under fresh ids"),
+    days: int = Query(30, ge=1, description="Spread search logs over this many days"),
+    batch_size: int = Query(5000, ge=100, le=100_000, description="Documents per insert_many"),
+    clear: bool = Query(False, description="Delete previously generated data first")
+):
+    """Queue generation of a synthetic fleet and search log for scale testing"""
+    return await job_runner.submit("generate-fleet", {
+        "vessels": vessels,
+        "searches": searches,
+        "seed": seed,
+        "days": days,
+        "batch_size": batch_size,
+        "clear": clear,
+    }, max_attempts=1)
+
+# Jobs
+
+@job_handler("generate-fleet")
+async def generate_fleet_job(
+    job: JobContext,
+    vessels: int = 1000,
+    searches: int = 0,
+    seed: int = 42,
+    days: int = 30,
+    batch_size: int = 5000,
+    clear: bool = False
+):
+    return await load_synthetic_fleet(vessels, searches, seed, days, batch_size, clear, progress=job.progress)
+
+@job_handler("migrate-search-log")
+async def migrate_search_log_job(job: JobContext, batch_size: int = 1000, drop_legacy: bool = False):
+    return await migrate_search_log(batch_size, drop_legacy)
+
+@job_handler("process-images")
+async def process_images_job(job: JobContext):
+    return await process_local_originals()
+
+@job_handler("recompute-price-histograms")
+async def recompute_price_histograms_job(job: JobContext):
+    return {"histograms": await recompute_price_histograms()}
+
+@job_handler("refresh-search-funnels")
+async def refresh_search_funnels_job(job: JobContext):
+    return await refresh_search_funnels()
+
+@api_router.post("/jobs", response_model=Job, status_code=202)
+async def submit_job(job_request: JobCreate):
+    """Queue a background job; poll GET /jobs/{id} for progress"""
+    return await job_runner.submit(job_request.kind, job_request.params, job_request.max_attempts)
+
+@api_router.get("/jobs", response_model=List[Job])
+async def list_jobs(
+    status: Optional[str] = Query(None, description="Filter by status: queued, running, succeeded, failed, cancelled"),
+    kind: Optional[str] = Query(None, description="Filter by job kind"),
+    limit: int = Query(50, ge=1, le=500, description="Number of jobs to return")
+):
+    """List recent jobs, newest first"""
+    query = {}
+    if status:
+        query["status"] = status
+    if kind:
+        query["kind"] = kind
+    return await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    """Get a job's status, progress and result"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=Job)
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or ask the worker running it to stop"""
+    now = datetime.utcnow()
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now, "updated_at": now}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    ) or await db.jobs.find_one_and_update(
+        {"id": job_id, "status": "running"},
+        {"$set": {"cancel_requested": True, "updated_at": now}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}")
+    task = job_runner.running.get(job_id)
+    if task is not None:
+        task.cancel()
+    return job
+
+# Startup and readiness
+#
+# The lifespan handler connects, ensures indexes and warms the hot read paths
+# before /ready reports ready, timing each phase so cold-start regressions
+# show up in the logs and in the /ready payload.
+
+startup_state: Dict[str, Any] = {"ready": False, "phases": {}}
+
+
+@asynccontextmanager
+async def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        startup_state["phases"][name] = elapsed_ms
+        logger.info("Startup phase %s took %.1f ms", name, elapsed_ms)
+
+
+async def warm_up():
+    """Prime the reference data and the default vessel page"""
+    if reference_snapshots:
+        await reference_snapshots.ensure_fresh()
+    await get_reference_data()
+    await db.vessels.find({}).sort([("is_featured", -1), ("rating", -1)]).limit(50).to_list(50)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with startup_phase("connect"):
+        connect_db()
+        await client.admin.command("ping")
+    async with startup_phase("indexes"):
+        await ensure_indexes()
+    async with startup_phase("warmup"):
+        await warm_up()
+    async with startup_phase("background"):
+        search_event_buffer.start()
+        query_heavy_hitters.start()
+        trace_exporter.start()
+        spawn(run_periodically(
+            "price_histograms",
+            PRICE_HISTOGRAM_RECOMPUTE_INTERVAL,
+            recompute_price_histograms,
+            run_immediately=await db.price_histograms.estimated_document_count() == 0
+        ))
+        spawn(run_periodically("search_funnels", SEARCH_FUNNEL_INTERVAL, refresh_search_funnels))
+        spawn(run_periodically("query_sketch_fold", SEARCH_TOPK_FOLD_INTERVAL, query_heavy_hitters.fold))
+        spawn(suggestion_index.rebuild())
+        spawn(similarity_index.rebuild())
+        job_runner.start()
+        if VESSEL_FEED_ENABLED:
+            vessel_feed.add_listener(suggestion_index.on_feed_event)
+            vessel_feed.add_listener(similarity_index.on_feed_event)
+            vessel_feed.start()
+            if VESSEL_CATALOG_ENABLED:
+                vessel_feed.add_listener(vessel_catalog.on_feed_event)
+                vessel_catalog.start()
+    startup_state["ready"] = True
+    logger.info("Ready after %.1f ms", sum(startup_state["phases"].values()))
+
+    yield
+
+    startup_state["ready"] = False
+    for task in list(background_tasks):
+        task.cancel()
+    await job_runner.stop()
+    await vessel_catalog.stop()
+    await vessel_feed.stop()
+    await search_event_buffer.stop()
+    await query_heavy_hitters.stop()
+    await trace_exporter.stop()
+    shutdown_image_pool()
+    close_db()
+
+# Create the main app without a prefix
+app = FastAPI(lifespan=lifespan, default_response_class=TracedJSONResponse)
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe; 503 until startup has finished warming up"""
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=startup_state)
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Shed load before it queues up behind the Mongo connection pool"""
+    if request.url.path == "/ready":
+        return await call_next(request)
+    if admission_state["in_flight"] >= ADMISSION_MAX_IN_FLIGHT or pool_wait_monitor.wait_ms > ADMISSION_MAX_POOL_WAIT_MS:
+        admission_state["shed"] += 1
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, retry shortly"},
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+        )
+    admission_state["in_flight"] += 1
+    try:
+        return await call_next(request)
+    finally:
+        admission_state["in_flight"] -= 1
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Trace the request; export when sampled, slow or failed"""
+    match = _traceparent.match(request.headers.get("traceparent", ""))
+    trace = Trace(*match.groups()[:2], sampled=match.group(3) == "01") if match else Trace()
+    trace_token = current_trace.set(trace)
+    span = Span(trace, f"{request.method} {request.url.path}", trace.parent_id, {"http.method": request.method})
+    span.__enter__()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Trace-Id"] = trace.trace_id
+        return response
+    finally:
+        span.__exit__(None, None, None)
+        span.attributes["http.status_code"] = status_code
+        current_trace.reset(trace_token)
+        elapsed_ms = (span.end_ns - span.start_ns) / 1e6
+        if trace.sampled or elapsed_ms >= TRACE_SLOW_MS or status_code >= 500:
+            trace_exporter.submit(trace)
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -641,6 +5451,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maritime marketplace backend maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate-search-log", help="Move search_queries into the time-series layout")
+    migrate.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many")
+    migrate.add_argument("--drop-legacy", action="store_true", help="Drop search_queries_legacy when done")
+
+    generate = commands.add_parser("generate-fleet", help="Bulk-load a synthetic fleet and search log")
+    generate.add_argument("--vessels", type=int, default=1000, help="Number of vessels to generate")
+    generate.add_argument("--searches", type=int, default=0, help="Number of search log entries to generate")
+    generate.add_argument("--seed", type=int, default=42, help="Random seed")
+    generate.add_argument("--days", type=int, default=30, help="Spread search logs over this many days")
+    generate.add_argument("--batch-size", type=int, default=5000, help="Documents per insert_many")
+    generate.add_argument("--clear", action="store_true", help="Delete previously generated data first")
+
+    images = commands.add_parser("process-images", help="Generate thumbnails for locally stored originals")
+    images.add_argument("--path", type=Path, default=None, help="Import image files from this directory first")
+
+    suggestions = commands.add_parser("benchmark-suggestions", help="Time fuzzy suggestion lookups")
+    suggestions.add_argument("--terms", type=int, default=100_000, help="Synthetic vocabulary size")
+    suggestions.add_argument("--queries", type=int, default=2_000, help="Number of misspelled lookups")
+    suggestions.add_argument("--seed", type=int, default=7, help="Random seed")
+
+    catalog = commands.add_parser("benchmark-catalog", help="Compare MongoDB and in-memory catalog search latency")
+    catalog.add_argument("--queries", type=int, default=500, help="Number of sample searches")
+    catalog.add_argument("--limit", type=int, default=50, help="Page size")
+    catalog.add_argument("--seed", type=int, default=7, help="Random seed")
+
+    args = parser.parse_args()
+    if args.command == "benchmark-suggestions":
+        print(json.dumps(benchmark_suggestions(args.terms, args.queries, args.seed)))
+        return
+    connect_db()
+
+    if args.command == "migrate-search-log":
+        result = asyncio.run(migrate_search_log(args.batch_size, args.drop_legacy))
+    elif args.command == "process-images":
+        result = asyncio.run(process_local_originals(args.path))
+    elif args.command == "benchmark-catalog":
+        result = asyncio.run(benchmark_catalog(args.queries, args.limit, args.seed))
+    elif args.command == "generate-fleet":
+        async def generate_fleet():
+            # Vessel write hooks run as background tasks that asyncio.run would cancel
+            loaded = await load_synthetic_fleet(
+                args.vessels, args.searches, args.seed, args.days, args.batch_size, args.clear
+            )
+            await drain_background_tasks()
+            return loaded
+        result = asyncio.run(generate_fleet())
+
+    print(json.dumps(result, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ class MaritimeMarketplaceTester:
         self.tests_run = 0
         self.tests_passed = 0
         self.created_vessel_id = None
+        self.logged_search_id = None
 
     def run_test(self, name, endpoint="", expected_status=200, method="GET", data=None, check_json=True, params=None):
         """Run a single test against the backend API"""
@@ -76,6 +77,23 @@ class MaritimeMarketplaceTester:
                 print(f"Message: {data['message']}")
         return success, data
 
+    def test_ready(self):
+        """Test the readiness endpoint reports ready with startup phase timings"""
+        self.tests_run += 1
+        print("\n🔍 Testing Readiness Endpoint...")
+        try:
+            response = requests.get(f"{self.base_url}/ready")
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False, None
+        data = response.json() if response.status_code in (200, 503) else None
+        if response.status_code == 200 and data and data.get("ready"):
+            self.tests_passed += 1
+            print(f"✅ Passed - Startup phases: {data.get('phases')}")
+            return True, data
+        print(f"❌ Failed - Status {response.status_code}")
+        return False, data
+
     def test_status_check_create(self):
         """Test creating a status check"""
         test_data = {
@@ -197,6 +215,121 @@ class MaritimeMarketplaceTester:
             print(f"Vessel with ID {self.created_vessel_id} retrieved successfully")
         return success, data
     
+    def test_vessel_quotes(self):
+        """Test charter quotes and sorting vessels by quoted total"""
+        success, response, data = self.run_test(
+            "Get Vessels Sorted By Quote", "vessels", params={"sort_by": "quote", "days": 45, "limit": 5}
+        )
+        if success and data:
+            totals = [vessel["quote"]["total"] for vessel in data]
+            print(f"45-day quotes: {totals}")
+            if totals != sorted(totals):
+                print("❌ Quotes are not in ascending order")
+                return False, data
+            success, response, quote = self.run_test(
+                "Get Vessel Quote", f"vessels/{data[0]['id']}/quote", params={"days": 10}
+            )
+            return success, quote
+        return success, data
+
+    def test_trace_id_header(self):
+        """Test that responses carry the trace id of a propagated traceparent"""
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        success, response, data = self.run_test("Get Vessels Traced", "vessels", params={"limit": 1})
+        if success:
+            response = requests.get(
+                f"{self.api_url}/vessels",
+                params={"limit": 1},
+                headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+            )
+            print(f"X-Trace-Id: {response.headers.get('X-Trace-Id')}")
+            if response.headers.get("X-Trace-Id") != trace_id:
+                print("❌ Trace id was not propagated")
+                return False, data
+        return success, data
+
+    def test_search_plan_canonical(self):
+        """Test that equivalent searches share one compiled query plan"""
+        success, first, data = self.run_test(
+            "Get Vessels Plan", "vessels", params={"tags": "DP2,North Sea", "limit": 1}
+        )
+        if not success:
+            return False, data
+        success, second, data = self.run_test(
+            "Get Vessels Plan Reordered", "vessels", params={"tags": " North Sea, DP2", "limit": 1}
+        )
+        if success:
+            print(f"Plans: {first.headers.get('X-Search-Plan')} / {second.headers.get('X-Search-Plan')}")
+            if first.headers.get("X-Search-Plan") != second.headers.get("X-Search-Plan"):
+                print("❌ Equivalent searches got different plans")
+                return False, data
+        return success, data
+
+    def test_catalog_status(self):
+        """Test the in-memory vessel catalog status and consistency check"""
+        success, response, data = self.run_test("Get Catalog Status", "admin/catalog")
+        if success and data and data.get("ready"):
+            success, response, check = self.run_test(
+                "Check Catalog Consistency", "admin/catalog/check", method="POST"
+            )
+            if success and not check.get("consistent"):
+                print(f"❌ Catalog differs from MongoDB: {check}")
+                return False, check
+            return success, check
+        return success, data
+
+    def test_get_similar_vessels(self):
+        """Test the similar vessels endpoint"""
+        if not self.created_vessel_id:
+            print("❌ No vessel ID available for testing")
+            return False, None
+        success, response, data = self.run_test(
+            "Get Similar Vessels", f"vessels/{self.created_vessel_id}/similar", params={"limit": 3}
+        )
+        if success and data is not None:
+            print(f"Similar vessels: {[vessel['vessel_name'] for vessel in data]}")
+        return success, data
+
+    def test_get_vessels_batch(self):
+        """Test fetching several vessels by id in one request"""
+        if not self.created_vessel_id:
+            print("❌ No vessel ID available for testing")
+            return False, None
+
+        params = {"ids": f"{self.created_vessel_id},missing-vessel-id", "fields": "vessel_name,daily_rate"}
+        success, response, data = self.run_test(
+            "Get Vessels Batch",
+            "vessels/batch",
+            params=params
+        )
+        if success and data:
+            if data.get("missing") != ["missing-vessel-id"]:
+                print(f"❌ Expected missing id to be reported, got {data.get('missing')}")
+                return False, data
+            print(f"Retrieved {len(data.get('vessels', []))} vessels in batch")
+        return success, data
+    
+    def test_vessel_stream(self):
+        """Test that the live vessel update stream opens (requires a replica set)"""
+        url = f"{self.api_url}/vessels/stream"
+        self.tests_run += 1
+        print(f"\n🔍 Testing Vessel Update Stream...\nURL: {url}")
+        try:
+            with requests.get(url, stream=True, timeout=10) as response:
+                if response.status_code != 200:
+                    print(f"❌ Failed - Expected status 200, got {response.status_code}")
+                    return False, None
+                first_line = next(response.iter_lines(decode_unicode=True))
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False, None
+        if first_line.startswith("retry:"):
+            self.tests_passed += 1
+            print("✅ Passed - Stream opened")
+            return True, first_line
+        print(f"❌ Failed - Unexpected first line: {first_line}")
+        return False, first_line
+    
     def test_create_vessel(self):
         """Test creating a new vessel"""
         test_data = {
@@ -254,6 +387,93 @@ class MaritimeMarketplaceTester:
             print(f"Vessel with ID {self.created_vessel_id} updated successfully")
         return success, data
     
+    def test_bulk_update_vessels(self):
+        """Test repricing vessels through the bulk endpoint"""
+        if not self.created_vessel_id:
+            print("❌ No vessel ID available for testing")
+            return False, None
+
+        test_data = {
+            "items": [
+                {"id": self.created_vessel_id, "update": {"daily_rate": 12500, "availability_status": "Limited"}},
+                {"id": "missing-vessel-id", "update": {"daily_rate": 1}}
+            ]
+        }
+        success, response, data = self.run_test(
+            "Bulk Update Vessels",
+            "vessels/bulk",
+            method="POST",
+            data=test_data
+        )
+        if success and data:
+            statuses = [result["status"] for result in data.get("results", [])]
+            if statuses != ["updated", "not_found"]:
+                print(f"❌ Unexpected per-item outcomes: {statuses}")
+                return False, data
+        return success, data
+    
+    def test_saved_search(self):
+        """Test saving a search and reading its notifications"""
+        test_data = {
+            "owner_id": "backend-test-broker",
+            "name": "PSVs in the North Sea",
+            "params": {"vessel_type": "Platform Supply Vessel", "tags": ["North Sea"], "max_daily_rate": 50000}
+        }
+        success, response, data = self.run_test("Create Saved Search", "saved-searches", method="POST", data=test_data)
+        if not success:
+            return success, data
+        success, response, notifications = self.run_test(
+            "Get Notifications", "notifications", params={"owner_id": "backend-test-broker"}
+        )
+        if success:
+            print(f"Retrieved {len(notifications or [])} notifications")
+        self.run_test("Delete Saved Search", f"saved-searches/{data['id']}", method="DELETE")
+        return success, notifications
+
+    def test_saved_search_regex_location(self):
+        """Test that a saved search with a regex location is notified of a matching vessel"""
+        owner_id = "backend-test-regex-broker"
+        success, response, saved = self.run_test(
+            "Create Regex Saved Search", "saved-searches", method="POST",
+            data={"owner_id": owner_id, "name": "Aberdeen or Stavanger", "params": {"location": "aberdeen|stavanger"}}
+        )
+        if not success:
+            return success, saved
+        vessel = {
+            "vessel_name": "Regex Location Test Vessel",
+            "vessel_type": "Test Vessel Type",
+            "location": "Aberdeen, Scotland",
+            "daily_rate": 12000,
+            "weekly_rate": 80000,
+            "monthly_rate": 330000,
+            "specifications": {"length": 60, "year_built": 2020},
+        }
+        success, response, created = self.run_test("Create Regex Match Vessel", "vessels", method="POST", data=vessel)
+        matched = []
+        if success:
+            for _ in range(10):
+                success, response, notifications = self.run_test(
+                    "Get Regex Notifications", "notifications", params={"owner_id": owner_id}
+                )
+                matched = [n for n in notifications or [] if n["saved_search_id"] == saved["id"]]
+                if not success or matched:
+                    break
+                time.sleep(1)
+            self.run_test("Delete Regex Match Vessel", f"vessels/{created['id']}", method="DELETE")
+        self.run_test("Delete Regex Saved Search", f"saved-searches/{saved['id']}", method="DELETE")
+        if success and not matched:
+            print("❌ Regex location saved search was not notified")
+            return False, matched
+        return success, matched
+
+    def test_saved_search_unsafe_pattern(self):
+        """Test that a saved search with a backtracking-prone pattern is rejected"""
+        success, response, data = self.run_test(
+            "Reject Unsafe Saved Search", "saved-searches", expected_status=400, method="POST",
+            data={"owner_id": "backend-test-broker", "params": {"search": "(a+)+$"}}, check_json=False
+        )
+        return success, data
+
     def test_delete_vessel(self):
         """Test deleting a vessel"""
         if not self.created_vessel_id:
@@ -282,6 +502,18 @@ class MaritimeMarketplaceTester:
             if data and "suggestions" in data:
                 print(f"Retrieved {len(data['suggestions'])} suggestions")
         return success, data
+
+    def test_fuzzy_search_suggestions(self):
+        """Test that misspelled queries still get suggestions"""
+        success, response, data = self.run_test(
+            "Get Fuzzy Search Suggestions",
+            "vessels/search/suggestions",
+            params={"q": "anchr handlng"}
+        )
+        if success and data:
+            values = [suggestion["value"] for suggestion in data.get("suggestions", [])]
+            print(f"Suggestions for 'anchr handlng': {values}")
+        return success, data
     
     def test_get_vessel_types(self):
         """Test getting all vessel types"""
@@ -319,6 +551,94 @@ class MaritimeMarketplaceTester:
                 print(f"Retrieved {len(data['features'])} features")
         return success, data
 
+    def test_price_histogram(self):
+        """Test the daily rate histogram used by the price slider"""
+        success, response, data = self.run_test("Get Price Histogram", "vessels/rates/histogram")
+        if success and data:
+            print(f"Retrieved {len(data.get('buckets', []))} buckets covering {data.get('total')} vessels")
+        return success, data
+
+    def test_jobs(self):
+        """Test queueing a background job and polling it"""
+        success, response, data = self.run_test(
+            "Submit Job", "jobs", expected_status=202, method="POST", data={"kind": "recompute-price-histograms"}
+        )
+        if not success or not data:
+            return success, data
+        for _ in range(10):
+            success, response, job = self.run_test("Get Job", f"jobs/{data['id']}")
+            if not success or job["status"] in ("succeeded", "failed", "cancelled"):
+                break
+            time.sleep(1)
+        if success:
+            print(f"Job {data['id']} is {job['status']}")
+        return success, job
+
+    # Search Logging Tests
+
+    def test_log_search(self):
+        """Test logging a search query"""
+        test_data = {
+            "query": "DP2 North Sea",
+            "query_type": "keyword",
+            "page_context": "marketplace",
+            "session_id": "backend-test-session"
+        }
+        success, response, data = self.run_test(
+            "Log Search Query",
+            "search/log",
+            method="POST",
+            data=test_data
+        )
+        if success and data and "id" in data:
+            self.logged_search_id = data["id"]
+            print(f"Logged search with ID: {self.logged_search_id}")
+        return success, data
+
+    def test_top_queries(self):
+        """Test the streaming top search queries endpoint"""
+        success, response, data = self.run_test(
+            "Get Top Queries", "search/top-queries", params={"window": "day", "limit": 5}
+        )
+        if success and data:
+            print(f"Top queries: {[entry['query'] for entry in data.get('queries', [])]}")
+        return success, data
+
+    def test_daily_funnels(self):
+        """Test the precomputed daily search funnels endpoint"""
+        success, response, data = self.run_test("Get Daily Funnels", "search/funnels/daily")
+        if success and data:
+            print(f"Retrieved {len(data.get('days', []))} funnel days, processed through {data.get('processed_through')}")
+        return success, data
+
+    def test_search_click_ctr(self):
+        """Test logging impressions and a click, then reading vessel CTR"""
+        if not self.logged_search_id or not self.created_vessel_id:
+            print("❌ No search or vessel ID available for testing")
+            return False, None
+
+        success1, _, _ = self.run_test(
+            "Log Search Impressions",
+            f"search/log/{self.logged_search_id}/impressions",
+            method="PUT",
+            data={"vessel_ids": [self.created_vessel_id]}
+        )
+        url = f"{self.api_url}/search/log/{self.logged_search_id}/click"
+        self.tests_run += 1
+        response = requests.put(url, params={"clicked_vessel_id": self.created_vessel_id})
+        success2 = response.status_code == 200
+        if success2:
+            self.tests_passed += 1
+            print("✅ Passed - Click logged")
+        else:
+            print(f"❌ Failed - Click returned {response.status_code}")
+
+        success3, _, data = self.run_test(
+            "Get Vessel CTR",
+            f"search/ctr/vessels/{self.created_vessel_id}"
+        )
+        return all([success1, success2, success3]), data
+
 def main():
     print("🚢 Testing Maritime Marketplace Backend API 🚢")
     
@@ -328,6 +648,7 @@ def main():
     
     # Test API root endpoint
     api_root_success, _ = tester.test_api_root()
+    ready_success, _ = tester.test_ready()
     
     # Test status check endpoints
     status_create_success, created_status = tester.test_status_check_create()
@@ -345,17 +666,38 @@ def main():
     
     # Test getting a specific vessel
     get_vessel_by_id_success, _ = tester.test_get_vessel_by_id()
+    get_vessels_batch_success, _ = tester.test_get_vessels_batch()
+    similar_vessels_success, _ = tester.test_get_similar_vessels()
+    vessel_quotes_success, _ = tester.test_vessel_quotes()
+    trace_id_success, _ = tester.test_trace_id_header()
+    catalog_success, _ = tester.test_catalog_status()
+    search_plan_success, _ = tester.test_search_plan_canonical()
+    vessel_stream_success, _ = tester.test_vessel_stream()
     
     # Test CRUD operations
     create_vessel_success, _ = tester.test_create_vessel()
     update_vessel_success, _ = tester.test_update_vessel()
+    bulk_update_success, _ = tester.test_bulk_update_vessels()
+    saved_search_success, _ = tester.test_saved_search()
+    saved_search_regex_success, _ = tester.test_saved_search_regex_location()
+    saved_search_unsafe_success, _ = tester.test_saved_search_unsafe_pattern()
     
     # Test search suggestions and metadata endpoints
     search_suggestions_success, _ = tester.test_search_suggestions()
+    fuzzy_suggestions_success, _ = tester.test_fuzzy_search_suggestions()
     get_vessel_types_success, _ = tester.test_get_vessel_types()
     get_locations_success, _ = tester.test_get_locations()
     get_tags_success, _ = tester.test_get_tags()
     get_features_success, _ = tester.test_get_features()
+    price_histogram_success, _ = tester.test_price_histogram()
+    jobs_success, _ = tester.test_jobs()
+    
+    # Test search logging and click tracking
+    print("\n🔎 Testing Search Logging Endpoints 🔎")
+    log_search_success, _ = tester.test_log_search()
+    search_click_ctr_success, _ = tester.test_search_click_ctr()
+    top_queries_success, _ = tester.test_top_queries()
+    daily_funnels_success, _ = tester.test_daily_funnels()
     
     # Finally, test deleting a vessel
     delete_vessel_success, _ = tester.test_delete_vessel()